@@ -12,12 +12,42 @@ import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 
-import board_manager.routing
-
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'CodeDocs_backend.settings')
 
-application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+# sets Django up before the consumers and their models are imported
+django_application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+import board_manager.routing  # noqa: E402
+from authentication.outbox import outbox_sender  # noqa: E402
+from board_manager.jobs import job_runner  # noqa: E402
+from board_manager.text_editing import text_documents  # noqa: E402
+from board_manager.workers import worker_registry  # noqa: E402
+from .warmup import warmup  # noqa: E402
+
+
+class ServerRouter(ProtocolTypeRouter):
+    """
+    Starts the warm-up, the job workers, the email sender, the saving of edited texts and the heartbeats
+    with the first connection to the server, e.g. the readiness probe, not on import,
+    so tests using the protocol applications run none
+    """
+
+    async def __call__(self, scope, receive, send):
+        if settings.WARMUP['ENABLED']:
+            warmup.start()
+        if settings.JOBS['RUN_IN_ASGI']:
+            job_runner.start()
+        if settings.OUTBOX['SEND_IN_ASGI']:
+            outbox_sender.start()
+        text_documents.start()
+        if settings.BOARD_AFFINITY['ENABLED']:
+            worker_registry.start()
+        return await super().__call__(scope, receive, send)
+
+
+application = ServerRouter({
+    "http": django_application,
     "websocket":     URLRouter(
             board_manager.routing.websocket_urlpatterns
     ),
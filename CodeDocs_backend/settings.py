@@ -37,13 +37,104 @@ SITE_NAME = 'shared_board'
 CHANNEL_LAYERS = {
     "default": {
         # "BACKEND": "channels.layers.InMemoryChannelLayer",  # local-development
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        # messages to sockets of the same process do not go through Redis
+        "BACKEND": "board_manager.channel_layers.LocalFirstChannelLayer",
         "CONFIG": {
-            "hosts": [("127.0.0.1", 6379)],
+            # groups are spread over the shards by consistent hashing
+            "shards": [
+                {
+                    "BACKEND": "channels_redis.core.RedisChannelLayer",
+                    "CONFIG": {
+                        "hosts": [("127.0.0.1", 6379)],
+                    },
+                },
+            ],
         },
     },
 }
 
+# sockets of a board go to the worker owning it, found by the load balancer at /board/route/<board id>,
+# see board_manager.workers. Group messages of owned boards then do not go through Redis
+BOARD_AFFINITY = {
+    'ENABLED': os.getenv('CODE_DOCS_BOARD_AFFINITY', '0') == '1',
+    'WORKER_NAME': os.getenv('CODE_DOCS_WORKER_NAME'),  # host:pid by default
+    'ADDRESS': os.getenv('CODE_DOCS_WORKER_ADDRESS', ''),  # where the load balancer reaches the worker
+    # sent by the load balancer in the X-Route-Token header of /board/route/, the route is refused without it
+    'ROUTE_TOKEN': os.getenv('CODE_DOCS_ROUTE_TOKEN', ''),
+    'HEARTBEAT_SECONDS': 5,
+    'EXPIRY_SECONDS': 15,  # workers without a heartbeat for so long left
+    'VIRTUAL_NODES': 100,
+}
+CHANNEL_LAYERS['default']['CONFIG']['owner_only'] = BOARD_AFFINITY['ENABLED']
+
+# the last events of every board, which a reconnecting client can replay
+BOARD_EVENTS_BUFFER = {
+    'SIZE': 500,  # events per board
+    'TIMEOUT': 3600,  # seconds without events after which a board is forgotten
+}
+
+# simultaneous editing of node titles and descriptions
+COLLABORATIVE_EDITING = {
+    'HISTORY_SIZE': 200,  # operations kept to transform the late ones
+    'SNAPSHOT_OPERATIONS': 50,  # save the merged text after so many operations
+    'SNAPSHOT_SECONDS': 5,  # or after so many seconds
+}
+
+# compression of big websocket messages for clients which asked for "json+deflate" or "msgpack+deflate"
+WEBSOCKET_COMPRESSION = {
+    'THRESHOLD': 16 * 1024,  # bytes, None disables compression
+    'LEVEL': 6,  # zlib compression level
+}
+
+# limits of messages from one websocket and the queue of messages to it
+WEBSOCKET_FLOW_CONTROL = {
+    # token buckets: (messages per second, burst)
+    'CONNECTION_RATE_LIMIT': (50, 100),
+    'MESSAGE_RATE_LIMITS': {
+        'default': (10, 20),
+        'board_info': (2, 5),
+        'board_nodes': (2, 5),
+        'columns_info': (2, 5),
+        'all_users': (2, 5),
+        'active_users': (2, 5),
+        'changing_node': (30, 60),
+        'changing_column': (30, 60),
+        'edit_node_text': (50, 100),
+    },
+    # messages waiting to be sent to a client which falls behind
+    'OUTBOUND_QUEUE_SIZE': 1000,
+}
+
+# files of helpers.logger, written by a background thread
+LOG_FILES = {
+    'MAX_BYTES': 10 * 1024 * 1024,
+    'WHEN': 'midnight',
+    'BACKUP_COUNT': 14,
+    'QUEUE_SIZE': 10000,
+    # records with the same message let through per period, the rest are counted
+    'SAMPLING_BURST': 10,
+    'SAMPLING_PERIOD': 60,
+}
+
+# queries of handlers are tagged with their context, slow and repeated (N+1) ones are logged
+SQL_TRACING = {
+    'SLOW_QUERY_SECONDS': 0.1,
+    'REPEATED_QUERIES': 5,  # identical statements in one handler call
+}
+
+# /metrics is served to the scrapers sending the token and to runworkers sending the secret it gave its workers
+METRICS = {
+    'TOKEN': os.getenv('CODE_DOCS_METRICS_TOKEN', ''),
+    'STATS_TOKEN': os.getenv('CODE_DOCS_STATS_TOKEN', ''),  # X-Stats-Token, set by runworkers
+}
+
+# opt-in recording of incoming websocket messages to replay them with `manage.py replay_websocket_traffic`
+WEBSOCKET_RECORDING = {
+    'ENABLED': os.getenv('CODE_DOCS_RECORD_WEBSOCKETS') == '1',
+    'PATH': os.path.join(BASE_DIR, 'recordings', 'websocket-{pid}.ndjson'),
+    'SALT': os.getenv('CODE_DOCS_RECORDING_SALT', ''),  # ids are hashed with it
+}
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -88,7 +179,18 @@ AUTH_USER_MODEL = 'authentication.CustomUser'
 ASGI_APPLICATION = "CodeDocs_backend.asgi.application"
 
 # email settings
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# emails are written to the outbox with the request and sent by the sender of authentication.outbox
+EMAIL_BACKEND = 'authentication.outbox.OutboxEmailBackend'
+OUTBOX = {
+    'EMAIL_BACKEND': 'django.core.mail.backends.smtp.EmailBackend',  # what really sends them
+    'BATCH_SIZE': 50,  # emails per connection to the mail server
+    'MAX_ATTEMPTS': 8,
+    'BACKOFF_SECONDS': 30,  # before the second attempt, doubled every next one
+    'LEASE_SECONDS': 300,  # a batch is taken again after it, when its sender died
+    'POLL_SECONDS': 10,  # between the looks for due emails, e.g. written by other workers or retried
+    # a thread of every ASGI worker sends them, otherwise run the send_emails command
+    'SEND_IN_ASGI': os.getenv('CODE_DOCS_SEND_EMAILS', '1') == '1',
+}
 EMAIL_HOST = 'smtp.mail.ru'
 EMAIL_PORT = 2525
 EMAIL_HOST_USER = os.getenv('CODE_DOCS_EMAIL')
@@ -165,15 +267,111 @@ WSGI_APPLICATION = 'CodeDocs_backend.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': 'helpers.pooled_postgresql',
         'NAME': 'shared_board',
         'USER': 'postgres',
         'PASSWORD': 'postgres',
         'HOST': '127.0.0.1',
         'PORT': '5432',
+        # connections are returned to the pool when Django closes them after every request
+        # and channels after every consumer handler, so CONN_MAX_AGE stays 0
+        'POOL': {
+            'SIZE': 20,
+            'TIMEOUT': 10,  # seconds to wait for a free connection
+            'CHECK_IDLE_SECONDS': 30,  # connections idle for longer are checked before use
+        },
+    }
+}
+
+# a replica streaming from the primary, e.g. CODE_DOCS_REPLICA_HOST=10.0.0.2
+if os.getenv('CODE_DOCS_REPLICA_HOST'):
+    DATABASES['replica'] = {**DATABASES['default'],
+                            'HOST': os.getenv('CODE_DOCS_REPLICA_HOST'),
+                            'TEST': {'MIRROR': 'default'}}
+
+# cached responses of my_boards and get_board_columns, share it in Redis between several workers
+# (CODE_DOCS_CACHE_REDIS=redis://127.0.0.1:6379/1), the local memory is seen by one process only
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shared_board',
+        # the events of the boards are kept here too
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    }
+}
+if os.getenv('CODE_DOCS_CACHE_REDIS'):
+    CACHES['default'] = {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.getenv('CODE_DOCS_CACHE_REDIS'),
     }
+
+RESPONSE_CACHE = {
+    # seconds the versions of cached responses are kept, None for ever. A process-local cache does not see
+    # the changes made in other workers, so its versions are forgotten soon and the responses built again
+    'VERSION_TIMEOUT': None if os.getenv('CODE_DOCS_CACHE_REDIS') else 5,
+}
+
+# full-text search of nodes, see board_manager.search
+SEARCH = {
+    'CONFIG': 'simple',  # text search configuration of Postgres, 'simple' does not stem the words of any language
+    'PAGE_SIZE': 20,
+    'MAX_PAGE_SIZE': 100,
+    'MAX_WORDS': 10,
 }
 
+# filters answering the availability checks of sign-up without queries, see authentication.availability
+AVAILABILITY_FILTER = {
+    'CAPACITY': 100000,  # users, grows to twice the number of users on rebuild
+    'ERROR_RATE': 0.01,  # share of free values looked up in the database
+    'REBUILD_SECONDS': 300,
+}
+
+# deleted boards and users are hidden at once and their rows removed by jobs of board_manager.reclaimer
+RECLAIMER = {
+    'CHUNK_SIZE': 500,
+    'PAUSE_SECONDS': 0.05,  # between chunks, lets requests take the locks
+}
+
+# heavy operations run by worker threads of the ASGI application, see board_manager.jobs
+JOBS = {
+    'THREADS': 2,
+    'POLL_SECONDS': 1,
+    'BACKOFF_SECONDS': 5,  # before the second attempt, doubled every next one
+    'MAX_ATTEMPTS': 3,
+    'LEASE_SECONDS': 600,  # a running job is taken again after it, when its worker died
+    'KEEP_SECONDS': 7 * 24 * 3600,  # finished jobs are deleted after it
+    'CLEANUP_SECONDS': 3600,  # between the deletions of finished jobs
+    'RUN_IN_ASGI': os.getenv('CODE_DOCS_RUN_JOBS', '1') == '1',
+}
+
+# phases run by a new ASGI worker before /ready answers 200, see CodeDocs_backend.warmup
+WARMUP = {
+    'ENABLED': os.getenv('CODE_DOCS_WARMUP', '1') == '1',
+    'DB_CONNECTIONS': 5,  # opened in the pool of every database
+}
+
+DATABASE_ROUTERS = ['helpers.db_router.ReadReplicaRouter']
+
+READ_REPLICAS = {
+    'DATABASES': [alias for alias in DATABASES if alias != 'default'],
+    # websocket handlers and views whose reads may go to the replicas
+    'HANDLERS': ['board_nodes', 'columns_info', 'all_users', 'active_users', 'board_info',
+                 'my_boards', 'get_board_columns', 'search_nodes'],
+    # reads of a board or a user written to recently go to the primary
+    'PIN_SECONDS': 5,
+}
+
+# cost of the password hash paid by every login, see the bench_login command
+PASSWORD_HASHING = {
+    'PBKDF2_ITERATIONS': int(os.getenv('CODE_DOCS_PBKDF2_ITERATIONS', 216000)),
+}
+
+PASSWORD_HASHERS = [
+    'authentication.hashers.ConfiguredPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -15,11 +15,17 @@ Including another URLconf
 """
 from django.urls import path, include
 
+from helpers.metrics import metrics_view
+from .warmup import readiness_view
+
 urlpatterns = [
     path('auth/', include('authentication.urls')),
     path('auth/', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
     path('auth/', include('djoser.urls.jwt')),
 
-    path('board/', include('board_manager.urls'))
+    path('board/', include('board_manager.urls')),
+
+    path('metrics', metrics_view),
+    path('ready', readiness_view),
 ]
@@ -0,0 +1,148 @@
+"""
+Warm-up of a worker: the imports, caches and connections the first requests would otherwise wait for.
+The readiness endpoint answers 200 only after all phases ran.
+"""
+import importlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.http import HttpResponse
+from django.urls import get_resolver
+
+from helpers.logger import create_logger
+from helpers.metrics import Gauge
+
+warmup_logger = create_logger('warmup_logger')
+warmup_phase_seconds = Gauge('warmup_phase_seconds', 'Duration of the warm-up phases of the worker', ['phase'])
+worker_ready = Gauge('worker_ready', 'Whether the warm-up of the worker has completed')
+worker_ready.set(0)
+
+LAZY_MODULES = [
+    'rest_framework.views',
+    'rest_framework.serializers',
+    'rest_framework_simplejwt.authentication',
+    'rest_framework_simplejwt.views',
+    'djoser.views',
+    'djoser.serializers',
+    'djoser.email',
+    'channels_presence.models',
+    'board_manager.consumers',
+]
+
+
+def import_modules():
+    for module in LAZY_MODULES:
+        importlib.import_module(module)
+    # builds the channel layer and its shards
+    from channels.layers import get_channel_layer
+    get_channel_layer()
+
+
+def compile_urls():
+    # the patterns are compiled when the reverse lookups are populated
+    get_resolver().reverse_dict
+    import board_manager.routing  # noqa: F401
+
+
+def prime_serializers():
+    from djoser.conf import settings as djoser_settings
+    from authentication.serializers import UserSerializer, UserRegistrationSerializer
+    from board_manager import serializers
+
+    classes = [UserSerializer, UserRegistrationSerializer, djoser_settings.SERIALIZERS.user_create,
+               djoser_settings.SERIALIZERS.activation, djoser_settings.SERIALIZERS.password_reset]
+    classes += [value for name, value in vars(serializers).items() if name.endswith('Serializer')]
+    for serializer_class in classes:
+        # the fields are introspected from the models
+        serializer_class().fields
+
+
+def open_databases():
+    for alias in connections:
+        connection = connections[alias]
+        connection.ensure_connection()
+        pool = getattr(connection, 'pool', None)
+        # returned to the pool
+        connection.close()
+        if pool is not None:
+            pool.prefill(settings.WARMUP['DB_CONNECTIONS'])
+
+
+def open_cache():
+    cache.get('warmup')
+
+
+def build_availability_filter():
+    from authentication.availability import availability_filter
+    availability_filter.rebuild()
+
+
+PHASES = [
+    ('imports', import_modules),
+    ('urls', compile_urls),
+    ('serializers', prime_serializers),
+    ('databases', open_databases),
+    ('cache', open_cache),
+    ('availability_filter', build_availability_filter),
+]
+
+
+class WarmUp:
+    """
+    Runs the phases once, a failed phase is logged and does not stop the others
+    """
+
+    def __init__(self, phases):
+        self.phases = phases
+        self.durations = {}
+        self.errors = {}
+        self.done = threading.Event()
+        self._started = False
+        self._lock = threading.Lock()
+
+    def run(self):
+        for name, function in self.phases:
+            started = time.perf_counter()
+            try:
+                function()
+            except Exception as e:
+                self.errors[name] = str(e)
+                warmup_logger.error(f"Warm-up phase {name} failed: {e}")
+            self.durations[name] = time.perf_counter() - started
+            warmup_phase_seconds.set(self.durations[name], phase=name)
+            warmup_logger.info(f"Warm-up phase {name} took {self.durations[name]:.3f}s")
+
+        warmup_logger.info(f"Warm-up took {sum(self.durations.values()):.3f}s")
+        worker_ready.set(1)
+        self.done.set()
+
+    def _run_in_background(self):
+        try:
+            self.run()
+        finally:
+            connections.close_all()
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._run_in_background, name='warmup', daemon=True).start()
+
+    def status(self) -> dict:
+        return {'ready': self.done.is_set(),
+                'phases': {name: round(seconds, 4) for name, seconds in self.durations.items()},
+                'errors': self.errors}
+
+
+warmup = WarmUp(PHASES)
+
+
+def readiness_view(request):
+    status = warmup.status()
+    status['ready'] = status['ready'] or not settings.WARMUP['ENABLED']
+    return HttpResponse(json.dumps(status), status=200 if status['ready'] else 503, content_type='application/json')
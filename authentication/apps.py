@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate, post_save
 
 
 class AuthenticationConfig(AppConfig):
     name = 'authentication'
+
+    def ready(self):
+        # users signing up are added to the availability filter at once
+        from .availability import user_saved, install_lookup_indexes
+        post_save.connect(user_saved, sender=self.get_model('CustomUser'))
+        post_migrate.connect(install_lookup_indexes, sender=self)
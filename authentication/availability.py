@@ -0,0 +1,200 @@
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache as default_cache
+from django.db import connections, router, transaction
+
+from helpers.metrics import Counter
+from .auth_logger import auth_logger
+from .models import CustomUser
+
+availability_checks = Counter('availability_checks_total', 'Username and email checks by what answered them',
+                              ['field', 'answered_by'])
+
+FIELDS = ('username', 'email')
+
+
+class BloomFilter:
+    """
+    Set of strings answering "definitely not added" or "maybe added" in a fixed number of bits
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        # the positions come from two hashes, h1 + i * h2
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, value):
+        return all(self.bits[position // 8] & (1 << (position % 8)) for position in self._positions(value))
+
+
+class AvailabilityFilter:
+    """
+    Bloom filters of the taken usernames and emails, case-insensitive.
+    A value missing in the filter is free without a query, the others are looked up in the database.
+
+    Users created by any worker are numbered in the cache, so the other workers sharing a Redis cache
+    add them to their filters before the next check. When some of them are no longer in the cache
+    the values are looked up in the database until the filters are rebuilt.
+    The filters are built by the warm-up or in the background on the first check, never on the request path,
+    and rebuilt in the background every `rebuild_seconds`
+    """
+
+    def __init__(self, capacity, error_rate, rebuild_seconds, cache=default_cache, clock=time.monotonic):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.rebuild_seconds = rebuild_seconds
+        self.cache = cache
+        self.clock = clock
+
+        self._filters = None
+        self._built_at = None
+        self._seen = 0  # number of the last user of the cache in the filters
+        self._stale = False
+        self._added_while_rebuilding = None
+        self._rebuilding = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name) -> str:
+        return f"availability:added:{name}"
+
+    @staticmethod
+    def _add_to(filters, values):
+        for field, value in values.items():
+            filters[field].add(value.lower())
+
+    def rebuild(self):
+        with self._lock:
+            # users saved in this worker during the query are added to the new filters
+            if self._added_while_rebuilding is None:
+                self._added_while_rebuilding = []
+        # users of other workers numbered after this are caught up later
+        seen = self.cache.get(self._key('seq'), 0)
+        users = CustomUser.objects.values_list(*FIELDS)
+        # room for the users signing up until the next rebuild
+        capacity = max(self.capacity, users.count() * 2)
+        filters = {field: BloomFilter(capacity, self.error_rate) for field in FIELDS}
+        started = self.clock()
+        for values in users.iterator(chunk_size=5000):
+            self._add_to(filters, dict(zip(FIELDS, values)))
+        with self._lock:
+            for values in self._added_while_rebuilding or []:
+                self._add_to(filters, values)
+            self._added_while_rebuilding = None
+            self._filters, self._built_at, self._seen, self._stale = filters, started, seen, False
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        except Exception as e:
+            auth_logger.error(f"Rebuilding the availability filter failed: {e}")
+        finally:
+            connections.close_all()
+            with self._lock:
+                self._rebuilding = False
+
+    def _catch_up(self):
+        """
+        Adds the users created by the other workers since the filters were built or caught up
+        """
+        filters, seen = self._filters, self._seen
+        seq = self.cache.get(self._key('seq'), 0)
+        if seq == seen:
+            return
+        keys = [self._key(number) for number in range(seen + 1, seq + 1)]
+        added = self.cache.get_many(keys) if seq > seen else {}
+        with self._lock:
+            if self._filters is not filters or self._seen != seen:
+                # rebuilt or caught up meanwhile
+                return
+            if seq < seen or len(added) < len(keys):
+                # restarted or forgotten by the cache
+                self._stale = True
+                return
+            for values in added.values():
+                self._add_to(filters, values)
+            self._seen = seq
+
+    def _start_rebuild(self):
+        with self._lock:
+            start, self._rebuilding = not self._rebuilding, True
+        if start:
+            threading.Thread(target=self._rebuild_in_background, name='availability-filter', daemon=True).start()
+
+    def _current_filters(self):
+        if self._filters is None:
+            # not warmed up, the database answers until the filters are built
+            self._start_rebuild()
+            return None
+        self._catch_up()
+        if self._stale or self.clock() - self._built_at > self.rebuild_seconds:
+            self._start_rebuild()
+        return None if self._stale else self._filters
+
+    def add(self, **values):
+        with self._lock:
+            if self._added_while_rebuilding is not None:
+                self._added_while_rebuilding.append(values)
+            filters = self._filters
+        if filters is not None:
+            self._add_to(filters, values)
+
+    def publish(self, **values):
+        """
+        Numbers a new user in the cache for the other workers
+        """
+        try:
+            seq = self.cache.incr(self._key('seq'))
+        except ValueError:
+            self.cache.add(self._key('seq'), 0, None)
+            seq = self.cache.incr(self._key('seq'))
+        self.cache.set(self._key(seq), values, self.rebuild_seconds)
+
+    def is_free(self, field, value) -> bool:
+        filters = self._current_filters()
+        if filters is not None and value.lower() not in filters[field]:
+            availability_checks.inc(field=field, answered_by='filter')
+            return True
+        availability_checks.inc(field=field, answered_by='database')
+        return not CustomUser.objects.filter(**{f"{field}__iexact": value}).exists()
+
+
+availability_filter = AvailabilityFilter(settings.AVAILABILITY_FILTER['CAPACITY'],
+                                         settings.AVAILABILITY_FILTER['ERROR_RATE'],
+                                         settings.AVAILABILITY_FILTER['REBUILD_SECONDS'])
+
+
+def user_saved(sender, instance, created, **kwargs):
+    values = {'username': instance.username, 'email': instance.email}
+    availability_filter.add(**values)
+    if created:
+        # the other workers learn about the user once it is committed
+        transaction.on_commit(lambda: availability_filter.publish(**values))
+
+
+def install_lookup_indexes(using, **kwargs):
+    """
+    post_migrate receiver creating the indexes of the case-insensitive lookups, Django can not declare them here
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql' or not router.allow_migrate_model(using, CustomUser):
+        return
+    with connection.cursor() as cursor:
+        for field in FIELDS:
+            # the same expression as the iexact lookup
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS authentication_customuser_{field}_upper "
+                           f"ON authentication_customuser (UPPER({field}::text))")
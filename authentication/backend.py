@@ -2,19 +2,20 @@ from django.contrib.auth.backends import AllowAllUsersModelBackend
 from django.db.utils import IntegrityError
 
 from authentication.models import CustomUser
+from .availability import availability_filter
 from .exceptions import NotUniqueFieldException, UserAlreadyExistException
 
 
 class AuthBackend(AllowAllUsersModelBackend):
     @staticmethod
     def is_unique_username(username):
-        if CustomUser.objects.filter(username=username).exists():
+        if not availability_filter.is_free('username', username):
             raise NotUniqueFieldException('username')
         return True
 
     @staticmethod
     def is_unique_email(email):
-        if CustomUser.objects.filter(email=email).exists():
+        if not availability_filter.is_free('email', email):
             raise NotUniqueFieldException('email')
         return True
 
@@ -6,7 +6,7 @@ from rest_framework.views import exception_handler
 from django.http import HttpResponse
 from rest_framework import status
 
-from authentication.models import CustomUser
+from helpers.context import handler_context
 from helpers.logger import create_logger
 
 
@@ -20,15 +20,17 @@ def custom_exception_handler(exc, context):
 
     if response is None:
         if isinstance(exc, SMTPException):
-            if context['request'].stream.path == '/auth/users/':
-                CustomUser.objects.filter(username=context['request'].data['username'],
-                                          email=context['request'].data['email']).all().delete()
-
+            # a user whose email failed is rolled back by UserViewSet.perform_create
             response = HttpResponse(content=str(exc),
                                     status=status.HTTP_400_BAD_REQUEST)
 
         else:
-            out_logger.error(f"UNKNOWN EXCEPTION {__name__} {exc} {traceback.format_exc()}")
+            # the view has already left its handler context, the exception carries it
+            token = handler_context.set(getattr(exc, 'handler_context', None) or handler_context.get())
+            try:
+                out_logger.error(f"UNKNOWN EXCEPTION {__name__} {exc} {traceback.format_exc()}")
+            finally:
+                handler_context.reset(token)
             response = HttpResponse(content=f"{str(exc)}\n problem in server, "
                                             "please report the error to 'msmorozova_3@edu.hse.ru' "
                                             "and specify the date: " + str(datetime.datetime.now()),
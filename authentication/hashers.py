@@ -0,0 +1,10 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class ConfiguredPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2 with the iterations of the PASSWORD_HASHING setting, measure them with the bench_login command.
+    Passwords hashed with other iterations are rehashed on the next login
+    """
+    iterations = settings.PASSWORD_HASHING['PBKDF2_ITERATIONS']
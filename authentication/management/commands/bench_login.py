@@ -0,0 +1,79 @@
+import random
+import time
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import get_hasher, check_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from authentication.models import CustomUser
+from board_manager.load_testing import percentiles
+
+PASSWORD = 'bench-login-password'
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Measures logins, the user lookup and the password hash apart, " \
+           "and the hash with other PBKDF2 iterations. The users it creates are rolled back"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--logins', type=int, default=50)
+        parser.add_argument('--iterations', default='',
+                            help="comma-separated PBKDF2 iterations to compare with the PASSWORD_HASHING setting")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.bench(options['users'], options['logins'],
+                           [int(value) for value in options['iterations'].split(',') if value])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def bench(self, users, logins, iterations):
+        hasher = get_hasher()
+        encoded = hasher.encode(PASSWORD, hasher.salt())
+        # one hash for everybody, creating the users must not take hours
+        CustomUser.objects.bulk_create([CustomUser(username=f"bench_user_{number}",
+                                                   email=f"bench_user_{number}@bench.local",
+                                                   password=encoded,
+                                                   is_active=True)
+                                        for number in range(users)], batch_size=1000)
+
+        samples = random.sample(range(users), min(logins, users))
+        inputs = {'username': [f"bench_user_{number}" for number in samples],
+                  'email': [f"Bench_User_{number}@bench.local" for number in samples]}
+
+        for kind, values in inputs.items():
+            self.report(f"lookup by {kind}", [self.timed(CustomUser.objects.get_by_natural_key, value)
+                                              for value in values])
+        # the query the lookup replaced, for comparison
+        self.report("username OR email query", [self.timed(CustomUser.objects.get, Q(username=value) | Q(email=value))
+                                                for value in inputs['username']])
+
+        for cost in [settings.PASSWORD_HASHING['PBKDF2_ITERATIONS']] + iterations:
+            cost_encoded = hasher.encode(PASSWORD, hasher.salt(), cost)
+            self.report(f"hash, {cost} iterations", [self.timed(check_password, PASSWORD, cost_encoded)
+                                                     for _ in range(min(logins, 20))])
+
+        self.report("authenticate", [self.timed(authenticate, username=value, password=PASSWORD)
+                                     for value in inputs['email']])
+
+    @staticmethod
+    def timed(function, *args, **kwargs) -> float:
+        started = time.perf_counter()
+        function(*args, **kwargs)
+        return time.perf_counter() - started
+
+    def report(self, name, durations):
+        values = percentiles(durations)
+        self.stdout.write(f"  {name:<30} "
+                          + ", ".join(f"{point} {value * 1000:.2f}ms" for point, value in values.items())
+                          + f", {len(durations) / sum(durations):.0f}/s")
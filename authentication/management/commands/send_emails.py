@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from authentication.outbox import outbox_sender
+
+
+class Command(BaseCommand):
+    help = "Sends the emails of the outbox, for deployments whose ASGI workers do not (CODE_DOCS_SEND_EMAILS=0). " \
+           "Several of them can run, every batch is sent by one"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="send the due emails and exit, e.g. from cron")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            self.stdout.write(f"{outbox_sender.send_pending()} emails sent")
+            return
+
+        self.stdout.write(f"Sending the emails of the outbox every {outbox_sender.poll_seconds}s")
+        try:
+            outbox_sender.run()
+        except KeyboardInterrupt:
+            pass
@@ -2,7 +2,6 @@ from django.db import models
 from django.contrib.auth.models import (
     AbstractBaseUser, BaseUserManager
 )
-from django.db.models import Q
 from django.utils import timezone
 
 from .account_colors import random_color
@@ -24,11 +23,25 @@ class CustomAccountManager(BaseUserManager):
         user.save(using=self._db)
         return user
 
+    def _get_ignoring_case(self, field, value):
+        # one query on the UPPER() index, the exact value wins when names differ only in case
+        users = list(self.filter(**{f"{field}__iexact": value})[:2])
+        if len(users) > 1:
+            return self.get(**{field: value})
+        if not users:
+            raise self.model.DoesNotExist()
+        return users[0]
+
     def get_by_natural_key(self, username):
-        return self.get(
-            Q(**{self.model.USERNAME_FIELD: username}) |
-            Q(**{self.model.EMAIL_FIELD: username})
-        )
+        """
+        Finds the user by the email when the login looks like one, otherwise by the username
+        """
+        if '@' in username:
+            try:
+                return self._get_ignoring_case(self.model.EMAIL_FIELD, username)
+            except self.model.DoesNotExist:
+                pass
+        return self._get_ignoring_case(self.model.USERNAME_FIELD, username)
 
 
 class CustomUser(AbstractBaseUser):
@@ -40,6 +53,8 @@ class CustomUser(AbstractBaseUser):
     email = models.EmailField(unique=True)
     account_color = models.CharField(max_length=7)
     is_active = models.BooleanField(default=False)
+    # rows of deleted users are removed in the background by board_manager.reclaimer
+    deleted = models.BooleanField(default=False, db_index=True)
     date_joined = models.DateTimeField(default=timezone.now)
     last_login = None
 
@@ -53,3 +68,24 @@ class CustomUser(AbstractBaseUser):
     def save(self, *args, **kwargs):
         super(CustomUser, self).save(*args, **kwargs)
         return self
+
+
+class OutboxEmail(models.Model):
+    """
+    Email written in the transaction of the request and sent later by authentication.outbox
+    """
+    class Statuses(models.TextChoices):
+        PENDING = "pending"
+        SENT = "sent"
+        FAILED = "failed"
+
+    message = models.JSONField()
+    status = models.CharField(choices=Statuses.choices, max_length=16, default=Statuses.PENDING, db_index=True)
+    attempts = models.IntegerField(default=0)
+    send_after = models.DateTimeField(default=timezone.now)
+    # a batch taken by a sender is locked until it is sent or the sender died
+    claimed_by = models.CharField(max_length=32, default='')
+    locked_until = models.DateTimeField(null=True, default=None)
+    error = models.TextField(default='')
+    created = models.DateTimeField(default=timezone.now)
+    sent = models.DateTimeField(null=True, default=None)
@@ -0,0 +1,206 @@
+import datetime
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from helpers.metrics import Counter
+from .auth_logger import auth_logger
+from .models import OutboxEmail
+
+outbox_emails = Counter('outbox_emails_total', 'Attempts to send emails of the outbox by result', ['status'])
+
+
+def serialize_message(message) -> dict:
+    if message.attachments:
+        raise ValueError("Emails with attachments can not be written to the outbox")
+    return {'subject': message.subject,
+            'body': message.body,
+            'from_email': message.from_email,
+            'to': message.to,
+            'cc': message.cc,
+            'bcc': message.bcc,
+            'reply_to': message.reply_to,
+            'headers': message.extra_headers,
+            'content_subtype': message.content_subtype,
+            'alternatives': getattr(message, 'alternatives', [])}
+
+
+def deserialize_message(data) -> EmailMultiAlternatives:
+    message = EmailMultiAlternatives(data['subject'], data['body'], data['from_email'], data['to'],
+                                     cc=data['cc'], bcc=data['bcc'], reply_to=data['reply_to'],
+                                     headers=data['headers'],
+                                     alternatives=[tuple(alternative) for alternative in data['alternatives']])
+    message.content_subtype = data['content_subtype']
+    return message
+
+
+class OutboxEmailBackend(BaseEmailBackend):
+    """
+    Writes the emails to the outbox in the transaction of the caller, so the request does not wait for the mail
+    server and an email is sent only if what it tells about was committed
+    """
+
+    def send_messages(self, email_messages):
+        if not email_messages:
+            return 0
+        OutboxEmail.objects.bulk_create([OutboxEmail(message=serialize_message(message))
+                                         for message in email_messages])
+        transaction.on_commit(outbox_sender.wake)
+        outbox_sender.warn_overdue()
+        return len(email_messages)
+
+
+class OutboxSender:
+    """
+    Sends the emails of the outbox in batches over one connection of `backend`.
+    Failed emails are retried after `backoff_seconds` doubled every attempt, up to `max_attempts`,
+    a batch whose sender died is taken again after `lease_seconds`.
+    A thread of the ASGI application or the send_emails command looks for due emails every `poll_seconds`
+    and at once after emails of its process are committed
+    """
+
+    def __init__(self, backend, batch_size, max_attempts, backoff_seconds, lease_seconds, poll_seconds):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+
+    @staticmethod
+    def _unlocked(now):
+        return Q(status=OutboxEmail.Statuses.PENDING) & (Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+
+    def claim(self) -> list:
+        """
+        Takes the next batch of emails to send, the conditional update lets only one sender have them
+        """
+        now = timezone.now()
+        token = uuid.uuid4().hex
+        due = OutboxEmail.objects.filter(self._unlocked(now), send_after__lte=now)
+        ids = list(due.order_by('send_after', 'id').values_list('pk', flat=True)[:self.batch_size])
+        OutboxEmail.objects.filter(self._unlocked(now), pk__in=ids).update(
+            claimed_by=token, locked_until=now + datetime.timedelta(seconds=self.lease_seconds))
+        return list(OutboxEmail.objects.filter(claimed_by=token, status=OutboxEmail.Statuses.PENDING).order_by('id'))
+
+    def _sent(self, email):
+        email.status = OutboxEmail.Statuses.SENT
+        email.sent = timezone.now()
+        email.error = ''
+        self._save(email)
+
+    def _failed(self, email, error):
+        auth_logger.warning(f"Sending email {email.pk}, attempt {email.attempts + 1} failed: {error}")
+        email.error = str(error)
+        if email.attempts + 1 < self.max_attempts:
+            email.send_after = timezone.now() + datetime.timedelta(seconds=self.backoff_seconds * 2 ** email.attempts)
+        else:
+            email.status = OutboxEmail.Statuses.FAILED
+        self._save(email)
+
+    @staticmethod
+    def _save(email):
+        email.attempts += 1
+        email.locked_until = None
+        email.save(update_fields=['status', 'attempts', 'send_after', 'locked_until', 'error', 'sent'])
+        outbox_emails.inc(status=email.status)
+
+    def send_batch(self, emails) -> int:
+        """
+        Sends the claimed emails, returns how many were sent
+        """
+        connection = get_connection(self.backend, fail_silently=False)
+        try:
+            connection.open()
+        except Exception as e:
+            for email in emails:
+                self._failed(email, e)
+            return 0
+
+        sent = 0
+        try:
+            for email in emails:
+                try:
+                    connection.send_messages([deserialize_message(email.message)])
+                except Exception as e:
+                    self._failed(email, e)
+                else:
+                    self._sent(email)
+                    sent += 1
+        finally:
+            connection.close()
+        return sent
+
+    def send_pending(self) -> int:
+        sent = 0
+        emails = self.claim()
+        while emails:
+            sent += self.send_batch(emails)
+            emails = self.claim()
+        return sent
+
+    def next_retry(self):
+        """
+        When the next email waiting for a retry is due, None if there are none
+        """
+        return (OutboxEmail.objects.filter(self._unlocked(timezone.now()))
+                .order_by('send_after').values_list('send_after', flat=True).first())
+
+    def overdue(self) -> int:
+        """
+        Pending emails due for longer than the lease, none are when a sender runs somewhere
+        """
+        since = timezone.now() - datetime.timedelta(seconds=self.lease_seconds)
+        return OutboxEmail.objects.filter(status=OutboxEmail.Statuses.PENDING, send_after__lt=since).count()
+
+    def warn_overdue(self):
+        overdue = self.overdue()
+        if overdue:
+            auth_logger.error(f"{overdue} emails of the outbox are due for more than {self.lease_seconds}s, "
+                              f"is an email sender running (OUTBOX['SEND_IN_ASGI'] or the send_emails command)?")
+
+    def wake(self):
+        self._wakeup.set()
+
+    def run(self):
+        """
+        Sends the due emails until stopped
+        """
+        while not self._stopping.is_set():
+            try:
+                self.send_pending()
+            except Exception as e:
+                auth_logger.exception(f"Email sender failed: {e}")
+            finally:
+                # return the connection to the pool between the rounds
+                connections.close_all()
+            self._wakeup.wait(self.poll_seconds)
+            self._wakeup.clear()
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self.run, name='outbox-sender', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+outbox_sender = OutboxSender(settings.OUTBOX['EMAIL_BACKEND'], settings.OUTBOX['BATCH_SIZE'],
+                             settings.OUTBOX['MAX_ATTEMPTS'], settings.OUTBOX['BACKOFF_SECONDS'],
+                             settings.OUTBOX['LEASE_SECONDS'], settings.OUTBOX['POLL_SECONDS'])
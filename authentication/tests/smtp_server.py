@@ -0,0 +1,52 @@
+import socketserver
+import threading
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.reply("220 localhost")
+        for line in self.rfile:
+            command = line.strip().upper()
+            if command.startswith((b'EHLO', b'HELO')):
+                self.reply("250 localhost")
+            elif command.startswith(b'RCPT') and self.server.reject:
+                self.reply("550 Mailbox unavailable")
+            elif command.startswith((b'MAIL', b'RCPT', b'RSET', b'NOOP')):
+                self.reply("250 OK")
+            elif command == b'DATA':
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = b''.join(iter(self.rfile.readline, b'.\r\n'))
+                self.server.messages.append(data.decode())
+                self.reply("250 OK")
+            elif command == b'QUIT':
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class SmtpStandIn(socketserver.ThreadingTCPServer):
+    """
+    Mail server on a free local port keeping the messages in `messages`, rejects all recipients while `reject`
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SmtpHandler)
+        self.messages = []
+        self.reject = False
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
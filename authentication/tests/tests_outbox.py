@@ -0,0 +1,102 @@
+import time
+from unittest import mock
+
+from django.core.mail import send_mail
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from authentication.models import CustomUser, OutboxEmail
+from authentication.outbox import OutboxSender
+from authentication.tests.smtp_server import SmtpStandIn
+
+OUTBOX_BACKEND = 'authentication.outbox.OutboxEmailBackend'
+SMTP_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+
+
+@override_settings(EMAIL_BACKEND=OUTBOX_BACKEND, EMAIL_HOST='127.0.0.1', EMAIL_USE_TLS=False,
+                   EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='', DEFAULT_FROM_EMAIL='boards@mail.ru')
+class OutboxTestCase(TestCase):
+    def setUp(self) -> None:
+        self.sender = OutboxSender(SMTP_BACKEND, batch_size=2, max_attempts=2, backoff_seconds=30, lease_seconds=60,
+                                   poll_seconds=60)
+
+    def test_registration_writes_to_the_outbox(self):
+        response = APIClient().post('/auth/users/', {'username': 'Igor Mashtakov',
+                                                     'email': 'masht@mail.ru',
+                                                     'password': 'Strong-password-1'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(CustomUser.objects.filter(username='Igor Mashtakov').exists())
+
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.status, OutboxEmail.Statuses.PENDING)
+        self.assertEqual(email.message['to'], ['masht@mail.ru'])
+
+    def test_emails_are_sent_in_batches(self):
+        for number in range(5):
+            send_mail(f"Subject {number}", "Body", None, [f"user{number}@mail.ru"])
+        with SmtpStandIn() as server, override_settings(EMAIL_PORT=server.port):
+            self.assertEqual(self.sender.send_pending(), 5)
+
+        self.assertEqual(len(server.messages), 5)
+        self.assertIn("Subject: Subject 0", server.messages[0])
+        self.assertFalse(OutboxEmail.objects.exclude(status=OutboxEmail.Statuses.SENT).exists())
+
+    def test_failed_email_is_retried(self):
+        send_mail("Subject", "Body", None, ["masht@mail.ru"])
+        with SmtpStandIn() as server, override_settings(EMAIL_PORT=server.port):
+            server.reject = True
+            self.assertEqual(self.sender.send_pending(), 0)
+
+            email = OutboxEmail.objects.get()
+            self.assertEqual(email.status, OutboxEmail.Statuses.PENDING)
+            self.assertEqual(email.attempts, 1)
+            self.assertGreater(email.send_after, timezone.now())
+            self.assertEqual(self.sender.next_retry(), email.send_after)
+
+            OutboxEmail.objects.update(send_after=timezone.now())
+            self.assertEqual(self.sender.send_pending(), 0)
+            email.refresh_from_db()
+            self.assertEqual(email.status, OutboxEmail.Statuses.FAILED)
+            self.assertEqual(email.attempts, 2)
+
+    def test_unreachable_server(self):
+        send_mail("Subject", "Body", None, ["masht@mail.ru"])
+        with SmtpStandIn() as server:
+            port = server.port
+        with override_settings(EMAIL_PORT=port):
+            self.assertEqual(self.sender.send_pending(), 0)
+        self.assertEqual(OutboxEmail.objects.get().attempts, 1)
+
+    def test_overdue_emails_are_logged(self):
+        send_mail("Subject", "Body", None, ["masht@mail.ru"])
+        OutboxEmail.objects.update(send_after=timezone.now() - timezone.timedelta(minutes=10))
+
+        with self.assertLogs('auth_logger', 'ERROR') as logs:
+            send_mail("Subject", "Body", None, ["masht@mail.ru"])
+        self.assertIn("1 emails of the outbox are due for more than 300s", logs.output[0])
+
+
+@override_settings(EMAIL_BACKEND=OUTBOX_BACKEND, EMAIL_HOST='127.0.0.1', EMAIL_USE_TLS=False,
+                   EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='', DEFAULT_FROM_EMAIL='boards@mail.ru')
+class OutboxSenderThreadTestCase(TransactionTestCase):
+    # emails wake the sender when they are committed
+
+    def test_committed_emails_are_sent(self):
+        sender = OutboxSender(SMTP_BACKEND, batch_size=2, max_attempts=2, backoff_seconds=30, lease_seconds=60,
+                              poll_seconds=60)
+        with SmtpStandIn() as server, override_settings(EMAIL_PORT=server.port):
+            sender.start()
+            try:
+                with mock.patch('authentication.outbox.outbox_sender', sender):
+                    send_mail("Subject", "Body", None, ["masht@mail.ru"])
+                deadline = time.monotonic() + 5
+                while OutboxEmail.objects.filter(status=OutboxEmail.Statuses.PENDING).exists() \
+                        and time.monotonic() < deadline:
+                    time.sleep(0.05)
+            finally:
+                sender.stop()
+
+        self.assertEqual(OutboxEmail.objects.get().status, OutboxEmail.Statuses.SENT)
+        self.assertEqual(len(server.messages), 1)
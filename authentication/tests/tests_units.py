@@ -1,5 +1,9 @@
+from unittest import mock
+
+from django.core.cache import cache
 from django.test import TestCase
 
+from authentication.availability import BloomFilter, AvailabilityFilter
 from authentication.backend import AuthBackend
 from authentication.models import CustomUser
 from authentication.exceptions import UserAlreadyExistException, NotUniqueFieldException
@@ -104,3 +108,117 @@ class CheckEmail(TestCase):
         self.auth_backend.create_user(username, email, password)
         with self.assertRaises(NotUniqueFieldException):
             self.auth_backend.is_unique_email(email)
+
+
+class BloomFilterTestCase(TestCase):
+    def test_added_values_are_found(self):
+        bloom = BloomFilter(1000, 0.01)
+        for number in range(1000):
+            bloom.add(f"user{number}")
+        self.assertTrue(all(f"user{number}" in bloom for number in range(1000)))
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(1000, 0.01)
+        for number in range(1000):
+            bloom.add(f"user{number}")
+        false_positives = sum(f"free{number}" in bloom for number in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class AvailabilityFilterTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.now = 0
+        self.filter = AvailabilityFilter(1000, 0.01, 60, clock=lambda: self.now)
+        AuthBackend().create_user(username='Igor Mashtakov', email='masht@mail.ru', password='12345')
+
+    def test_free_value_needs_no_query(self):
+        self.filter.rebuild()
+        with self.assertNumQueries(0):
+            self.assertTrue(self.filter.is_free('username', 'Somebody Else'))
+            self.assertTrue(self.filter.is_free('email', 'else@mail.ru'))
+
+    def test_not_built_filter_is_built_in_background(self):
+        with mock.patch.object(self.filter, '_rebuild_in_background') as rebuild:
+            with self.assertNumQueries(1):
+                self.assertTrue(self.filter.is_free('username', 'Somebody Else'))
+            with self.assertNumQueries(1):
+                self.assertFalse(self.filter.is_free('username', 'Igor Mashtakov'))
+        rebuild.assert_called_once()
+        self.assertIsNone(self.filter._filters)
+
+    def test_taken_value_ignores_case(self):
+        self.filter.rebuild()
+        self.assertFalse(self.filter.is_free('username', 'igor mashtakov'))
+        self.assertFalse(self.filter.is_free('email', 'MASHT@mail.ru'))
+
+    def test_added_user_is_taken(self):
+        self.filter.rebuild()
+        CustomUser.objects.create_user(username='Somebody Else', email='else@mail.ru', password='12345')
+        self.filter.add(username='Somebody Else', email='else@mail.ru')
+        self.assertFalse(self.filter.is_free('username', 'Somebody Else'))
+
+    def test_rebuild_finds_users_created_elsewhere(self):
+        self.filter.rebuild()
+        CustomUser.objects.bulk_create([CustomUser(username='Somebody Else', email='else@mail.ru')])
+        self.assertTrue(self.filter.is_free('username', 'Somebody Else'))
+        self.filter.rebuild()
+        self.assertFalse(self.filter.is_free('username', 'Somebody Else'))
+
+    def test_users_of_other_workers(self):
+        self.filter.rebuild()
+        other_worker = AvailabilityFilter(1000, 0.01, 60, clock=lambda: self.now)
+        CustomUser.objects.bulk_create([CustomUser(username='Somebody Else', email='else@mail.ru')])
+        other_worker.publish(username='Somebody Else', email='else@mail.ru')
+
+        # found in the filter and looked up in the database
+        with self.assertNumQueries(1):
+            self.assertFalse(self.filter.is_free('username', 'Somebody Else'))
+
+    def test_forgotten_users_of_other_workers(self):
+        self.filter.rebuild()
+        self.filter.publish(username='Somebody Else', email='else@mail.ru')
+        cache.delete('availability:added:1')
+
+        with mock.patch.object(self.filter, '_rebuild_in_background') as rebuild:
+            with self.assertNumQueries(1):
+                self.assertTrue(self.filter.is_free('username', 'Free Name'))
+        rebuild.assert_called_once()
+
+    def test_users_added_during_rebuild(self):
+        self.filter.rebuild()
+
+        def clock():
+            # saved after the query of the rebuild read the users
+            self.filter.add(username='During Rebuild', email='during@mail.ru')
+            return self.now
+        self.filter.clock = clock
+        self.filter.rebuild()
+        self.filter.clock = lambda: self.now
+
+        with self.assertNumQueries(1):
+            self.filter.is_free('username', 'During Rebuild')
+
+
+class GetByNaturalKey(TestCase):
+    def setUp(self) -> None:
+        self.user = AuthBackend().create_user(username='Igor Mashtakov', email='masht@mail.ru', password='12345')
+
+    def test_by_username_ignoring_case(self):
+        self.assertEqual(CustomUser.objects.get_by_natural_key('igor mashtakov'), self.user)
+
+    def test_by_email_ignoring_case(self):
+        self.assertEqual(CustomUser.objects.get_by_natural_key('Masht@Mail.ru'), self.user)
+
+    def test_username_with_at_sign(self):
+        user = AuthBackend().create_user(username='igor@home', email='igor@mail.ru', password='12345')
+        self.assertEqual(CustomUser.objects.get_by_natural_key('igor@home'), user)
+
+    def test_exact_case_wins(self):
+        user = AuthBackend().create_user(username='IGOR MASHTAKOV', email='igor@mail.ru', password='12345')
+        self.assertEqual(CustomUser.objects.get_by_natural_key('IGOR MASHTAKOV'), user)
+        self.assertEqual(CustomUser.objects.get_by_natural_key('Igor Mashtakov'), self.user)
+
+    def test_unknown_login(self):
+        with self.assertRaises(CustomUser.DoesNotExist):
+            CustomUser.objects.get_by_natural_key('nobody@mail.ru')
@@ -1,5 +1,6 @@
 from django.test import Client, TestCase
 from rest_framework import status
+from rest_framework.test import APIClient
 
 from authentication.backend import AuthBackend
 
@@ -38,3 +39,49 @@ class CheckEmail(TestCase):
         response = self.client.post('/auth/check_email/', {'email': 'masht@mail.ru'})
         self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
         self.assertEqual(response.content, b'This email is already in use')
+
+
+class CheckAvailability(TestCase):
+    def setUp(self) -> None:
+        self.client = Client()
+        AuthBackend().create_user(username='Igor Mashtakov',
+                                  email='masht@mail.ru',
+                                  password='12345')
+
+    def test_both_fields(self):
+        response = self.client.post('/auth/check_availability/',
+                                    {'username': 'Somebody Else', 'email': 'MASHT@mail.ru'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'username': True, 'email': False})
+
+    def test_one_field(self):
+        response = self.client.post('/auth/check_availability/', {'username': 'igor mashtakov'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'username': False})
+
+    def test_no_fields(self):
+        response = self.client.post('/auth/check_availability/', {})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_not_string(self):
+        response = self.client.post('/auth/check_availability/', {'username': ['Somebody Else']},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_406_NOT_ACCEPTABLE)
+
+
+class DeleteUser(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = AuthBackend().create_user(username='Igor Mashtakov',
+                                              email='masht@mail.ru',
+                                              password='12345')
+        self.client.force_authenticate(user=self.user)
+
+    def test_user_is_marked_deleted(self):
+        response = self.client.delete('/auth/users/me/', {'current_password': '12345'})
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        # the rows are removed by the reclaimer
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.deleted)
+        self.assertFalse(self.user.is_active)
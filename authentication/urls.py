@@ -1,10 +1,16 @@
 from django.urls import path
+from rest_framework.routers import DefaultRouter
 
 from .views import (
-    check_username, check_email
+    check_username, check_email, check_availability, UserViewSet
 )
 
+# replaces the users routes of djoser.urls, included after these
+router = DefaultRouter()
+router.register('users', UserViewSet)
+
 urlpatterns = [
     path('check_username/', check_username),
     path('check_email/', check_email),
-]
+    path('check_availability/', check_availability),
+] + router.urls
@@ -1,12 +1,16 @@
-from django.http import HttpResponse
+from django.db import transaction
+from django.http import HttpResponse, JsonResponse
 from rest_framework.decorators import api_view
 from rest_framework import status
 from django.views.decorators.csrf import csrf_exempt
+from djoser.views import UserViewSet as DjoserUserViewSet
 
 from authentication.backend import AuthBackend
+from board_manager.reclaimer import mark_user_deleted
 from helpers.helper import catch_view_exception
 from .auth_logger import auth_logger
-from .exceptions import AuthenticationException
+from .availability import FIELDS, availability_filter
+from .exceptions import AuthenticationException, FieldNotGivenException, IllegalFieldException
 
 auth_backend = AuthBackend()
 
@@ -31,3 +35,31 @@ def check_email(request):
         return HttpResponse(status=status.HTTP_204_NO_CONTENT)
     except AuthenticationException as e:
         return HttpResponse(content=e.message, status=e.response_status)
+
+
+@csrf_exempt
+@api_view(['POST'])
+@catch_view_exception([], auth_logger)
+def check_availability(request):
+    try:
+        fields = [field for field in FIELDS if request.data.get(field)]
+        if not fields:
+            raise FieldNotGivenException(' or '.join(FIELDS))
+        for field in fields:
+            if not isinstance(request.data[field], str):
+                raise IllegalFieldException(field)
+        availability = {field: availability_filter.is_free(field, request.data[field]) for field in fields}
+        return JsonResponse(availability, status=status.HTTP_200_OK)
+    except AuthenticationException as e:
+        return HttpResponse(content=e.message, status=e.response_status)
+
+
+class UserViewSet(DjoserUserViewSet):
+    def perform_create(self, serializer):
+        # the user and the activation email in the outbox are committed together
+        with transaction.atomic():
+            super().perform_create(serializer)
+
+    def perform_destroy(self, instance):
+        # the boards of the user can be too big to delete in the request
+        mark_user_deleted(instance)
@@ -1,5 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class BoardManagerConfig(AppConfig):
     name = 'board_manager'
+
+    def ready(self):
+        # register the gauges for the metrics endpoint, the receivers invalidating cached responses and the jobs
+        from . import metrics, caching, tasks  # noqa: F401
+
+        # the full-text index is not a model, see search.py
+        from .search import install_search_index
+        post_migrate.connect(install_search_index, sender=self)
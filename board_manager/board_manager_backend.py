@@ -1,46 +1,131 @@
 import random
 import string
 
-from .models import Board, UserBoards, Access, Column
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Board, UserBoards, Access, Column, Node, BoardTemplate
+from .caching import bump, user_boards_key, board_key, columns_key
+from .reclaimer import mark_board_deleted
 
 from .exceptions import (
-    NoRequiredBoardAccess, BoardDoesNotExistException
+    NoRequiredBoardAccess, BoardDoesNotExistException, BoardTemplateDoesNotExistException
 )
 
+DEFAULT_COLUMNS = {Board.BoardTypes.KANBAN: ['TODO', 'IN PROGRESS', 'DONE']}
+
+# copied fields of nodes, the column is kept by position and the lock is not copied
+NODE_FIELDS = ['title', 'description', 'tag', 'link_to', 'color', 'assigned', 'position_x', 'position_y']
+NODES_BATCH_SIZE = 1000
+
 
 class BoardManager:
     @staticmethod
-    def create_board(name, board_type, owner, prev_board_id=None):
-        board = Board.objects.create(name=name,
-                                     board_type=board_type,
-                                     prefix=''.join(random.choices(string.ascii_lowercase, k=5)))
+    def create_board(name, board_type, owner, prev_board_id=None, content=None):
+        """
+        Creates the board with the columns and nodes of `content` (see board_content),
+        by default with the columns of the board type
+        """
+        with transaction.atomic():
+            board = Board.objects.create(name=name,
+                                         board_type=board_type,
+                                         prefix=''.join(random.choices(string.ascii_lowercase, k=5)))
+
+            participants = [UserBoards(board=board, user=owner, access=Access.OWNER)]
+
+            # inherit the user's relationship with the previous board
+            if prev_board_id:
+                for user_id, access in UserBoards.objects.filter(board__id=prev_board_id).values_list('user_id',
+                                                                                                      'access'):
+                    if user_id == owner.pk:
+                        continue
+
+                    if access == Access.OWNER:
+                        access = Access.EDITOR
+
+                    participants.append(UserBoards(user_id=user_id, board=board, access=access))
 
-        UserBoards.objects.create(board=board,
-                                  user=owner,
-                                  access=Access.OWNER)
+            UserBoards.objects.bulk_create(participants)
+
+            if content is None:
+                content = {'columns': [{'name': column, 'position': position}
+                                       for position, column in enumerate(DEFAULT_COLUMNS.get(board_type, []))],
+                           'nodes': []}
+            BoardManager._fill_board(board, content)
 
-        # inherit the user's relationship with the previous board
-        if prev_board_id:
-            participants = []
-            for access_to_board in UserBoards.objects.filter(board__id=prev_board_id).all():
-                if access_to_board.user == owner:
-                    continue
+            # bulk_create sends no signals
+            bump(board_key(board.pk), columns_key(board.pk),
+                 *[user_boards_key(participant.user_id) for participant in participants])
+        return board
 
-                access_to_prev_board = access_to_board.access
+    @staticmethod
+    def _fill_board(board, content):
+        Column.objects.bulk_create([Column(board=board, name=column['name'], position=column['position'])
+                                    for column in content['columns']])
+        # ids of the inserted rows are not returned by every database
+        column_ids = dict(Column.objects.filter(board=board).values_list('position', 'id'))
+
+        Node.objects.bulk_create([Node(board=board,
+                                       status=str(column_ids[node['column']]) if node['column'] in column_ids else None,
+                                       **{field: node[field] for field in NODE_FIELDS if field in node})
+                                  for node in content['nodes']],
+                                 batch_size=NODES_BATCH_SIZE)
 
-                if access_to_prev_board == Access.OWNER:
-                    access_to_prev_board = Access.EDITOR
+    @staticmethod
+    def board_content(board) -> dict:
+        """
+        Columns and nodes of the board, nodes refer to their columns by position
+        """
+        columns = list(Column.objects.filter(board=board).order_by('position').values('id', 'name', 'position'))
+        positions = {str(column['id']): column['position'] for column in columns}
 
-                participants.append(UserBoards(user=access_to_board.user, board=board, access=access_to_prev_board))
+        nodes = []
+        for node in Node.objects.filter(board=board).order_by('id').values('status', *NODE_FIELDS).iterator():
+            node['column'] = positions.get(node.pop('status'))
+            nodes.append(node)
 
-            UserBoards.objects.bulk_create(participants)
+        return {'columns': [{'name': column['name'], 'position': column['position']} for column in columns],
+                'nodes': nodes}
 
-        if board_type == Board.BoardTypes.KANBAN:
-            Column.objects.create(board=board, name='TODO', position=0)
-            Column.objects.create(board=board, name='IN PROGRESS', position=1)
-            Column.objects.create(board=board, name='DONE', position=2)
+    @staticmethod
+    def get_participated_board(board_id, user):
+        try:
+            board = Board.objects.get(pk=board_id)
+        except Board.DoesNotExist:
+            raise BoardDoesNotExistException()
+        if not board.user_boards.filter(user=user).exists():
+            raise NoRequiredBoardAccess('ANY')
         return board
 
+    @staticmethod
+    def clone_board(board_id, user, name=None):
+        """
+        Copies the board with its columns, nodes and participants, the user owns the copy
+        """
+        board = BoardManager.get_participated_board(board_id, user)
+        return BoardManager.create_board(name or board.name, board.board_type, user,
+                                         prev_board_id=board.pk, content=BoardManager.board_content(board))
+
+    @staticmethod
+    def save_template(board_id, user, name=None):
+        board = BoardManager.get_participated_board(board_id, user)
+        return BoardTemplate.objects.create(name=name or board.name,
+                                            board_type=board.board_type,
+                                            owner=user,
+                                            content=BoardManager.board_content(board))
+
+    @staticmethod
+    def get_templates(user):
+        return BoardTemplate.objects.filter(Q(owner=user) | Q(owner__isnull=True)).order_by('-created').all()
+
+    @staticmethod
+    def create_board_from_template(template_id, user, name=None):
+        try:
+            template = BoardManager.get_templates(user).get(pk=template_id)
+        except (BoardTemplate.DoesNotExist, ValueError):
+            raise BoardTemplateDoesNotExistException()
+        return BoardManager.create_board(name or template.name, template.board_type, user, content=template.content)
+
     @staticmethod
     def delete_board(board_id, user):
         try:
@@ -49,13 +134,13 @@ class BoardManager:
             if not board.user_boards.filter(user=user, access=Access.OWNER).exists():
                 raise NoRequiredBoardAccess('OWNER')
 
-            board.delete()
+            mark_board_deleted(board)
         except Board.DoesNotExist:
             raise BoardDoesNotExistException()
 
     @staticmethod
     def get_user_boards(user):
-        return UserBoards.objects.filter(user=user).all()
+        return UserBoards.objects.filter(user=user, board__deleted=False).all()
 
     @staticmethod
     def generate_link(board_id):
@@ -68,7 +153,7 @@ class BoardManager:
     @staticmethod
     def leave_board(board_id, user):
         try:
-            access_to_board = UserBoards.objects.get(board__id=board_id, user=user)
+            access_to_board = UserBoards.objects.get(board__id=board_id, board__deleted=False, user=user)
             if access_to_board.access == Access.OWNER:
                 raise NoRequiredBoardAccess('VIEWER OR EDITOR')
             access_to_board.delete()
@@ -0,0 +1,98 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.http import HttpResponse
+from rest_framework import status
+
+from authentication.models import CustomUser
+from authentication.serializers import UserSerializer
+from helpers.metrics import Counter
+from .models import Access, Board, UserBoards, Column
+
+cached_responses = Counter('cached_responses_total', 'Responses of cached views by result', ['view', 'result'])
+
+
+def user_boards_key(user_id) -> str:
+    return f"version:user_boards:{user_id}"
+
+
+def board_key(board_id) -> str:
+    return f"version:board:{board_id}"
+
+
+def columns_key(board_id) -> str:
+    return f"version:columns:{board_id}"
+
+
+def versions(*keys) -> list:
+    """
+    Returns versions of the keys, new random ones for the unknown keys.
+    Versions are never reused, so a lost version can not reveal an outdated response.
+    """
+    known = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in known}
+    if missing:
+        cache.set_many(missing, timeout=settings.RESPONSE_CACHE['VERSION_TIMEOUT'])
+    return [known.get(key) or missing[key] for key in keys]
+
+
+def bump(*keys):
+    # after the commit, or a request in between could cache the old rows under the new version
+    transaction.on_commit(lambda: cache.set_many({key: uuid.uuid4().hex for key in keys},
+                                                 timeout=settings.RESPONSE_CACHE['VERSION_TIMEOUT']))
+
+
+def make_etag(*parts) -> str:
+    return '"' + hashlib.md5(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest() + '"'
+
+
+def cached_response(request, name, etag, build) -> HttpResponse:
+    """
+    Answers 304 if the client has the current version, otherwise the cached
+    or just built JSON body of the version
+    """
+    if etag in [tag.strip() for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]:
+        cached_responses.inc(view=name, result='not_modified')
+        response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        key = f"response:{name}:{etag}"
+        body = cache.get(key)
+        cached_responses.inc(view=name, result='miss' if body is None else 'hit')
+        if body is None:
+            body = build()
+            cache.set(key, body)
+        response = HttpResponse(body, content_type='application/json', status=status.HTTP_200_OK)
+    response['ETag'] = etag
+    return response
+
+
+@receiver([post_save, post_delete], sender=UserBoards)
+def user_boards_changed(sender, instance, **kwargs):
+    # the list of boards of the user and the owner shown for the board
+    bump(user_boards_key(instance.user_id), board_key(instance.board_id))
+
+
+@receiver([post_save, post_delete], sender=Board)
+def board_changed(sender, instance, **kwargs):
+    bump(board_key(instance.pk))
+
+
+@receiver(post_save, sender=CustomUser)
+def user_changed(sender, instance, created, update_fields=None, **kwargs):
+    # the owner is shown with the boards, not changed e.g. by is_active of an activation
+    if created or update_fields is not None and not set(update_fields) & set(UserSerializer.Meta.fields):
+        return
+    owned_boards = UserBoards.objects.filter(user=instance, access=Access.OWNER).values_list('board_id', flat=True)
+    keys = [board_key(board_id) for board_id in owned_boards]
+    if keys:
+        bump(*keys)
+
+
+@receiver([post_save, post_delete], sender=Column)
+def column_changed(sender, instance, **kwargs):
+    bump(columns_key(instance.board_id))
@@ -1,29 +1,25 @@
 import traceback
 
-from rest_framework import status
-
+from helpers.instrumentation import instrument
 from .logger import boards_logger
+from .protocol import protocol
 
 
-def catch_websocket_exception(required_request_fields):
+def catch_websocket_exception(schema):
+    """
+    Registers the handler with the schema of its message, the message type is the name of the handler
+    """
     def decorator(func):
         def wrap(self, event, *args, **kwargs):
-            # check necessary fields in package
-            for field in required_request_fields:
+            with instrument('websocket', func.__name__, type=event['type'],
+                            board=self.board.pk if self.board is not None else None,
+                            user=self.scope['user'].pk):
+                # catch unknown exceptions, logged with the context of the handler
                 try:
-                    event[field]
-                except KeyError:
-                    message = f"{field} is empty field"
-                    boards_logger.error(message)
-                    self.send_json({'type': event['type'],
-                                    'error_code': 4000 + status.HTTP_404_NOT_FOUND,
-                                    'message': f"{message} in {event}"}, close=True)
-
-            # catch unknown exceptions
-            try:
-                return func(self, event, *args, **kwargs)
-            except Exception as e:
-                boards_logger.error(f"UNKNOWN EXCEPTION {__name__} {e} {traceback.format_exc()}")
-                self.close(4500)
+                    return func(self, event, *args, **kwargs)
+                except Exception as e:
+                    boards_logger.error(f"UNKNOWN EXCEPTION {__name__} {e} {traceback.format_exc()}")
+                    self.close(4500)
+        protocol.register(func.__name__, schema, wrap)
         return wrap
     return decorator
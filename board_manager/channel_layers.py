@@ -0,0 +1,309 @@
+import asyncio
+import random
+import re
+import uuid
+from copy import deepcopy
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from django.utils.module_loading import import_string
+
+from helpers.consistent_hash import ConsistentHashRing
+from helpers.metrics import Counter
+from .logger import boards_logger
+
+local_messages = Counter('channel_layer_local_messages_total',
+                         'Messages delivered to channels of the same process')
+remote_messages = Counter('channel_layer_remote_messages_total',
+                          'Messages sent over the remote channel layers')
+
+owned_group_messages = Counter('channel_layer_owned_group_messages_total',
+                               'Group messages kept in the process owning the group')
+local_group_messages = Counter('channel_layer_local_group_messages_total',
+                               'Group messages kept in the process, no other process has joined the group')
+dropped_messages = Counter('channel_layer_dropped_messages_total',
+                           'Messages from groups dropped because the channel of this process was full')
+
+SHARD_NAME = re.compile(r'^shard(\d+)\.')
+
+
+class LocalFirstChannelLayer(BaseChannelLayer):
+    """
+    Delivers messages to channels of this process directly and sends only the rest over
+    the remote layers (e.g. Redis), sharded by consistent hashing of group names.
+
+    Instead of its channels every process joins a remote group once with its relay channel,
+    so a group message crosses the remote layer once per group send, not once per member.
+    Processes announce joining and leaving a group over it, and a member of a group sends
+    its messages over the remote layer only while other processes are in the group. Messages
+    sent before the announcement of a new member arrives reach it through the replay of board events.
+
+    With `owner_only` the sockets of a group are expected in the process owning it (see board_manager.workers),
+    which sends its group messages only to them. Local members of groups owned by another process
+    get a `board_moved` message, so their sockets reconnect to the owner.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, shards, expiry=60, capacity=100, channel_capacity=None, virtual_nodes=100,
+                 owner_only=False, owners='board_manager.workers.worker_registry'):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        # shards are configs like CHANNEL_LAYERS items or ready layers
+        self.shards = [import_string(shard['BACKEND'])(**shard.get('CONFIG', {})) if isinstance(shard, dict) else shard
+                       for shard in shards]
+        self.ring = ConsistentHashRing(range(len(self.shards)), virtual_nodes)
+        self.process_id = uuid.uuid4().hex[:12]
+
+        self.local_channels = {}
+        self.channel_loops = {}  # channel -> event loop of its consumer, which owns the queue
+        self.local_groups = {}
+        self.remote_members = {}  # group -> ids of the other processes in it, known to members only
+        self.remote_receives = {}
+        self.relay_channels = None
+        self.relay_tasks = []
+
+        self.owner_only = owner_only
+        # import path or an object with owns_group(group), is_moved(group) and version
+        self._owners = owners
+        self._owners_version = None
+
+    @property
+    def owners(self):
+        if isinstance(self._owners, str):
+            self._owners = import_string(self._owners)
+        return self._owners
+
+    def _move_groups(self):
+        if self.owners.version == self._owners_version:
+            return
+        self._owners_version = self.owners.version
+        for group in list(self.local_groups):
+            if self.owners.is_moved(group):
+                self._send_to_local_group(group, {'type': 'board_moved', 'group': group})
+
+    def _shard_index(self, name) -> int:
+        # channels of this layer are named after their shard, the others are hashed
+        match = SHARD_NAME.match(name)
+        if match is not None and int(match.group(1)) < len(self.shards):
+            return int(match.group(1))
+        return self.ring.get_node(name)
+
+    def _shard(self, name):
+        return self.shards[self._shard_index(name)]
+
+    def _local_queue(self, channel) -> asyncio.Queue:
+        if channel not in self.local_channels:
+            self.local_channels[channel] = asyncio.Queue()
+            self.channel_loops[channel] = asyncio.get_running_loop()
+        return self.local_channels[channel]
+
+    def _put_local(self, channel, message) -> bool:
+        queue, loop = self.local_channels[channel], self.channel_loops.get(channel)
+        if queue.qsize() >= self.get_capacity(channel):
+            dropped_messages.inc()
+            return False
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if loop is None or loop is running_loop:
+            queue.put_nowait(message)
+        else:
+            # e.g. a group_send of a job thread, the queue can be changed only in the loop of its consumer
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, message)
+            except RuntimeError:
+                # the loop has been closed with the consumer
+                dropped_messages.inc()
+                return False
+        local_messages.inc()
+        return True
+
+    # Channel layer API
+
+    async def new_channel(self, prefix='specific.'):
+        index = random.randrange(len(self.shards))
+        channel = await self.shards[index].new_channel(prefix=f"shard{index}.{prefix}")
+        self._local_queue(channel)
+        return channel
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+
+        if channel in self.local_channels:
+            if not self._put_local(channel, deepcopy(message)):
+                raise ChannelFull(channel)
+        else:
+            remote_messages.inc()
+            await self._shard(channel).send(channel, message)
+
+    async def receive(self, channel):
+        """
+        Waits for a message sent either directly in this process or over the remote layer
+        """
+        assert self.valid_channel_name(channel)
+        if self.owner_only:
+            self._move_groups()
+        queue = self._local_queue(channel)
+        if channel not in self.remote_receives:
+            self.remote_receives[channel] = asyncio.ensure_future(self._shard(channel).receive(channel))
+        remote_receive = self.remote_receives[channel]
+        local_receive = asyncio.ensure_future(queue.get())
+
+        try:
+            done, _ = await asyncio.wait([local_receive, remote_receive], return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            # nobody is going to receive from the channel anymore
+            local_receive.cancel()
+            remote_receive.cancel()
+            self._forget_channel(channel)
+            raise
+
+        if remote_receive in done:
+            del self.remote_receives[channel]
+            if local_receive in done:
+                queue.put_nowait(remote_receive.result())
+            else:
+                local_receive.cancel()
+                return remote_receive.result()
+        return local_receive.result()
+
+    def _forget_channel(self, channel):
+        self.local_channels.pop(channel, None)
+        self.channel_loops.pop(channel, None)
+        self.remote_receives.pop(channel, None)
+        for group, channels in list(self.local_groups.items()):
+            channels.discard(channel)
+
+    # Groups extension
+
+    async def _start_relay(self):
+        if self.relay_channels is not None:
+            return
+        self.relay_channels = [await shard.new_channel(prefix=f"shard{index}.relay")
+                               for index, shard in enumerate(self.shards)]
+        self.relay_tasks = [asyncio.ensure_future(self._relay(shard, relay_channel))
+                            for shard, relay_channel in zip(self.shards, self.relay_channels)]
+
+    async def _relay(self, shard, relay_channel):
+        while True:
+            try:
+                relayed = await shard.receive(relay_channel)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                boards_logger.error(f"Unable to receive relayed messages {e}")
+                await asyncio.sleep(1)
+                continue
+
+            if relayed['origin'] == self.process_id:
+                continue
+            if 'membership' in relayed:
+                await self._update_membership(shard, relayed)
+            else:
+                self._send_to_local_group(relayed['group'], relayed['message'])
+
+    async def _update_membership(self, shard, relayed):
+        group, origin = relayed['group'], relayed['origin']
+        if group not in self.local_groups:
+            return
+        if relayed['membership'] == 'leave':
+            self.remote_members.get(group, set()).discard(origin)
+            return
+        self.remote_members.setdefault(group, set()).add(origin)
+        if relayed['membership'] == 'join':
+            # the new member learns about this process
+            try:
+                await shard.send(relayed['relay'], {'origin': self.process_id,
+                                                    'group': group,
+                                                    'membership': 'present'})
+            except Exception as e:
+                boards_logger.error(f"Unable to answer the new member of the group {group} {e}")
+
+    async def _announce(self, group, membership):
+        index = self._shard_index(group)
+        await self.shards[index].group_send(group, {'origin': self.process_id,
+                                                    'group': group,
+                                                    'membership': membership,
+                                                    'relay': self.relay_channels[index]})
+
+    def _send_to_local_group(self, group, message):
+        channels = self.local_groups.get(group, ())
+        if channels:
+            message = deepcopy(message)
+        for channel in list(channels):
+            if channel in self.local_channels and not self._put_local(channel, message):
+                boards_logger.warning(f"Channel {channel} is full, a message of the group {group} is dropped")
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+
+        if channel not in self.local_channels:
+            raise ValueError("Only channels of this process can be added to groups")
+
+        await self._start_relay()
+        joined = group not in self.local_groups
+        self.local_groups.setdefault(group, set()).add(channel)
+        if self.owner_only and self.owners.is_moved(group):
+            self._put_local(channel, {'type': 'board_moved', 'group': group})
+        # refresh the membership of the process, remote layers expire groups
+        await self._shard(group).group_add(group, self.relay_channels[self._shard_index(group)])
+        if joined:
+            await self._announce(group, 'join')
+
+    async def group_discard(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+
+        channels = self.local_groups.get(group, set())
+        if channel not in channels:
+            return
+
+        channels.discard(channel)
+        if not channels:
+            self.local_groups.pop(group, None)
+            self.remote_members.pop(group, None)
+            await self._shard(group).group_discard(group, self.relay_channels[self._shard_index(group)])
+            await self._announce(group, 'leave')
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        assert self.valid_group_name(group), "Group name not valid"
+
+        self._send_to_local_group(group, message)
+        if self.owner_only and self.owners.owns_group(group):
+            owned_group_messages.inc()
+            return
+        # a process which is not in the group, e.g. of a job, does not know its members
+        if group in self.local_groups and not self.remote_members.get(group):
+            local_group_messages.inc()
+            return
+
+        # members in the other processes
+        remote_messages.inc()
+        await self._shard(group).group_send(group, {'origin': self.process_id,
+                                                    'group': group,
+                                                    'message': message})
+
+    # Flush extension
+
+    async def flush(self):
+        for task in self.relay_tasks + list(self.remote_receives.values()):
+            task.cancel()
+        self.local_channels = {}
+        self.channel_loops = {}
+        self.local_groups = {}
+        self.remote_members = {}
+        self.remote_receives = {}
+        self.relay_channels = None
+        self.relay_tasks = []
+        for shard in self.shards:
+            if hasattr(shard, 'flush'):
+                await shard.flush()
+
+    async def close(self):
+        for shard in self.shards:
+            if hasattr(shard, 'close'):
+                await shard.close()
@@ -0,0 +1,117 @@
+import json
+import zlib
+
+from django.conf import settings
+
+from helpers.metrics import Counter
+from .exceptions import MessageTooBigException, UndecodableMessageException
+
+try:
+    import msgpack
+except ImportError:  # the binary protocol is optional
+    msgpack = None
+
+# the first byte of compressed binary frames, neither JSON nor MessagePack messages start with it
+COMPRESSED_FRAME_MARKER = b'\x00'
+# incoming compressed messages can not be inflated beyond it
+MAX_DECOMPRESSED_SIZE = 8 * 1024 * 1024
+
+compressed_frames = Counter('websocket_compressed_frames_total',
+                            'Websocket messages sent compressed', ['subprotocol'])
+compression_raw_bytes = Counter('websocket_compression_raw_bytes_total',
+                                'Size of websocket messages before compression', ['subprotocol'])
+compression_saved_bytes = Counter('websocket_compression_saved_bytes_total',
+                                  'Bytes saved by compression of websocket messages', ['subprotocol'])
+
+
+class JsonCodec:
+    """
+    Codecs encode messages to str for text frames or to bytes for binary frames
+    """
+    subprotocol = 'json'
+
+    @staticmethod
+    def encode(content):
+        return json.dumps(content)
+
+    @staticmethod
+    def decode(data):
+        return json.loads(data)
+
+
+class MsgPackCodec:
+    subprotocol = 'msgpack'
+
+    @staticmethod
+    def encode(content):
+        return msgpack.packb(content, use_bin_type=True)
+
+    @staticmethod
+    def decode(data):
+        return msgpack.unpackb(data, raw=False)
+
+
+class DeflateCodec:
+    """
+    Sends messages of the wrapped codec bigger than the threshold as binary frames:
+    COMPRESSED_FRAME_MARKER followed by the zlib stream of the encoded message
+    """
+
+    def __init__(self, codec):
+        self.codec = codec
+        self.subprotocol = f'{codec.subprotocol}+deflate'
+
+    def encode(self, content):
+        data = self.codec.encode(content)
+        raw = data.encode('utf-8') if isinstance(data, str) else data
+        threshold = settings.WEBSOCKET_COMPRESSION['THRESHOLD']
+        if threshold is None or len(raw) < threshold:
+            return data
+
+        compressed = COMPRESSED_FRAME_MARKER + zlib.compress(raw, settings.WEBSOCKET_COMPRESSION['LEVEL'])
+        if len(compressed) >= len(raw):
+            return data
+
+        compressed_frames.inc(subprotocol=self.subprotocol)
+        compression_raw_bytes.inc(len(raw), subprotocol=self.subprotocol)
+        compression_saved_bytes.inc(len(raw) - len(compressed), subprotocol=self.subprotocol)
+        return compressed
+
+    def decode(self, data):
+        if isinstance(data, bytes) and data.startswith(COMPRESSED_FRAME_MARKER):
+            decompressor = zlib.decompressobj()
+            data = decompressor.decompress(data[len(COMPRESSED_FRAME_MARKER):], MAX_DECOMPRESSED_SIZE)
+            if decompressor.unconsumed_tail:
+                raise MessageTooBigException()
+        return self.codec.decode(data)
+
+
+CODECS = {}
+for base_codec in [JsonCodec] + ([MsgPackCodec] if msgpack is not None else []):
+    for codec in (base_codec, DeflateCodec(base_codec)):
+        CODECS[codec.subprotocol] = codec
+
+
+# errors of corrupt messages, msgpack raises some which are not ValueError
+DECODE_ERRORS = (ValueError, TypeError, zlib.error) + \
+    ((msgpack.exceptions.UnpackException,) if msgpack is not None else ())
+
+
+def decode_message(codec, data):
+    """
+    Decodes a received message, UndecodableMessageException if it is corrupt
+    """
+    try:
+        return codec.decode(data)
+    except DECODE_ERRORS:
+        raise UndecodableMessageException()
+
+
+def choose_codec(subprotocols):
+    """
+    Returns the first codec supported from the subprotocols offered by the client, JSON by default
+    """
+    for subprotocol in subprotocols:
+        if subprotocol in CODECS:
+            return CODECS[subprotocol]
+    return JsonCodec
@@ -1,5 +1,6 @@
 import datetime
 
+from django.conf import settings
 from channels.generic.websocket import JsonWebsocketConsumer
 from asgiref.sync import async_to_sync
 from django.db.models import F
@@ -20,8 +21,20 @@ from .serializers import (
     BoardSerializer, NodeSerializer, ColumnSerializer
 )
 
-from .exceptions import BoardManagerException
+from .exceptions import BoardManagerException, TextRevisionTooOldException
 from .catch_websocket_exceptions import catch_websocket_exception
+from .protocol import protocol, Optional, MapOf, Integer, ID, NULL
+from .event_buffer import board_events
+from .codecs import choose_codec, decode_message, JsonCodec
+from .flow_control import RateLimiter, OutboundQueue, throttled_messages
+from .traffic_recording import traffic_recorder
+from .metrics import open_sockets
+from .caching import bump, columns_key
+from .jobs import enqueue
+from .search import search_nodes
+from helpers.context import handler_context
+from helpers.instrumentation import payload_size
+from .text_editing import text_documents, TextOperation
 
 
 class BoardEditorConsumer(JsonWebsocketConsumer):
@@ -31,9 +44,25 @@ class BoardEditorConsumer(JsonWebsocketConsumer):
         self.room_group_name = None
         self.room = None
         self.board = None
+        self.codec = JsonCodec
+        self.outbound_queue = None
+        self.rate_limiter = RateLimiter(settings.WEBSOCKET_FLOW_CONTROL['CONNECTION_RATE_LIMIT'],
+                                        settings.WEBSOCKET_FLOW_CONTROL['MESSAGE_RATE_LIMITS'])
+
+    @property
+    def channel_receive(self):
+        return self.outbound_queue.receive
+
+    @channel_receive.setter
+    def channel_receive(self, receive):
+        # messages from the channel layer go through the outbound queue of the socket
+        self.outbound_queue = OutboundQueue(receive, settings.WEBSOCKET_FLOW_CONTROL['OUTBOUND_QUEUE_SIZE'])
 
     def connect(self):
-        self.accept()
+        # negotiate the protocol of messages, JSON if the client did not ask for any
+        subprotocols = self.scope.get('subprotocols', [])
+        self.codec = choose_codec(subprotocols)
+        self.accept(self.codec.subprotocol if self.codec.subprotocol in subprotocols else None)
 
         # get current user
         try:
@@ -44,7 +73,7 @@ class BoardEditorConsumer(JsonWebsocketConsumer):
         except InvalidToken as e:
             self.close_connection(e.status_code)
 
-        if not self.scope['user'].is_authenticated:
+        if not self.scope['user'].is_authenticated or self.scope['user'].deleted:
             self.close_connection(status.HTTP_401_UNAUTHORIZED)
 
         # get board
@@ -67,6 +96,7 @@ class BoardEditorConsumer(JsonWebsocketConsumer):
         async_to_sync(self.channel_layer.group_add)(self.room_group_name,
                                                     self.channel_name)
         self.room = Room.objects.add(self.room_group_name, self.channel_name, self.scope["user"])
+        open_sockets.inc()
 
         user_serializer = UserWithAccessSerializer(access_to_board)
 
@@ -79,18 +109,52 @@ class BoardEditorConsumer(JsonWebsocketConsumer):
         self.send_json({'type': 'board_info',
                         'board': BoardSerializer(self.board).data})
 
+        self.send_json({'type': 'last_event',
+                        **board_events.last_event(self.board.pk)})
+
         if Presence.objects.filter(user=self.scope['user'], room=self.room).count() == 1:
             self.send_to_group({'type': 'new_user',
                                 'user': user_serializer.data})
 
+        traffic_recorder.connected(self)
+
     def close_connection(self, http_code):
         self.close(4000 + http_code)
         raise StopConsumer()
 
+    def receive(self, text_data=None, bytes_data=None, **kwargs):
+        data = text_data if text_data is not None else bytes_data
+        try:
+            content = decode_message(self.codec, data)
+        except BoardManagerException as e:
+            # the client does not speak the protocol it asked for
+            self.close(4000 + e.response_status)
+            return
+        payload_size.observe(len(data), kind='websocket', handler=protocol.known_type(content), direction='received')
+        self.receive_json(content, **kwargs)
+
+    def send_json(self, content, close=False):
+        data = self.codec.encode(content)
+        # the handler sending it, the types of the messages may come from clients
+        context = handler_context.get()
+        payload_size.observe(len(data), kind='websocket', direction='sent',
+                             handler=context['handler'] if context else protocol.known_type(content))
+        if isinstance(data, bytes):
+            self.send(bytes_data=data, close=close)
+        else:
+            self.send(text_data=data, close=close)
+
     def send_content(self, content):
         self.send_json(content['content'])
 
+    def board_moved(self, event):
+        # another worker owns the board now, the client reconnects to it through the load balancer,
+        # the texts edited here are saved for it
+        text_documents.close(self.board.pk)
+        self.close(4000 + status.HTTP_307_TEMPORARY_REDIRECT)
+
     def send_to_group(self, content):
+        content = board_events.append(self.board.pk, content)
         async_to_sync(self.channel_layer.group_send)(
             self.room_group_name, {'type': 'send_content',
                                    'content': content})
@@ -102,9 +166,40 @@ class BoardEditorConsumer(JsonWebsocketConsumer):
 
     @touch_presence
     def receive_json(self, content, **kwargs):
-        getattr(self, content['type'])(content)
+        traffic_recorder.received(self, content)
+        # invalid messages are throttled too, the unknown types share one limit
+        message_type = protocol.known_type(content)
+        if not self.rate_limiter.allow(message_type):
+            throttled_messages.inc(type=message_type)
+            self.send_error(protocol.known_type(content, None), status.HTTP_429_TOO_MANY_REQUESTS, "Too many messages")
+            return
 
-    @catch_websocket_exception([])
+        # only registered messages matching their schemas reach the handlers
+        try:
+            message = protocol.get(content)
+        except BoardManagerException as e:
+            self.send_error(protocol.known_type(content, None), e.response_status, e.message)
+            return
+        message.handler(self, content)
+
+    @catch_websocket_exception({})
+    def protocol_info(self, event):
+        self.send_json({**event, **protocol.describe()})
+
+    @catch_websocket_exception({'seq': int, 'epoch': Optional(str)})
+    def missed_events(self, event):
+        events = board_events.events_after(self.board.pk, int(event['seq']), event.get('epoch'))
+        if events is None:
+            # the buffer has been rolled over, only a full reload can help
+            self.send_json({**event,
+                            'reload': True,
+                            **board_events.last_event(self.board.pk)})
+        else:
+            self.send_json({**event,
+                            'reload': False,
+                            'events': events})
+
+    @catch_websocket_exception({})
     def active_users(self, event):
         users = self.room.get_users()
         users_with_accesses = UserBoards.objects.filter(user__in=users, board=self.board).all()
@@ -112,14 +207,14 @@ class BoardEditorConsumer(JsonWebsocketConsumer):
         self.send_json({**event,
                         'users': serializer.data})
 
-    @catch_websocket_exception([])
+    @catch_websocket_exception({})
     def all_users(self, event):
         all_users = UserBoards.objects.filter(board=self.board).all()
         serializer = UserWithAccessSerializer(all_users, many=True)
         self.send_json({**event,
                         'users': serializer.data})
 
-    @catch_websocket_exception(['new_access'])
+    @catch_websocket_exception({'new_access': int})
     def change_link_access(self, event):
         self.board.refresh_from_db()
         self.board.link_access = event['new_access']
@@ -127,7 +222,7 @@ class BoardEditorConsumer(JsonWebsocketConsumer):
         self.board.save()
         self.send_to_group(event)
 
-    @catch_websocket_exception(['another_user_id', 'new_access'])
+    @catch_websocket_exception({'another_user_id': ID, 'new_access': int})
     def change_user_access(self, event):
         another_user = UserBoards.objects.get(user__id=event['another_user_id'], board=self.board)
 
@@ -144,18 +239,21 @@ class BoardEditorConsumer(JsonWebsocketConsumer):
             self.send_to_group({'type': event['type'],
                                 'user': user_serializer.data})
 
-    @catch_websocket_exception([])
+    @catch_websocket_exception({})
     def board_info(self, event):
         self.board.refresh_from_db()
         board_serializer = BoardSerializer(self.board)
         self.send_json({**event,
                         'board': board_serializer.data})
 
-    @catch_websocket_exception(['config'])
+    @catch_websocket_exception({'config': {'name': Optional(str),
+                                           'board_type': Optional(str),
+                                           'prefix': Optional(str)}})
     def change_board_config(self, event):
         self.board.refresh_from_db()
         for field in event['config']:
-            setattr(self.board, field, event['config'][field])
+            if self.board.can_be_changed(field):
+                setattr(self.board, field, event['config'][field])
         self.board.updated = datetime.datetime.now()
         self.board.save()
 
@@ -168,12 +266,26 @@ class BoardEditorConsumer(JsonWebsocketConsumer):
                             'node': NodeSerializer(node).data,
                             'channel_name': self.channel_name})
 
-    @catch_websocket_exception([])
+    @catch_websocket_exception({})
     def board_nodes(self, event):
+        text_documents.flush(self.board.pk)
         self.send_json({'type': 'board_nodes',
                         'nodes': NodeSerializer(self.board.nodes.all(), many=True).data})
 
-    @catch_websocket_exception(['node_id'])
+    @catch_websocket_exception({'query': str, 'page': Optional(int), 'all_boards': Optional(bool)})
+    def search_nodes(self, event):
+        # texts being edited are searched as saved
+        text_documents.flush(self.board.pk)
+        try:
+            results = search_nodes(self.scope['user'], event['query'],
+                                   None if event.get('all_boards') else self.board.pk,
+                                   event.get('page', 1))
+        except BoardManagerException as e:
+            self.send_error('search_nodes', e.response_status, e.message)
+            return
+        self.send_json({'type': 'search_results', **results})
+
+    @catch_websocket_exception({'node_id': ID})
     def start_changing_node(self, event):
         try:
             node = Node.objects.get(id=event['node_id'])
@@ -187,7 +299,14 @@ class BoardEditorConsumer(JsonWebsocketConsumer):
         node.save()
         self.send_change_node(node)
 
-    @catch_websocket_exception(['node'])
+    @catch_websocket_exception({'node': {'id': ID,
+                                         'title': Optional(str),
+                                         'description': Optional(str),
+                                         'link_to': Optional(str),
+                                         'status': Optional((str, int, NULL)),
+                                         'assigned': Optional((str, NULL)),
+                                         'position_x': Optional((int, float)),
+                                         'position_y': Optional((int, float))}})
     def changing_node(self, event):
         try:
             node = Node.objects.get(id=event['node']['id'])
@@ -199,6 +318,9 @@ class BoardEditorConsumer(JsonWebsocketConsumer):
                             'node': NodeSerializer(node).data})
             return
 
+        # texts edited together are saved first, or the node would overwrite them with the old ones
+        text_documents.close_node(self.board.pk, node.pk)
+        node.refresh_from_db()
         for field in event['node']:
             if node.can_be_changed(field):
                 setattr(node, field, event['node'][field])
@@ -211,7 +333,7 @@ class BoardEditorConsumer(JsonWebsocketConsumer):
 
         self.send_change_node(node)
 
-    @catch_websocket_exception(['node_id'])
+    @catch_websocket_exception({'node_id': ID})
     def stop_changing_node(self, event):
         try:
             node = Node.objects.get(id=event['node_id'])
@@ -225,7 +347,52 @@ class BoardEditorConsumer(JsonWebsocketConsumer):
         node.save()
         self.send_change_node(node)
 
-    @catch_websocket_exception([])
+    @catch_websocket_exception({'node_id': ID, 'field': str})
+    def node_text(self, event):
+        try:
+            document = text_documents.get(self.board, event['node_id'], event['field'])
+        except Node.DoesNotExist:
+            return
+        except BoardManagerException as e:
+            self.send_error(event['type'], e.response_status, e.message)
+            return
+        self.send_json({**event,
+                        'text': document.text,
+                        'revision': document.revision})
+
+    @catch_websocket_exception({'node_id': ID,
+                                'field': str,
+                                'revision': int,
+                                'operation': {'position': int, 'delete': Optional(int), 'insert': Optional(str)}})
+    def edit_node_text(self, event):
+        # no lock is needed, concurrent operations are transformed against each other
+        try:
+            document, operation, revision = text_documents.apply(self.board, event['node_id'], event['field'],
+                                                                 TextOperation.from_dict(event['operation']),
+                                                                 int(event['revision']))
+        except Node.DoesNotExist:
+            return
+        except TextRevisionTooOldException:
+            # the client has to start again from the current text
+            self.node_text({'type': 'node_text',
+                            'node_id': event['node_id'],
+                            'field': event['field']})
+            return
+        except BoardManagerException as e:
+            self.send_error(event['type'], e.response_status, e.message)
+            return
+
+        self.send_to_group({'type': 'node_text_edited',
+                            'node_id': document.node_id,
+                            'field': document.field,
+                            'operation': operation.to_dict(),
+                            'revision': revision,
+                            'channel_name': self.channel_name})
+
+        if document.need_snapshot():
+            document.snapshot()
+
+    @catch_websocket_exception({'status': (str, int, NULL)})
     def create_node(self, event):
         self.board.refresh_from_db()
         self.board.updated = datetime.datetime.now()
@@ -243,7 +410,7 @@ class BoardEditorConsumer(JsonWebsocketConsumer):
         self.send_to_group({'type': "node_created",
                             'node': NodeSerializer(node).data})
 
-    @catch_websocket_exception(['node_id'])
+    @catch_websocket_exception({'node_id': ID})
     def delete_node(self, event):
         try:
             node = Node.objects.get(id=event['node_id'])
@@ -255,6 +422,7 @@ class BoardEditorConsumer(JsonWebsocketConsumer):
             return
         node_id = node.pk
         node.delete()
+        text_documents.discard(self.board.pk, node_id)
 
         self.board.refresh_from_db()
         self.board.updated = datetime.datetime.now()
@@ -264,14 +432,14 @@ class BoardEditorConsumer(JsonWebsocketConsumer):
                             "node_id": node_id
                             })
 
-    @catch_websocket_exception([])
+    @catch_websocket_exception({})
     def columns_info(self, event):
         columns = Column.objects.filter(board=self.board).order_by('position').all()
         column_serializer = ColumnSerializer(columns, many=True)
         self.send_json({**event,
                         'columns': column_serializer.data})
 
-    @catch_websocket_exception(['position'])
+    @catch_websocket_exception({'position': Integer()})
     def create_column(self, event):
         self.board.refresh_from_db()
         self.board.updated = datetime.datetime.now()
@@ -284,7 +452,7 @@ class BoardEditorConsumer(JsonWebsocketConsumer):
         self.send_to_group({'type': 'column_created',
                         'column': column_serializer.data})
 
-    @catch_websocket_exception(['column_id'])
+    @catch_websocket_exception({'column_id': ID})
     def delete_column(self, event):
         self.board.refresh_from_db()
         self.board.updated = datetime.datetime.now()
@@ -300,11 +468,12 @@ class BoardEditorConsumer(JsonWebsocketConsumer):
         data = ColumnSerializer(old_column).data
         old_column.delete()
         Column.objects.filter(board=self.board, position__gt=old_column.position).all().update(position=F('position')-1)
+        bump(columns_key(self.board.pk))  # update() sends no signals
 
         self.send_to_group({'type': 'column_deleted',
                         'column': data})
 
-    @catch_websocket_exception(['column'])
+    @catch_websocket_exception({'column': {'id': ID, 'name': Optional(str)}})
     def changing_column(self, event):
         self.board.refresh_from_db()
         self.board.updated = datetime.datetime.now()
@@ -326,23 +495,28 @@ class BoardEditorConsumer(JsonWebsocketConsumer):
             "channel": self.channel_name
         })
 
-    @catch_websocket_exception(['board_id', 'columns'])
+    @catch_websocket_exception({'board_id': str, 'columns': MapOf(ID, ID)})
     def migrate_to_another_board(self, event):
-        self.board.refresh_from_db()
-        self.board.updated = datetime.datetime.now()
-        self.board.save()
-        to_board = Board.objects.get(id=event['board_id'])
-        nodes = Node.objects.filter(board=self.board).all()
-        for node in nodes:
-            node.board = to_board
-            node.status = event['columns'][node.status]
-            print("STATUS", node.status)
-            node.save()
-        to_board.updated = datetime.datetime.now()
-        to_board.save()
+        # the status of the job is pushed to the group
+        enqueue('migrate_to_another_board',
+                {'board_id': self.board.pk, 'to_board_id': event['board_id'], 'columns': event['columns']},
+                board_id=self.board.pk,
+                user=self.scope['user'])
 
     @remove_presence
     def disconnect(self, code):
+        traffic_recorder.disconnected(self)
+        # the connection was refused before it joined the board
+        if self.room is None:
+            return
+        open_sockets.dec()
+
+        # save texts edited together
+        if Presence.objects.filter(room=self.room).exists():
+            text_documents.flush(self.board.pk)
+        else:
+            text_documents.close(self.board.pk)
+
         # leave room
         if not Presence.objects.filter(user=self.scope['user'], room=self.room).exists():
             self.send_to_group({'type': 'delete_user',
@@ -0,0 +1,75 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache as default_cache
+
+
+class BoardEventBuffer:
+    """
+    Keeps the last events of every board stamped with a per-board sequence number,
+    so that a reconnecting client can replay everything it missed after some sequence.
+
+    The counters and the events are kept in the cache, so the workers sharing a Redis cache
+    number the events of a board together. A board without events for `timeout` seconds is forgotten.
+    Sequence numbers are only meaningful together with the epoch of the board,
+    which changes every time its counter is started again (e.g. after it was forgotten).
+    """
+
+    def __init__(self, size, timeout, cache=default_cache):
+        self.size = size
+        self.timeout = timeout
+        self.cache = cache
+
+    @staticmethod
+    def _key(board_id, name) -> str:
+        return f"board_events:{board_id}:{name}"
+
+    def append(self, board_id, event) -> dict:
+        seq_key, epoch_key = self._key(board_id, 'seq'), self._key(board_id, 'epoch')
+        try:
+            seq = self.cache.incr(seq_key)
+        except ValueError:
+            # a new counter, only the worker which created it starts the epoch
+            if self.cache.add(seq_key, 0, self.timeout):
+                self.cache.set(epoch_key, uuid.uuid4().hex, self.timeout)
+            seq = self.cache.incr(seq_key)
+        self.cache.touch(seq_key, self.timeout)
+        self.cache.touch(epoch_key, self.timeout)
+
+        stamped_event = {**event, 'seq': seq}
+        self.cache.set(self._key(board_id, seq), stamped_event, self.timeout)
+        self.cache.delete(self._key(board_id, seq - self.size))
+        return stamped_event
+
+    def last_event(self, board_id) -> dict:
+        """
+        Sequence number and epoch of the last event of the board, sent to the connected clients
+        """
+        values = self.cache.get_many([self._key(board_id, 'seq'), self._key(board_id, 'epoch')])
+        return {'seq': values.get(self._key(board_id, 'seq'), 0),
+                'epoch': values.get(self._key(board_id, 'epoch'))}
+
+    def last_seq(self, board_id) -> int:
+        return self.last_event(board_id)['seq']
+
+    def events_after(self, board_id, seq, epoch=None):
+        """
+        Returns events of the board with sequence greater than seq
+        or None if some of them have already been rolled over and the client has to reload the board
+        """
+        last_event = self.last_event(board_id)
+        last_seq = last_event['seq']
+        if epoch not in (None, last_event['epoch']) or seq > last_seq or last_seq - seq > self.size:
+            return None
+        if seq == last_seq:
+            return []
+
+        keys = [self._key(board_id, number) for number in range(seq + 1, last_seq + 1)]
+        events = self.cache.get_many(keys)
+        if len(events) < len(keys):
+            return None
+        return [events[key] for key in keys]
+
+
+board_events = BoardEventBuffer(settings.BOARD_EVENTS_BUFFER['SIZE'],
+                                settings.BOARD_EVENTS_BUFFER['TIMEOUT'])
@@ -30,3 +30,54 @@ class BoardAlreadyRunningException(BoardManagerException):
 class BoardNotRunningException(BoardManagerException):
     def __init__(self, board):
         super().__init__(f"The board {board} is not running", status.HTTP_409_CONFLICT)
+
+
+class TextRevisionTooOldException(BoardManagerException):
+    def __init__(self, revision):
+        super().__init__(f"The text has been changed too much since the revision, the last one is {revision}",
+                         status.HTTP_409_CONFLICT)
+
+
+class IllegalTextOperationException(BoardManagerException):
+    def __init__(self):
+        super().__init__("Unable to apply the text operation", status.HTTP_406_NOT_ACCEPTABLE)
+
+
+class InvalidMessageException(BoardManagerException):
+    def __init__(self, message):
+        super().__init__(message, status.HTTP_400_BAD_REQUEST)
+
+
+class UndecodableMessageException(BoardManagerException):
+    def __init__(self):
+        super().__init__("Unable to decode the message", status.HTTP_400_BAD_REQUEST)
+
+
+class MessageTooBigException(BoardManagerException):
+    def __init__(self):
+        super().__init__("Decompressed message is too big", status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+
+class UnknownMessageTypeException(BoardManagerException):
+    def __init__(self, message_type):
+        super().__init__(f"Unknown message type {message_type}", status.HTTP_404_NOT_FOUND)
+
+
+class BoardTemplateDoesNotExistException(BoardManagerException):
+    def __init__(self):
+        super().__init__("Such board template does not exist", status.HTTP_404_NOT_FOUND)
+
+
+class JobDoesNotExistException(BoardManagerException):
+    def __init__(self):
+        super().__init__("Such job does not exist", status.HTTP_404_NOT_FOUND)
+
+
+class EmptySearchQueryException(BoardManagerException):
+    def __init__(self):
+        super().__init__("The search query has no words", status.HTTP_400_BAD_REQUEST)
+
+
+class InvalidSearchPageException(BoardManagerException):
+    def __init__(self):
+        super().__init__("page and page_size must be numbers", status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,126 @@
+import asyncio
+import time
+from collections import deque
+
+from helpers.metrics import Counter
+
+throttled_messages = Counter('websocket_throttled_messages_total',
+                             'Incoming websocket messages rejected by rate limits', ['type'])
+collapsed_messages = Counter('websocket_collapsed_messages_total',
+                             'Outgoing websocket messages replaced by newer ones of the same node', ['type'])
+dropped_messages = Counter('websocket_dropped_messages_total',
+                           'Outgoing websocket messages dropped because the client fell behind', ['type'])
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+
+    def has_token(self) -> bool:
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens >= 1
+
+    def consume(self) -> bool:
+        if not self.has_token():
+            return False
+        self.tokens -= 1
+        return True
+
+
+class RateLimiter:
+    """
+    Token buckets of one connection: one for all messages and one per message type,
+    a message takes a token from both only if both have one
+    """
+
+    def __init__(self, connection_limit, message_limits, clock=time.monotonic):
+        self.clock = clock
+        self.message_limits = message_limits
+        self.connection_bucket = TokenBucket(*connection_limit, clock=clock)
+        self.message_buckets = {}
+
+    def allow(self, message_type) -> bool:
+        if message_type not in self.message_buckets:
+            limit = self.message_limits.get(message_type, self.message_limits['default'])
+            self.message_buckets[message_type] = TokenBucket(*limit, clock=self.clock)
+        buckets = (self.message_buckets[message_type], self.connection_bucket)
+        if not all(bucket.has_token() for bucket in buckets):
+            return False
+        for bucket in buckets:
+            bucket.consume()
+        return True
+
+
+def _collapse_key(message):
+    # only the last state of a node matters to a client which has not received the previous ones yet
+    content = message.get('content')
+    if message.get('type') == 'send_content' and isinstance(content, dict) and content.get('type') == 'node_changed':
+        return content['type'], content['node']['id']
+    return None
+
+
+class OutboundQueue:
+    """
+    Takes messages for one socket from the channel layer as soon as they arrive,
+    so that the channel of the socket does not overflow, and hands them to the consumer one by one.
+    When the consumer falls behind, superseded updates of the same node are collapsed
+    and the oldest messages are dropped beyond max_size.
+    """
+
+    def __init__(self, receive, max_size):
+        self.max_size = max_size
+        self._receive = receive
+        self._messages = deque()
+        self._has_messages = asyncio.Event()
+        self._pump = None
+        self._error = None
+
+    async def receive(self):
+        if self._pump is None:
+            self._pump = asyncio.ensure_future(self._pump_messages())
+
+        try:
+            while not self._messages:
+                if self._error is not None:
+                    raise self._error
+                self._has_messages.clear()
+                await self._has_messages.wait()
+        except asyncio.CancelledError:
+            # the consumer has finished
+            self._pump.cancel()
+            raise
+        return self._messages.popleft()
+
+    async def _pump_messages(self):
+        try:
+            while True:
+                self.put(await self._receive())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._error = e
+            self._has_messages.set()
+
+    def put(self, message):
+        key = _collapse_key(message)
+        if key is not None:
+            for queued_message in self._messages:
+                if _collapse_key(queued_message) == key:
+                    self._messages.remove(queued_message)
+                    collapsed_messages.inc(type=key[0])
+                    break
+
+        self._messages.append(message)
+        while len(self._messages) > self.max_size:
+            dropped_message = self._messages.popleft()
+            dropped_messages.inc(type=dropped_message.get('content', dropped_message).get('type'))
+        self._has_messages.set()
+
+    def __len__(self):
+        return len(self._messages)
@@ -0,0 +1,225 @@
+import datetime
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q, F
+from django.utils import timezone
+
+from helpers.instrumentation import instrument
+from helpers.metrics import Counter
+from .event_buffer import board_events
+from .logger import boards_logger
+from .models import Job
+
+# durations are in handler_duration_seconds{kind="job"}
+finished_jobs = Counter('jobs_finished_total', 'Attempts of jobs by result', ['kind', 'status'])
+
+
+class JobKind:
+    def __init__(self, function, max_attempts):
+        self.function = function
+        self.max_attempts = max_attempts
+
+
+job_kinds = {}
+
+
+def register_job(kind, max_attempts=None):
+    """
+    Registers the function run for the jobs of the kind, it gets the job and the payload as keyword arguments
+    and returns the JSON result. It can run several times, so it must be safe to repeat
+    """
+    def decorator(func):
+        job_kinds[kind] = JobKind(func, max_attempts or settings.JOBS['MAX_ATTEMPTS'])
+        return func
+    return decorator
+
+
+def enqueue(kind, payload, board_id=None, user=None, run_after=None) -> Job:
+    job = Job.objects.create(kind=kind, payload=payload, board_id=board_id, user=user,
+                             max_attempts=job_kinds[kind].max_attempts, run_after=run_after or timezone.now())
+    transaction.on_commit(lambda: job_runner.push(job))
+    transaction.on_commit(job_runner.wake)
+    return job
+
+
+class JobRunner:
+    """
+    Worker threads taking jobs from the Job table, no broker is needed.
+    Failed attempts are retried after `backoff_seconds` doubled every attempt,
+    a job whose worker died is taken again after `lease_seconds`, or fails if that was its last attempt.
+    Finished jobs are deleted after `keep_seconds`, idle workers look for them every `cleanup_seconds`
+    """
+
+    def __init__(self, threads, poll_seconds, backoff_seconds, lease_seconds, keep_seconds, cleanup_seconds,
+                 clock=time.monotonic):
+        self.threads = threads
+        self.poll_seconds = poll_seconds
+        self.backoff_seconds = backoff_seconds
+        self.lease_seconds = lease_seconds
+        self.keep_seconds = keep_seconds
+        self.cleanup_seconds = cleanup_seconds
+        self.clock = clock
+
+        self._next_cleanup = 0
+        self._cleanup_lock = threading.Lock()
+        self._workers = []
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+
+    @staticmethod
+    def _runnable(now):
+        return (Q(status=Job.Statuses.QUEUED, run_after__lte=now)
+                | Q(status=Job.Statuses.RUNNING, locked_until__lt=now, attempts__lt=F('max_attempts')))
+
+    def fail_abandoned(self, now) -> int:
+        """
+        Fails the jobs whose worker died in their last attempt, e.g. the job crashes or hangs it,
+        returns how many were failed
+        """
+        abandoned = Q(status=Job.Statuses.RUNNING, locked_until__lt=now, attempts__gte=F('max_attempts'))
+        failed = 0
+        for job in Job.objects.filter(abandoned)[:10]:
+            job.status = Job.Statuses.FAILED
+            job.error = f"The worker stopped in attempt {job.attempts} and the lease of the job expired"
+            job.locked_until = None
+            job.updated = now
+            if Job.objects.filter(abandoned, pk=job.pk).update(status=job.status, error=job.error,
+                                                               locked_until=None, updated=now):
+                boards_logger.error(f"Job {job.pk} {job.kind} failed: {job.error}")
+                finished_jobs.inc(kind=job.kind, status=job.status)
+                self.push(job)
+                failed += 1
+        return failed
+
+    def claim(self):
+        """
+        Takes the next runnable job, the conditional update lets only one worker have it
+        """
+        now = timezone.now()
+        self.fail_abandoned(now)
+        for pk in Job.objects.filter(self._runnable(now)).order_by('run_after', 'id').values_list('pk', flat=True)[:10]:
+            claimed = Job.objects.filter(self._runnable(now), pk=pk).update(
+                status=Job.Statuses.RUNNING,
+                locked_until=now + datetime.timedelta(seconds=self.lease_seconds),
+                attempts=F('attempts') + 1,
+                updated=now)
+            if claimed:
+                return Job.objects.get(pk=pk)
+        return None
+
+    def run(self, job):
+        kind = job_kinds.get(job.kind)
+        self.push(job)
+        try:
+            if kind is None:
+                raise KeyError(f"Unknown job kind {job.kind}")
+            with instrument('job', job.kind, board=job.board_id, user=job.user_id):
+                job.result = kind.function(job, **job.payload)
+        except Exception as e:
+            boards_logger.exception(f"Job {job.pk} {job.kind} failed, attempt {job.attempts}: {e}")
+            job.error = str(e)
+            if kind is not None and job.attempts < job.max_attempts:
+                job.status = Job.Statuses.QUEUED
+                job.run_after = timezone.now() + datetime.timedelta(
+                    seconds=self.backoff_seconds * 2 ** (job.attempts - 1))
+            else:
+                job.status = Job.Statuses.FAILED
+        else:
+            job.status = Job.Statuses.SUCCEEDED
+            job.error = ''
+        finished_jobs.inc(kind=job.kind, status=job.status)
+
+        job.locked_until = None
+        job.updated = timezone.now()
+        job.save(update_fields=['status', 'result', 'error', 'run_after', 'locked_until', 'updated'])
+        self.push(job)
+
+    def run_pending(self) -> int:
+        """
+        Runs the runnable jobs in the calling thread, returns how many were run
+        """
+        count = 0
+        job = self.claim()
+        while job is not None:
+            self.run(job)
+            count += 1
+            job = self.claim()
+        return count
+
+    def delete_finished(self) -> int:
+        """
+        Deletes the jobs which finished more than `keep_seconds` ago, returns how many were deleted
+        """
+        before = timezone.now() - datetime.timedelta(seconds=self.keep_seconds)
+        deleted, _ = Job.objects.filter(status__in=[Job.Statuses.SUCCEEDED, Job.Statuses.FAILED],
+                                        updated__lt=before).delete()
+        return deleted
+
+    def _cleanup_if_due(self):
+        now = self.clock()
+        with self._cleanup_lock:
+            if now < self._next_cleanup:
+                return
+            self._next_cleanup = now + self.cleanup_seconds
+        self.delete_finished()
+
+    def report(self, job, progress):
+        job.progress = progress
+        job.updated = timezone.now()
+        Job.objects.filter(pk=job.pk).update(progress=progress, updated=job.updated)
+        self.push(job)
+
+    @staticmethod
+    def push(job):
+        if job.board_id is None:
+            return
+        content = board_events.append(job.board_id, {'type': 'job_status', 'job': job.to_dict()})
+        async_to_sync(get_channel_layer().group_send)(f"board_{job.board_id}",
+                                                      {'type': 'send_content', 'content': content})
+
+    def wake(self):
+        self._wakeup.set()
+
+    def start(self):
+        if self._workers:
+            return
+        self._stopping.clear()
+        for number in range(self.threads):
+            worker = threading.Thread(target=self._work, name=f"job-worker-{number}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                job = self.claim()
+                if job is not None:
+                    self.run(job)
+                else:
+                    self._cleanup_if_due()
+            except Exception as e:
+                job = None
+                boards_logger.exception(f"Job worker failed: {e}")
+            finally:
+                # return the connection to the pool between jobs
+                connections.close_all()
+
+            if job is None:
+                self._wakeup.wait(self.poll_seconds)
+                self._wakeup.clear()
+
+
+job_runner = JobRunner(settings.JOBS['THREADS'], settings.JOBS['POLL_SECONDS'], settings.JOBS['BACKOFF_SECONDS'],
+                       settings.JOBS['LEASE_SECONDS'], settings.JOBS['KEEP_SECONDS'], settings.JOBS['CLEANUP_SECONDS'])
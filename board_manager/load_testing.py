@@ -0,0 +1,86 @@
+import asyncio
+import json
+import threading
+import time
+
+from channels.testing import WebsocketCommunicator
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework_simplejwt.tokens import AccessToken
+
+
+class QueryCounter:
+    """
+    Counts SQL queries of every connection opened while it is installed,
+    including the ones of the thread pool which runs the consumer handlers
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def _add_to(self, connection):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def _on_connection_created(self, sender, connection, **kwargs):
+        self._add_to(connection)
+
+    def install(self):
+        connection_created.connect(self._on_connection_created)
+        for connection in connections.all():
+            self._add_to(connection)
+
+    def uninstall(self):
+        connection_created.disconnect(self._on_connection_created)
+        for connection in connections.all():
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+
+def percentiles(values, points=(50, 95, 99)) -> dict:
+    values = sorted(values)
+    if not values:
+        return {f"p{point}": None for point in points}
+    return {f"p{point}": values[min(len(values) - 1, int(len(values) * point / 100))] for point in points}
+
+
+class BoardClient:
+    """
+    Websocket client of one user on one board, connected to the application in this process
+    """
+
+    def __init__(self, application, board, user):
+        self.board = board
+        self.user = user
+        self.communicator = WebsocketCommunicator(application,
+                                                  f"/boards/{board.pk}/{AccessToken.for_user(user)}/")
+        self.received = 0
+        self._reader = None
+
+    async def connect(self, on_message):
+        connected, code = await self.communicator.connect(timeout=10)
+        if not connected:
+            raise ConnectionError(f"Unable to connect to the board {self.board.pk}: {code}")
+        self._reader = asyncio.ensure_future(self._read(on_message))
+
+    async def _read(self, on_message):
+        while True:
+            output = await self.communicator.output_queue.get()
+            if output['type'] != 'websocket.send':
+                continue
+            self.received += 1
+            on_message(self, json.loads(output['text']), time.perf_counter())
+
+    async def send(self, message):
+        await self.communicator.send_json_to(message)
+
+    async def disconnect(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        await self.communicator.disconnect()
@@ -0,0 +1,257 @@
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import random
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from CodeDocs_backend.asgi import application
+from authentication.models import CustomUser
+from board_manager.board_manager_backend import BoardManager
+from board_manager.load_testing import BoardClient, QueryCounter, percentiles
+from board_manager.models import Board, UserBoards, Access, Node
+
+DEFAULT_MIX = 'changing_node=50,drag=30,create_node=5,active_users=15'
+IN_MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer',
+                                        'CONFIG': {'capacity': 10000}}}
+
+
+class Command(BaseCommand):
+    help = "Simulates boards with clients editing them and reports throughput, " \
+           "fan-out latency and DB queries per message"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--boards', type=int, default=5)
+        parser.add_argument('--clients', type=int, default=10, help="clients per board")
+        parser.add_argument('--messages', type=int, default=50, help="messages sent by every client")
+        parser.add_argument('--rate', type=float, default=5, help="messages per second of every client")
+        parser.add_argument('--mix', default=DEFAULT_MIX,
+                            help=f"weights of the message kinds, {DEFAULT_MIX} by default")
+        parser.add_argument('--channel-layer', choices=['memory', 'settings'], default='memory',
+                            help="the in-memory channel layer or the one from the settings")
+        parser.add_argument('--output', help="where to save the results, bench_results/ by default")
+        parser.add_argument('--compare', help="results of a previous run to compare with")
+
+    def handle(self, *args, **options):
+        mix = {}
+        for item in options['mix'].split(','):
+            kind, weight = item.split('=')
+            if kind not in ('changing_node', 'drag', 'create_node', 'active_users'):
+                raise CommandError(f"Unknown message kind {kind}")
+            mix[kind] = float(weight)
+
+        channel_layers = IN_MEMORY_CHANNEL_LAYERS if options['channel_layer'] == 'memory' else settings.CHANNEL_LAYERS
+        with override_settings(CHANNEL_LAYERS=channel_layers):
+            results = WebsocketBenchmark(options['boards'], options['clients'], options['messages'],
+                                         options['rate'], mix).run()
+
+        output = options['output'] or os.path.join(
+            settings.BASE_DIR, 'bench_results', f"websocket-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+        self.print_results(results)
+        self.stdout.write(f"Results saved to {output}")
+        if options['compare']:
+            with open(options['compare']) as f:
+                self.print_comparison(json.load(f), results)
+
+    def print_results(self, results):
+        self.stdout.write(f"{results['boards']} boards x {results['clients']} clients, "
+                          f"{results['sent']} messages sent in {results['duration']:.2f}s")
+        for name, value in self.flat_results(results).items():
+            self.stdout.write(f"  {name:<40} {self.format_value(value)}")
+
+    def print_comparison(self, previous, results):
+        self.stdout.write("Compared with the previous run:")
+        previous = self.flat_results(previous)
+        for name, value in self.flat_results(results).items():
+            before = previous.get(name)
+            if before in (None, 0) or value is None:
+                continue
+            self.stdout.write(f"  {name:<40} {self.format_value(before)} -> {self.format_value(value)} "
+                              f"({(value - before) / before * 100:+.1f}%)")
+
+    @staticmethod
+    def flat_results(results) -> dict:
+        flat = {'sent_per_second': results['sent_per_second'],
+                'received_per_second': results['received_per_second'],
+                'queries_per_message': results['queries_per_message'],
+                'throttled': results['throttled'],
+                'missing': results['missing']}
+        for kind, latencies in results['latency_ms'].items():
+            for point, value in latencies.items():
+                flat[f"latency_ms.{kind}.{point}"] = value
+        return flat
+
+    @staticmethod
+    def format_value(value):
+        return '-' if value is None else f"{value:.2f}"
+
+
+class WebsocketBenchmark:
+    def __init__(self, boards, clients, messages, rate, mix, timeout=30):
+        self.boards_number = boards
+        self.clients_number = clients
+        self.messages_number = messages
+        self.rate = rate
+        self.mix = mix
+        self.timeout = timeout
+        self.run_id = uuid.uuid4().hex[:8]
+
+        self.operation_ids = itertools.count(1)
+        self.pending = {}  # operation id -> (kind, sent at, board id, node id)
+        self.latencies = {kind: [] for kind in mix}
+        self.delivered = set()  # (operation id, client)
+        self.expected_deliveries = 0
+        self.throttled = 0
+        self.sent = 0
+        self.round_trips = {}
+        self.own_nodes = {}
+
+    def run(self) -> dict:
+        users, boards = self.create_data()
+        try:
+            return asyncio.run(self.run_clients(users, boards))
+        finally:
+            self.delete_data(users, boards)
+
+    def create_data(self):
+        users = [CustomUser.objects.create_user(username=f"bench_{self.run_id}_{i}",
+                                                email=f"bench_{self.run_id}_{i}@bench.local",
+                                                password=self.run_id)
+                 for i in range(self.clients_number)]
+        boards = []
+        for i in range(self.boards_number):
+            board = BoardManager.create_board(f"bench {i}", Board.BoardTypes.BOARD_FOR_NOTES, users[0])
+            UserBoards.objects.bulk_create([UserBoards(board=board, user=user, access=Access.EDITOR)
+                                            for user in users[1:]])
+            for j, user in enumerate(users):
+                self.own_nodes[(board.pk, user.pk)] = Node.objects.create(board=board, tag=j, color='#5688C7',
+                                                                          blocked_by=user).pk
+            boards.append(board)
+        return users, boards
+
+    @staticmethod
+    def delete_data(users, boards):
+        Board.objects.filter(pk__in=[board.pk for board in boards]).delete()
+        CustomUser.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+    def on_message(self, client, message, received_at):
+        if message.get('error_code') == 4429:
+            self.throttled += 1
+            return
+
+        if message['type'] == 'active_users':
+            sent_at = self.round_trips.pop(client, None)
+            if sent_at is not None:
+                self.latencies['active_users'].append((received_at - sent_at) * 1000)
+            return
+
+        node = message.get('node') or {}
+        for marker in (node.get('title'), node.get('status'), node.get('position_x')):
+            operation_id = self.marker_operation(marker)
+            if operation_id in self.pending and (operation_id, client) not in self.delivered:
+                kind, sent_at, board_id, node_id = self.pending[operation_id]
+                if board_id == client.board.pk:
+                    self.delivered.add((operation_id, client))
+                    self.latencies[kind].append((received_at - sent_at) * 1000)
+                    self.supersede(client, operation_id, node_id)
+
+    def supersede(self, client, operation_id, node_id):
+        # queued changes of a node are collapsed into the latest one for slow clients
+        if node_id is None:
+            return
+        for earlier_id, (_, _, _, earlier_node_id) in self.pending.items():
+            if earlier_id < operation_id and earlier_node_id == node_id:
+                self.delivered.add((earlier_id, client))
+
+    @staticmethod
+    def marker_operation(marker):
+        if isinstance(marker, str) and marker.startswith('bench-'):
+            return int(marker[len('bench-'):])
+        if isinstance(marker, float) and marker >= 1000000:
+            return int(marker) - 1000000
+        return None
+
+    def make_message(self, client, kind, operation_id):
+        node_id = self.own_nodes[(client.board.pk, client.user.pk)]
+        if kind == 'changing_node':
+            return {'type': 'changing_node', 'node': {'id': node_id, 'title': f"bench-{operation_id}"}}
+        if kind == 'drag':
+            return {'type': 'changing_node', 'node': {'id': node_id,
+                                                      'position_x': 1000000.0 + operation_id,
+                                                      'position_y': random.random() * 1000}}
+        if kind == 'create_node':
+            return {'type': 'create_node', 'status': f"bench-{operation_id}"}
+        return {'type': 'active_users'}
+
+    async def run_client(self, client):
+        kinds, weights = list(self.mix), list(self.mix.values())
+        for _ in range(self.messages_number):
+            await asyncio.sleep(random.expovariate(self.rate))
+            kind = random.choices(kinds, weights)[0]
+            operation_id = next(self.operation_ids)
+            sent_at = time.perf_counter()
+            if kind == 'active_users':
+                if client in self.round_trips:
+                    continue
+                self.round_trips[client] = sent_at
+            else:
+                node_id = self.own_nodes[(client.board.pk, client.user.pk)] if kind != 'create_node' else None
+                self.pending[operation_id] = (kind, sent_at, client.board.pk, node_id)
+                self.expected_deliveries += self.clients_number
+            await client.send(self.make_message(client, kind, operation_id))
+            self.sent += 1
+
+    async def run_clients(self, users, boards):
+        clients = [BoardClient(application.application_mapping['websocket'], board, user)
+                   for board in boards for user in users]
+        for client in clients:
+            await client.connect(self.on_message)
+        await asyncio.sleep(1)  # greetings of the connected users
+
+        query_counter = QueryCounter()
+        await sync_to_async(query_counter.install)()
+        received_before = sum(client.received for client in clients)
+        started = time.perf_counter()
+
+        await asyncio.gather(*[self.run_client(client) for client in clients])
+        deadline = time.perf_counter() + self.timeout
+        while len(self.delivered) < self.expected_deliveries and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+
+        duration = time.perf_counter() - started
+        await sync_to_async(query_counter.uninstall)()
+        received = sum(client.received for client in clients) - received_before
+        for client in clients:
+            await client.disconnect()
+
+        sent = self.sent
+        return {
+            'started': datetime.datetime.now().isoformat(),
+            'boards': self.boards_number,
+            'clients': self.clients_number,
+            'messages': self.messages_number,
+            'rate': self.rate,
+            'mix': self.mix,
+            'duration': duration,
+            'sent': sent,
+            'received': received,
+            'sent_per_second': sent / duration,
+            'received_per_second': received / duration,
+            'queries': query_counter.count,
+            'queries_per_message': query_counter.count / sent,
+            'throttled': self.throttled,
+            'missing': self.expected_deliveries - len(self.delivered),
+            'latency_ms': {'all': percentiles(list(itertools.chain(*self.latencies.values()))),
+                           **{kind: percentiles(latencies) for kind, latencies in self.latencies.items()}},
+        }
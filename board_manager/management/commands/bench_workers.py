@@ -0,0 +1,199 @@
+import datetime
+import json
+import os
+import secrets
+import subprocess
+import sys
+import time
+import urllib.request
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authentication.models import CustomUser
+from board_manager.board_manager_backend import BoardManager
+from board_manager.load_testing import percentiles
+from board_manager.management.commands.runworkers import shared_state_problems
+from board_manager.models import Board
+
+
+class Command(BaseCommand):
+    help = "Runs runworkers with different numbers of workers and reports the peak websocket throughput " \
+           "of every number and its scaling compared with one worker. The connections are doubled " \
+           "until the throughput stops growing, so every number of workers is measured saturated. " \
+           "The connections are spread over several boards per worker and sent to the worker owning " \
+           "their board, as the load balancer does with /board/route/"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', default=f"1,{os.cpu_count()}", help="numbers of workers to compare")
+        parser.add_argument('--clients', type=int, default=200, help="websocket connections of the first step")
+        parser.add_argument('--max-clients', type=int, default=6400, help="websocket connections of the last step")
+        parser.add_argument('--saturation', type=float, default=0.05,
+                            help="the server is saturated when doubling the connections adds less throughput")
+        parser.add_argument('--boards-per-worker', type=int, default=4,
+                            help="boards of the connections for every worker of the largest number")
+        parser.add_argument('--client-processes', type=int, default=max(os.cpu_count() // 2, 1))
+        parser.add_argument('--rate', type=float, default=8,
+                            help="messages per second of every connection, below its rate limit")
+        parser.add_argument('--duration', type=float, default=20, help="seconds of sending of every step")
+        parser.add_argument('--port', type=int, default=8800,
+                            help="port of the workers, the next one serves their stats, "
+                                 "the workers listen also on the ports after it")
+        parser.add_argument('--timeout', type=float, default=60, help="seconds to wait for the workers")
+        parser.add_argument('--output', help="where to save the results, bench_results/ by default")
+
+    def handle(self, *args, **options):
+        workers = [int(number) for number in options['workers'].split(',')]
+        problems = shared_state_problems(self.worker_base_port(options))
+        if max(workers) > 1 and problems:
+            raise CommandError(f"Several workers would not share their boards: {', '.join(problems)}")
+
+        user = CustomUser.objects.create_user(username=f"bench_workers_{os.getpid()}",
+                                              email=f"bench_workers_{os.getpid()}@bench.local",
+                                              password=str(os.getpid()))
+        boards = [BoardManager.create_board(f"bench workers {number}", Board.BoardTypes.BOARD_FOR_NOTES, user)
+                  for number in range(max(workers) * options['boards_per_worker'])]
+        paths = {board.pk: f"/boards/{board.pk}/{AccessToken.for_user(user)}/" for board in boards}
+        try:
+            runs = [self.run_workers(number, paths, options) for number in workers]
+        finally:
+            Board.objects.filter(pk__in=paths).delete()
+            CustomUser.objects.filter(pk=user.pk).delete()
+
+        results = {'started': datetime.datetime.now().isoformat(),
+                   'cpu_count': os.cpu_count(),
+                   'boards': len(boards),
+                   'clients': options['clients'],
+                   'max_clients': options['max_clients'],
+                   'rate': options['rate'],
+                   'duration': options['duration'],
+                   'runs': runs}
+        output = options['output'] or os.path.join(
+            settings.BASE_DIR, 'bench_results', f"workers-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+        base = runs[0]['messages_per_second']
+        for run in runs:
+            scaling = run['messages_per_second'] / base if base else 0
+            self.stdout.write(f"{run['workers']:>3} workers: {run['messages_per_second']:9.1f} messages/s "
+                              f"with {run['clients']} connections, "
+                              f"p50 {self.format_value(run['latency_ms']['p50'])} ms, "
+                              f"p95 {self.format_value(run['latency_ms']['p95'])} ms, "
+                              f"x{scaling:.2f}, {run['throttled']} throttled, {run['moved']} moved, "
+                              f"{run['failed']} failed connections")
+        if any(run['moved'] for run in runs):
+            self.stdout.write("Some connections were closed as their boards moved, the scaling is understated")
+        self.stdout.write(f"Results saved to {output}")
+
+    @staticmethod
+    def worker_base_port(options) -> int:
+        return options['port'] + 2
+
+    def run_workers(self, number, paths, options) -> dict:
+        """
+        Throughput of the number of workers at the step of connections where it was highest
+        """
+        port, route_token = options['port'], secrets.token_hex(16)
+        server = subprocess.Popen([sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'runworkers',
+                                   '--workers', str(number), '--port', str(port), '--stats-port', str(port + 1),
+                                   '--worker-base-port', str(self.worker_base_port(options))],
+                                  env={**os.environ, 'CODE_DOCS_ROUTE_TOKEN': route_token},
+                                  stdout=subprocess.DEVNULL)
+        steps = []
+        try:
+            self.wait_ready(number, port + 1, options['timeout'])
+            targets = [[owner_port, paths[board_id]]
+                       for board_id, owner_port in self.route(number, list(paths), route_token, options).items()]
+            clients = options['clients']
+            while True:
+                steps.append(self.run_load([targets[i % len(targets)] for i in range(clients)], options))
+                self.stdout.write(f"{number} workers, {clients} connections: "
+                                  f"{steps[-1]['messages_per_second']:.1f} messages/s")
+                saturated = len(steps) > 1 and steps[-1]['messages_per_second'] < \
+                    steps[-2]['messages_per_second'] * (1 + options['saturation'])
+                if saturated or clients * 2 > options['max_clients']:
+                    break
+                clients *= 2
+        finally:
+            server.terminate()
+            server.wait()
+
+        peak = max(steps, key=lambda step: step['messages_per_second'])
+        return {'workers': number, **peak, 'steps': steps}
+
+    def route(self, number, board_ids, route_token, options) -> dict:
+        """
+        Port of the worker owning every board, once all the workers agree on the owners
+        """
+        if not settings.BOARD_AFFINITY['ENABLED']:
+            return {board_id: options['port'] for board_id in board_ids}
+        deadline = time.monotonic() + options['timeout']
+        while time.monotonic() < deadline:
+            owners = [self.ask_route(self.worker_base_port(options) + index, board_ids, route_token)
+                      for index in range(number)]
+            if None not in owners and all(owner == owners[0] for owner in owners):
+                return {board_id: int(address.rsplit(':', 1)[1]) for board_id, address in owners[0].items()}
+            time.sleep(0.5)
+        raise CommandError(f"{number} workers did not agree on the owners of the boards in {options['timeout']}s")
+
+    @staticmethod
+    def ask_route(port, board_ids, route_token):
+        """
+        Addresses of the owners of the boards in the ring of the worker on the port, None while some are unknown
+        """
+        owners = {}
+        for board_id in board_ids:
+            request = urllib.request.Request(f"http://127.0.0.1:{port}/board/route/{board_id}/",
+                                             headers={'X-Route-Token': route_token})
+            try:
+                with urllib.request.urlopen(request, timeout=5) as response:
+                    owners[board_id] = response.headers['X-Board-Worker']
+            except OSError:
+                return None
+        return owners
+
+    @staticmethod
+    def run_load(targets, options) -> dict:
+        processes = min(options['client_processes'], len(targets))
+        # autobahn runs on asyncio in the clients, daphne has chosen twisted for it in this process
+        processes = [subprocess.Popen([sys.executable, '-m', 'helpers.websocket_load', '--rate', str(options['rate']),
+                                       '--duration', str(options['duration']), '--timeout', str(options['timeout'])],
+                                      cwd=settings.BASE_DIR, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+                     for _ in range(processes)]
+        # all the processes get their connections before any is waited for
+        for i, process in enumerate(processes):
+            process.stdin.write(json.dumps(targets[i::len(processes)]).encode())
+            process.stdin.close()
+        results = [json.load(process.stdout) for process in processes]
+        for process in processes:
+            process.wait()
+
+        latencies = [latency for result in results for latency in result['latencies']]
+        return {'clients': len(targets),
+                'messages': len(latencies),
+                'messages_per_second': len(latencies) / options['duration'],
+                'latency_ms': percentiles(latencies),
+                'throttled': sum(result['throttled'] for result in results),
+                'moved': sum(result['moved'] for result in results),
+                'failed': sum(result['failed'] for result in results)}
+
+    @staticmethod
+    def wait_ready(number, stats_port, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{stats_port}/workers", timeout=5) as response:
+                    workers = json.load(response)
+                if len(workers) == number and all(worker['ready'] for worker in workers):
+                    return
+            except OSError:
+                pass
+            time.sleep(0.5)
+        raise CommandError(f"{number} workers were not ready in {timeout}s")
+
+    @staticmethod
+    def format_value(value):
+        return '-' if value is None else f"{value:.2f}"
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from board_manager.reclaimer import reclaimer
+
+
+class Command(BaseCommand):
+    help = "Removes the rows of boards and users marked as deleted, " \
+           "for example those left over when a worker stopped in the middle"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, help="rows deleted per transaction, RECLAIMER setting by default")
+
+    def handle(self, *args, **options):
+        if options['chunk_size']:
+            reclaimer.chunk_size = options['chunk_size']
+
+        def on_progress(kind, pk, removed, done):
+            self.stdout.write(f"{kind} {pk}: {removed} rows removed" + (", done" if done else ""))
+
+        pending = reclaimer.pending()
+        self.stdout.write(f"{len(pending)} boards and users to reclaim")
+        reclaimer.run(on_progress)
@@ -0,0 +1,232 @@
+import asyncio
+import collections
+import datetime
+import json
+import os
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from CodeDocs_backend.asgi import application
+from authentication.models import CustomUser
+from board_manager.board_manager_backend import BoardManager
+from board_manager.load_testing import BoardClient, QueryCounter, percentiles
+from board_manager.models import Board, UserBoards, Access, Node, Column
+from board_manager.traffic_recording import PSEUDONYM, read_recordings
+from .bench_websocket import IN_MEMORY_CHANNEL_LAYERS
+
+
+class Command(BaseCommand):
+    help = "Replays websocket traffic recorded with WEBSOCKET_RECORDING against the application " \
+           "in this process and reports how the server kept up with it"
+
+    def add_arguments(self, parser):
+        parser.add_argument('recordings', nargs='+', help="NDJSON files of the recorder")
+        parser.add_argument('--speed', type=float, default=1, help="2 replays the traffic twice as fast")
+        parser.add_argument('--channel-layer', choices=['memory', 'settings'], default='memory',
+                            help="the in-memory channel layer or the one from the settings")
+        parser.add_argument('--output', help="where to save the results, bench_results/ by default")
+        parser.add_argument('--compare', help="results of a previous replay to compare with")
+
+    def handle(self, *args, **options):
+        if options['speed'] <= 0:
+            raise CommandError("Speed must be positive")
+        records = read_recordings(options['recordings'])
+        if not records:
+            raise CommandError("Recordings are empty")
+
+        channel_layers = IN_MEMORY_CHANNEL_LAYERS if options['channel_layer'] == 'memory' else settings.CHANNEL_LAYERS
+        with override_settings(CHANNEL_LAYERS=channel_layers):
+            results = TrafficReplay(records, options['speed']).run()
+
+        output = options['output'] or os.path.join(
+            settings.BASE_DIR, 'bench_results', f"replay-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+        self.stdout.write(f"{results['connections']} connections, {results['sent']} messages "
+                          f"replayed in {results['duration']:.2f}s at {results['speed']}x")
+        for name, value in self.flat_results(results).items():
+            self.stdout.write(f"  {name:<40} {self.format_value(value)}")
+        self.stdout.write(f"Results saved to {output}")
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                previous = self.flat_results(json.load(f))
+            self.stdout.write("Compared with the previous replay:")
+            for name, value in self.flat_results(results).items():
+                before = previous.get(name)
+                if before in (None, 0) or value is None:
+                    continue
+                self.stdout.write(f"  {name:<40} {self.format_value(before)} -> {self.format_value(value)} "
+                                  f"({(value - before) / before * 100:+.1f}%)")
+
+    @staticmethod
+    def flat_results(results) -> dict:
+        flat = {'duration': results['duration'],
+                'received_per_second': results['received_per_second'],
+                'queries_per_message': results['queries_per_message'],
+                'errors': sum(results['errors'].values())}
+        for point, value in results['lag_ms'].items():
+            flat[f"lag_ms.{point}"] = value
+        return flat
+
+    @staticmethod
+    def format_value(value):
+        return '-' if value is None else f"{value:.2f}"
+
+
+class TrafficReplay:
+    """
+    Creates local users, boards, columns and nodes for the pseudonyms of a recording
+    and sends the recorded messages on behalf of the users at the recorded times
+    """
+
+    def __init__(self, records, speed=1):
+        self.records = records
+        self.speed = speed
+        self.run_id = uuid.uuid4().hex[:8]
+
+        self.users = {}
+        self.boards = {}
+        self.objects = {}  # pseudonym -> local id
+        self.lags = []
+        self.errors = collections.Counter()
+        self.sent = 0
+
+    def run(self) -> dict:
+        try:
+            self.create_data()
+            return asyncio.run(self.replay())
+        finally:
+            self.delete_data()
+
+    def pseudonyms(self, value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                yield from self.pseudonyms(key)
+                yield from self.pseudonyms(item)
+        elif isinstance(value, list):
+            for item in value:
+                yield from self.pseudonyms(item)
+        elif isinstance(value, str) and PSEUDONYM.match(value):
+            yield value
+
+    def create_user(self, pseudonym):
+        if pseudonym not in self.users:
+            number = len(self.users)
+            self.users[pseudonym] = CustomUser.objects.create_user(username=f"replay_{self.run_id}_{number}",
+                                                                   email=f"replay_{self.run_id}_{number}@replay.local",
+                                                                   password=self.run_id)
+        return self.users[pseudonym]
+
+    def create_board(self, pseudonym, owner):
+        if pseudonym not in self.boards:
+            board = BoardManager.create_board(f"replay {len(self.boards)}", Board.BoardTypes.KANBAN, owner)
+            self.boards[pseudonym] = board
+            self.objects[pseudonym] = board.pk
+        return self.boards[pseudonym]
+
+    def create_data(self):
+        members = collections.defaultdict(set)
+        for record in self.records:
+            owner = self.create_user(record['user'])
+            board = self.create_board(record['board'], owner)
+            members[board].add(owner)
+
+            for pseudonym in self.pseudonyms(record.get('message')):
+                if pseudonym in self.objects:
+                    continue
+                kind = pseudonym[0]
+                if kind == 'u':
+                    user = self.create_user(pseudonym)
+                    members[board].add(user)
+                    self.objects[pseudonym] = user.pk
+                elif kind == 'b':
+                    another_board = self.create_board(pseudonym, owner)
+                    members[another_board].add(owner)
+                elif kind == 'c':
+                    self.objects[pseudonym] = Column.objects.create(board=board,
+                                                                    position=board.columns.count()).pk
+                else:
+                    self.objects[pseudonym] = Node.objects.create(board=board, tag=board.nodes.count() + 1,
+                                                                  color='#5688C7').pk
+
+        for board, users in members.items():
+            owners = set(board.users.all())
+            UserBoards.objects.bulk_create([UserBoards(board=board, user=user, access=Access.EDITOR)
+                                            for user in users - owners])
+
+    def delete_data(self):
+        Board.objects.filter(pk__in=[board.pk for board in self.boards.values()]).delete()
+        CustomUser.objects.filter(pk__in=[user.pk for user in self.users.values()]).delete()
+
+    def localize(self, value):
+        if isinstance(value, dict):
+            return {str(self.localize(key)): self.localize(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.localize(item) for item in value]
+        if isinstance(value, str) and value in self.objects:
+            return self.objects[value]
+        return value
+
+    def on_message(self, client, message, received_at):
+        if 'error_code' in message:
+            self.errors[str(message['error_code'])] += 1
+
+    async def replay_connection(self, records, started, first_time):
+        client = None
+        try:
+            for record in records:
+                due = started + (record['time'] - first_time) / self.speed
+                await asyncio.sleep(max(0, due - time.perf_counter()))
+                self.lags.append(max(0, time.perf_counter() - due) * 1000)
+
+                if record['event'] == 'disconnect':
+                    break
+                if client is None:
+                    # recordings may start in the middle of a connection
+                    client = BoardClient(application.application_mapping['websocket'],
+                                         self.boards[record['board']], self.users[record['user']])
+                    await client.connect(self.on_message)
+                if record['event'] == 'message':
+                    await client.send(self.localize(record['message']))
+                    self.sent += 1
+        finally:
+            if client is not None:
+                await client.disconnect()
+        return client.received if client is not None else 0
+
+    async def replay(self):
+        connections = collections.defaultdict(list)
+        for record in self.records:
+            connections[record['connection']].append(record)
+
+        query_counter = QueryCounter()
+        await sync_to_async(query_counter.install)()
+        started = time.perf_counter()
+
+        received = await asyncio.gather(*[self.replay_connection(records, started, self.records[0]['time'])
+                                          for records in connections.values()])
+
+        duration = time.perf_counter() - started
+        await sync_to_async(query_counter.uninstall)()
+        return {
+            'started': datetime.datetime.now().isoformat(),
+            'speed': self.speed,
+            'recorded_duration': self.records[-1]['time'] - self.records[0]['time'],
+            'connections': len(connections),
+            'duration': duration,
+            'sent': self.sent,
+            'received': sum(received),
+            'received_per_second': sum(received) / duration,
+            'queries': query_counter.count,
+            'queries_per_message': query_counter.count / self.sent if self.sent else None,
+            'errors': dict(self.errors),
+            'lag_ms': percentiles(self.lags),
+        }
@@ -0,0 +1,182 @@
+import json
+import os
+import secrets
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from helpers.metrics import MetricsRegistry, merge_rendered
+from helpers.worker_supervisor import WorkerSupervisor, get_from_worker, worker_restarts, alive_workers
+
+
+def _is_redis(backend) -> bool:
+    return 'redis' in backend.lower()
+
+
+def shared_state_problems(worker_base_port) -> list:
+    """
+    Reasons why several workers would not share their boards: every worker has to own its boards,
+    have an address of its own where the load balancer sends their sockets,
+    and the workers have to reach each other and their events through Redis
+    """
+    problems = []
+    if not settings.BOARD_AFFINITY['ENABLED']:
+        problems.append("board affinity is off (CODE_DOCS_BOARD_AFFINITY=1)")
+    elif not worker_base_port:
+        problems.append("the workers have no addresses of their own (--worker-base-port)")
+    if not _is_redis(settings.CACHES['default']['BACKEND']):
+        problems.append("the cache is not Redis (CODE_DOCS_CACHE_REDIS)")
+    layer = settings.CHANNEL_LAYERS['default']
+    backends = [shard['BACKEND'] for shard in layer.get('CONFIG', {}).get('shards', [])] or [layer['BACKEND']]
+    if not all(_is_redis(backend) for backend in backends):
+        problems.append("the channel layer is not Redis")
+    return problems
+
+
+class WorkerStats:
+    """
+    Metrics and readiness of every worker, asked over its private unix socket
+    with the secret the workers got in CODE_DOCS_STATS_TOKEN
+    """
+
+    def __init__(self, supervisor, socket_dir, token):
+        self.supervisor = supervisor
+        self.socket_dir = socket_dir
+        self.token = token
+        self.registry = MetricsRegistry()
+        self.registry.register(worker_restarts)
+        self.registry.register(alive_workers)
+
+    def socket_path(self, index):
+        return os.path.join(self.socket_dir, f"worker-{index}.sock")
+
+    def _get(self, slot, url):
+        if slot.process is None:
+            return None, None
+        try:
+            return get_from_worker(self.socket_path(slot.index), url, {'X-Stats-Token': self.token})
+        except OSError:
+            return None, None
+
+    def metrics(self) -> str:
+        """
+        Counters and histograms of all workers summed up, their gauges labelled with the worker,
+        with the metrics of the supervisor
+        """
+        texts = {slot.index: self._get(slot, '/metrics')[1] for slot in self.supervisor.slots}
+        texts = {index: text for index, text in texts.items() if text}
+        return merge_rendered({**texts, None: self.registry.render()})
+
+    def workers(self) -> list:
+        workers = self.supervisor.stats()
+        for worker, slot in zip(workers, self.supervisor.slots):
+            worker['ready'] = self._get(slot, '/ready')[0] == 200
+        return workers
+
+
+def stats_handler(stats):
+    class StatsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body, content_type = stats.metrics(), 'text/plain; version=0.0.4; charset=utf-8'
+            elif self.path == '/workers':
+                body, content_type = json.dumps(stats.workers()), 'application/json'
+            else:
+                self.send_error(404)
+                return
+            body = body.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StatsHandler
+
+
+class Command(BaseCommand):
+    help = "Runs the ASGI application in Daphne worker processes sharing one listening socket, " \
+           "one per core by default. Workers which exit are started again, the metrics of all of them " \
+           "are served together on --stats-port"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--bind', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8000)
+        parser.add_argument('--backlog', type=int, default=1024)
+        parser.add_argument('--worker-base-port', type=int,
+                            help="every worker also listens on this port plus its number, "
+                                 "the address of the worker for the board affinity of the load balancer")
+        parser.add_argument('--stats-port', type=int, help="port of /metrics and /workers of all workers")
+        parser.add_argument('--stats-interval', type=float, default=60, help="seconds between status lines")
+        parser.add_argument('--graceful-timeout', type=float, default=30,
+                            help="seconds the workers have to close their connections when stopping")
+
+    def handle(self, *args, **options):
+        problems = shared_state_problems(options['worker_base_port'])
+        if options['workers'] > 1 and problems:
+            raise CommandError(f"Several workers would not share their boards: {', '.join(problems)}. "
+                               f"Run with --workers 1")
+
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((options['bind'], options['port']))
+        listener.listen(options['backlog'])
+        listener.set_inheritable(True)
+        socket_dir = tempfile.mkdtemp(prefix='runworkers-')
+        stats_token = secrets.token_hex(16)
+
+        def command(index):
+            socket_path = stats.socket_path(index)
+            # left by the worker this one replaces
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            arguments = [sys.executable, '-m', 'daphne', '--fd', str(listener.fileno()), '-u', socket_path]
+            if options['worker_base_port']:
+                arguments += ['-e', f"tcp:port={options['worker_base_port'] + index}:interface={options['bind']}"]
+            return arguments + ['CodeDocs_backend.asgi:application']
+
+        def env(index):
+            worker_env = {'CODE_DOCS_WORKER_NAME': f"{socket.gethostname()}:{options['port']}:{index}",
+                          'CODE_DOCS_STATS_TOKEN': stats_token}
+            if options['worker_base_port']:
+                worker_env['CODE_DOCS_WORKER_ADDRESS'] = f"{options['bind']}:{options['worker_base_port'] + index}"
+            return worker_env
+
+        supervisor = WorkerSupervisor(command, options['workers'], env, pass_fds=[listener.fileno()],
+                                      cwd=settings.BASE_DIR, graceful_seconds=options['graceful_timeout'],
+                                      log=self.stdout.write)
+        stats = WorkerStats(supervisor, socket_dir, stats_token)
+
+        stats_server = None
+        if options['stats_port']:
+            stats_server = ThreadingHTTPServer((options['bind'], options['stats_port']), stats_handler(stats))
+            threading.Thread(target=stats_server.serve_forever, name='runworkers-stats', daemon=True).start()
+
+        ticks = {'next': 0}
+
+        def on_tick():
+            now = supervisor.clock()
+            if now >= ticks['next']:
+                ticks['next'] = now + options['stats_interval']
+                workers = supervisor.stats()
+                self.stdout.write(f"{sum(worker['pid'] is not None for worker in workers)}/{len(workers)} workers "
+                                  f"running, {sum(worker['restarts'] for worker in workers)} restarts")
+
+        self.stdout.write(f"Listening on {options['bind']}:{options['port']} with {options['workers']} workers")
+        try:
+            supervisor.run(on_tick=on_tick)
+        finally:
+            if stats_server is not None:
+                stats_server.shutdown()
+            listener.close()
+            shutil.rmtree(socket_dir, ignore_errors=True)
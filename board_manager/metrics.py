@@ -0,0 +1,10 @@
+from channels_presence.models import Room
+
+from helpers.metrics import Gauge
+from .models import Node
+
+open_sockets = Gauge('websocket_open_connections', 'Websocket connections open in this process')
+rooms = Gauge('board_rooms', 'Boards with connected users',
+              function=lambda: Room.objects.count())
+held_node_locks = Gauge('board_held_node_locks', 'Nodes blocked by users changing them',
+                        function=lambda: Node.objects.filter(blocked_by__isnull=False).count())
@@ -17,6 +17,10 @@ class Access(models.IntegerChoices):
 
 
 class BoardManager(models.Manager):
+    def get_queryset(self):
+        # deleted boards wait for the reclaimer, see reclaimer.py
+        return super().get_queryset().filter(deleted=False)
+
     def create(self, **obd_data):
         obd_data['id'] = str(uuid.uuid4())
         return super().create(**obd_data)
@@ -38,8 +42,10 @@ class Board(models.Model):
     prefix = models.CharField(max_length=8)
 
     link_access = models.IntegerField(default=Access.VIEWER, choices=Access.choices)
+    deleted = models.BooleanField(default=False, db_index=True)
 
     objects = BoardManager()
+    all_objects = models.Manager()
 
     def encode(self):
         return self.id
@@ -51,6 +57,9 @@ class Board(models.Model):
         except Board.DoesNotExist:
             raise BoardDoesNotExistException()
 
+    def can_be_changed(self, field: str) -> bool:
+        return field in ['name', 'board_type', 'prefix']
+
 
 def cascade_with_deleting_boards_where_user_is_owner(collector, field, sub_objs, using):
     # delete from UserBoards
@@ -116,4 +125,67 @@ class Column(models.Model):
             'id': self.id,
             'name': self.name,
             'position': self.position,
-        }
\ No newline at end of file
+        }
+
+
+class BoardTemplate(models.Model):
+    """
+    Columns and nodes to start boards with, nodes refer to their columns by position.
+    Templates without owner are shared with everybody
+    """
+    name = models.CharField(max_length=248)
+    board_type = models.CharField(choices=Board.BoardTypes.choices, max_length=50)
+    owner = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='board_templates',
+                              null=True, default=None)
+    content = models.JSONField(default=dict)
+    created = models.DateTimeField(default=timezone.now)
+
+
+class Job(models.Model):
+    """
+    Queued operation run by the workers of jobs.py
+    """
+    class Statuses(models.TextChoices):
+        QUEUED = "queued"
+        RUNNING = "running"
+        SUCCEEDED = "succeeded"
+        FAILED = "failed"
+
+    kind = models.CharField(max_length=64)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(choices=Statuses.choices, max_length=16, default=Statuses.QUEUED, db_index=True)
+    # status changes are pushed to the group of the board
+    board_id = models.CharField(max_length=128, null=True, default=None)
+    user = models.ForeignKey(get_user_model(), on_delete=models.SET_NULL, related_name='jobs',
+                             null=True, default=None)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, default=None)
+    progress = models.JSONField(null=True, default=None)
+    result = models.JSONField(null=True, default=None)
+    error = models.TextField(default='')
+    created = models.DateTimeField(default=timezone.now)
+    updated = models.DateTimeField(default=timezone.now)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'attempts': self.attempts,
+            'progress': self.progress,
+            'result': self.result,
+            'error': self.error,
+        }
+
+
+class Worker(models.Model):
+    """
+    Running worker process, boards are spread over the live ones by board_manager.workers
+    """
+    name = models.CharField(max_length=128, unique=True)
+    # where the load balancer sends the sockets of its boards, e.g. 10.0.0.5:8001
+    address = models.CharField(max_length=256)
+    heartbeat = models.DateTimeField(default=timezone.now, db_index=True)
+    started = models.DateTimeField(default=timezone.now)
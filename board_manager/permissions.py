@@ -0,0 +1,14 @@
+import hmac
+
+from django.conf import settings
+from rest_framework.permissions import BasePermission
+
+
+class IsLoadBalancer(BasePermission):
+    """
+    Requests of the load balancer, which sends BOARD_AFFINITY['ROUTE_TOKEN'] in the X-Route-Token header
+    """
+
+    def has_permission(self, request, view):
+        token = settings.BOARD_AFFINITY['ROUTE_TOKEN']
+        return bool(token) and hmac.compare_digest(request.META.get('HTTP_X_ROUTE_TOKEN', ''), token)
@@ -0,0 +1,146 @@
+import re
+
+from .exceptions import InvalidMessageException, UnknownMessageTypeException
+
+PROTOCOL_VERSION = 1
+
+NULL = type(None)
+DIGITS = re.compile(r'[0-9]+')
+
+
+class Integer:
+    """
+    Whole number coming both as a number and as a string of digits
+    """
+
+
+ID = Integer()  # ids of nodes, columns and users
+
+
+class Optional:
+    """
+    Field which may be absent
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+
+
+class MapOf:
+    """
+    Object with any keys, like {old column id: new column id}
+    """
+
+    def __init__(self, keys, values):
+        self.keys = keys
+        self.values = values
+
+
+def _type_names(types) -> list:
+    return ['null' if t is NULL else {dict: 'object', list: 'array'}.get(t, t.__name__) for t in types]
+
+
+def compile_schema(schema):
+    """
+    Turns a declared schema into a function checking a value and raising InvalidMessageException
+    """
+    if isinstance(schema, Optional):
+        return compile_schema(schema.schema)
+
+    if isinstance(schema, Integer):
+        def check_integer(value, path):
+            if not (isinstance(value, int) and not isinstance(value, bool) or
+                    isinstance(value, str) and DIGITS.fullmatch(value)):
+                raise InvalidMessageException(f"{path} must be number")
+        return check_integer
+
+    if isinstance(schema, MapOf):
+        check_key, check_value = compile_schema(schema.keys), compile_schema(schema.values)
+
+        def check_map(value, path):
+            if not isinstance(value, dict):
+                raise InvalidMessageException(f"{path} must be object")
+            for key, item in value.items():
+                check_key(key, f"{path} key")
+                check_value(item, f"{path}.{key}")
+        return check_map
+
+    if isinstance(schema, dict):
+        fields = [(name, compile_schema(field), isinstance(field, Optional)) for name, field in schema.items()]
+
+        def check_object(value, path):
+            if not isinstance(value, dict):
+                raise InvalidMessageException(f"{path} must be object")
+            for name, check, optional in fields:
+                if name in value:
+                    check(value[name], f"{path}.{name}" if path else name)
+                elif not optional:
+                    raise InvalidMessageException(f"{path}.{name} is empty field" if path else f"{name} is empty field")
+        return check_object
+
+    types = schema if isinstance(schema, tuple) else (schema,)
+    names = ' or '.join(_type_names(types))
+    # JSON true is not a number
+    bool_allowed = bool in types
+
+    def check_type(value, path):
+        if not isinstance(value, types) or (isinstance(value, bool) and not bool_allowed):
+            raise InvalidMessageException(f"{path} must be {names}")
+    return check_type
+
+
+def describe_schema(schema):
+    if isinstance(schema, Optional):
+        return {**describe_schema(schema.schema), 'optional': True}
+    if isinstance(schema, Integer):
+        return {'type': ['int', 'str'], 'pattern': DIGITS.pattern}
+    if isinstance(schema, MapOf):
+        return {'type': 'map', 'keys': describe_schema(schema.keys), 'values': describe_schema(schema.values)}
+    if isinstance(schema, dict):
+        return {'type': 'object', 'fields': {name: describe_schema(field) for name, field in schema.items()}}
+    return {'type': _type_names(schema if isinstance(schema, tuple) else (schema,))}
+
+
+class Message:
+    def __init__(self, type, schema, handler):
+        self.type = type
+        self.schema = schema
+        self.handler = handler
+        self.validate = compile_schema(schema)
+
+
+class MessageRegistry:
+    """
+    Message types of the websocket protocol with their schemas and handlers,
+    the only messages clients can send
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.messages = {}
+
+    def register(self, type, schema, handler):
+        self.messages[type] = Message(type, {'type': str, **schema}, handler)
+
+    def known_type(self, content, default='unknown') -> str:
+        message_type = content.get('type') if isinstance(content, dict) else None
+        return message_type if isinstance(message_type, str) and message_type in self.messages else default
+
+    def get(self, content) -> Message:
+        """
+        Returns the message type of the content if it matches its schema
+        """
+        if not isinstance(content, dict) or not isinstance(content.get('type'), str):
+            raise InvalidMessageException("message must be object with type")
+        message = self.messages.get(content['type'])
+        if message is None:
+            raise UnknownMessageTypeException(content['type'])
+        message.validate(content, '')
+        return message
+
+    def describe(self) -> dict:
+        return {'version': self.version,
+                'messages': {type: describe_schema(message.schema) for type, message in self.messages.items()}}
+
+
+protocol = MessageRegistry(PROTOCOL_VERSION)
@@ -0,0 +1,125 @@
+import time
+
+from channels_presence.models import Room, Presence
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from helpers.metrics import Counter, Gauge
+from .caching import bump, board_key
+from .jobs import enqueue
+from .logger import boards_logger
+from .models import Board, UserBoards, Access, Column, Node, BoardTemplate
+
+reclaimed_rows = Counter('reclaimed_rows_total', 'Rows of deleted boards and users removed by the reclaimer',
+                         ['table'])
+pending_deletions = Gauge('pending_deletions', 'Boards and users marked as deleted and not reclaimed yet', ['kind'])
+
+
+def mark_board_deleted(board):
+    """
+    Hides the board at once, its rows are removed by the reclaimer
+    """
+    board.deleted = True
+    board.save(update_fields=['deleted'])
+    # the progress is pushed to the sockets still open on the board
+    enqueue('reclaim', {'kind': 'board', 'pk': board.pk}, board_id=board.pk)
+
+
+def mark_user_deleted(user):
+    """
+    Deactivates the user and hides the boards they own, their rows are removed by the reclaimer
+    """
+    with transaction.atomic():
+        user.is_active = False
+        user.deleted = True
+        user.save(update_fields=['is_active', 'deleted'])
+
+        board_ids = list(UserBoards.objects.filter(user=user, access=Access.OWNER).values_list('board_id', flat=True))
+        Board.all_objects.filter(pk__in=board_ids).update(deleted=True)
+        # update() sends no signals
+        bump(*[board_key(board_id) for board_id in board_ids])
+
+        for board_id in board_ids:
+            enqueue('reclaim', {'kind': 'board', 'pk': board_id}, board_id=board_id)
+        enqueue('reclaim', {'kind': 'user', 'pk': user.pk})
+
+
+class Reclaimer:
+    """
+    Deletes the rows of boards and users marked as deleted, `chunk_size` rows per short transaction,
+    so no request waits for a big cascade and locks are held briefly
+    """
+
+    def __init__(self, chunk_size, pause):
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.progress = {}  # (kind, pk) -> removed rows
+
+    @staticmethod
+    def _steps(kind, pk) -> list:
+        # children first, the collector of the last row finds nothing left to load
+        if kind == 'board':
+            room = f"board_{pk}"
+            return [Node.objects.filter(board_id=pk),
+                    Column.objects.filter(board_id=pk),
+                    UserBoards.objects.filter(board_id=pk),
+                    Presence.objects.filter(room__channel_name=room),
+                    Room.objects.filter(channel_name=room),
+                    Board.all_objects.filter(pk=pk)]
+        return [UserBoards.objects.filter(user_id=pk),
+                Presence.objects.filter(user_id=pk),
+                BoardTemplate.objects.filter(owner_id=pk),
+                get_user_model().objects.filter(pk=pk)]
+
+    def reclaim_chunk(self, kind, pk) -> int:
+        """
+        Deletes the next chunk of rows of the board or user, returns 0 once nothing is left
+        """
+        for queryset in self._steps(kind, pk):
+            with transaction.atomic():
+                ids = list(queryset.values_list('pk', flat=True)[:self.chunk_size])
+                if ids:
+                    queryset.model._base_manager.filter(pk__in=ids).delete()
+            if ids:
+                reclaimed_rows.inc(len(ids), table=queryset.model._meta.db_table)
+                self.progress[(kind, pk)] = self.progress.get((kind, pk), 0) + len(ids)
+                return len(ids)
+        return 0
+
+    @staticmethod
+    def pending() -> list:
+        # boards first, deleted users own deleted boards
+        boards = list(Board.all_objects.filter(deleted=True).values_list('pk', flat=True))
+        users = list(get_user_model().objects.filter(deleted=True).values_list('pk', flat=True))
+        pending_deletions.set(len(boards), kind='board')
+        pending_deletions.set(len(users), kind='user')
+        return [('board', pk) for pk in boards] + [('user', pk) for pk in users]
+
+    def run(self, on_progress=None):
+        """
+        Reclaims everything marked as deleted, on_progress(kind, pk, removed rows, done) is called after each chunk
+        """
+        while True:
+            pending = self.pending()
+            # rows which can not be removed must not make it spin
+            if not pending or not any([self.reclaim(kind, pk, on_progress) for kind, pk in pending]):
+                return
+
+    def reclaim(self, kind, pk, on_progress=None) -> int:
+        """
+        Removes all rows of the board or user, returns how many
+        """
+        while self.reclaim_chunk(kind, pk):
+            if on_progress is not None:
+                on_progress(kind, pk, self.progress[(kind, pk)], False)
+            time.sleep(self.pause)
+        removed = self.progress.pop((kind, pk), 0)
+        if removed:
+            boards_logger.info(f"Reclaimed {kind} {pk}: {removed} rows")
+            if on_progress is not None:
+                on_progress(kind, pk, removed, True)
+        return removed
+
+
+reclaimer = Reclaimer(settings.RECLAIMER['CHUNK_SIZE'], settings.RECLAIMER['PAUSE_SECONDS'])
@@ -0,0 +1,176 @@
+import html
+import re
+
+from django.conf import settings
+from django.db import connections, router
+
+from .exceptions import EmptySearchQueryException, InvalidSearchPageException
+from .models import Node
+
+# highlighted words are marked with control characters and turned into <mark> after escaping the text
+START_MARK, STOP_MARK = '\x02', '\x03'
+
+ACCESSIBLE_BOARDS = """
+    SELECT user_boards.board_id FROM board_manager_userboards user_boards
+    JOIN board_manager_board board ON board.id = user_boards.board_id
+    WHERE user_boards.user_id = %s AND NOT board.deleted
+"""
+
+
+class PostgresSearch:
+    """
+    tsvector column of the nodes filled by a trigger on every write, including update() of the text editor
+    """
+
+    def install(self, connection):
+        config = settings.SEARCH['CONFIG']
+        with connection.cursor() as cursor:
+            cursor.execute("ALTER TABLE board_manager_node ADD COLUMN IF NOT EXISTS search_vector tsvector")
+            cursor.execute(f"""
+                CREATE OR REPLACE FUNCTION board_manager_node_search_vector() RETURNS trigger AS $$
+                BEGIN
+                    NEW.search_vector := setweight(to_tsvector('{config}', coalesce(NEW.title, '')), 'A')
+                                      || setweight(to_tsvector('{config}', coalesce(NEW.description, '')), 'B');
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql
+            """)
+            cursor.execute("DROP TRIGGER IF EXISTS board_manager_node_search ON board_manager_node")
+            cursor.execute("""
+                CREATE TRIGGER board_manager_node_search BEFORE INSERT OR UPDATE OF title, description
+                ON board_manager_node FOR EACH ROW EXECUTE PROCEDURE board_manager_node_search_vector()
+            """)
+            # rows written before the trigger, after a change of the config the column is emptied by hand
+            cursor.execute("UPDATE board_manager_node SET title = title WHERE search_vector IS NULL")
+            cursor.execute("CREATE INDEX IF NOT EXISTS board_manager_node_search_vector "
+                           "ON board_manager_node USING GIN (search_vector)")
+
+    def search(self, connection, words, user_id, board_id, limit, offset) -> list:
+        query = ' & '.join(f"{word}:*" for word in words)
+        board_filter = "AND node.board_id = %s" if board_id is not None else ""
+        options = f"StartSel={START_MARK}, StopSel={STOP_MARK}, MaxFragments=2, MaxWords=20, MinWords=5"
+        # headlines only for the page, they are slow
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT page.id, page.board_id, page.rank, page.total,
+                       ts_headline(%s, node.title, page.query, %s),
+                       ts_headline(%s, node.description, page.query, %s)
+                FROM (
+                    SELECT node.id, node.board_id, ts_rank(node.search_vector, query) AS rank,
+                           COUNT(*) OVER () AS total, query
+                    FROM board_manager_node node, to_tsquery(%s, %s) query
+                    WHERE node.search_vector @@ query
+                      AND node.board_id IN ({ACCESSIBLE_BOARDS}) {board_filter}
+                    ORDER BY rank DESC, node.id
+                    LIMIT %s OFFSET %s
+                ) page
+                JOIN board_manager_node node ON node.id = page.id
+                ORDER BY page.rank DESC, page.id
+            """, [settings.SEARCH['CONFIG'], options, settings.SEARCH['CONFIG'], options,
+                  settings.SEARCH['CONFIG'], query, user_id] + ([board_id] if board_id is not None else [])
+                 + [limit, offset])
+            return cursor.fetchall()
+
+
+class SqliteSearch:
+    """
+    FTS5 table over the nodes kept current by triggers, for local runs and tests
+    """
+
+    def install(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS board_manager_node_fts
+                USING fts5(title, description, content='board_manager_node', content_rowid='id')
+            """)
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS board_manager_node_fts_insert AFTER INSERT ON board_manager_node BEGIN
+                    INSERT INTO board_manager_node_fts(rowid, title, description)
+                    VALUES (new.id, new.title, new.description);
+                END
+            """)
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS board_manager_node_fts_delete AFTER DELETE ON board_manager_node BEGIN
+                    INSERT INTO board_manager_node_fts(board_manager_node_fts, rowid, title, description)
+                    VALUES ('delete', old.id, old.title, old.description);
+                END
+            """)
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS board_manager_node_fts_update AFTER UPDATE OF title, description
+                ON board_manager_node BEGIN
+                    INSERT INTO board_manager_node_fts(board_manager_node_fts, rowid, title, description)
+                    VALUES ('delete', old.id, old.title, old.description);
+                    INSERT INTO board_manager_node_fts(rowid, title, description)
+                    VALUES (new.id, new.title, new.description);
+                END
+            """)
+            cursor.execute("INSERT INTO board_manager_node_fts(board_manager_node_fts) VALUES ('rebuild')")
+
+    def search(self, connection, words, user_id, board_id, limit, offset) -> list:
+        query = ' '.join(f'"{word}"*' for word in words)
+        board_filter = "AND node.board_id = %s" if board_id is not None else ""
+        with connection.cursor() as cursor:
+            # bm25 is lower for better matches, titles weigh more. The auxiliary functions work only
+            # in the query of the FTS table, so they run for all matches, fine for local runs
+            cursor.execute(f"""
+                SELECT node.id, node.board_id, matches.rank, COUNT(*) OVER () AS total, matches.title, matches.snippet
+                FROM (
+                    SELECT rowid, -bm25(board_manager_node_fts, 10.0, 1.0) AS rank,
+                           highlight(board_manager_node_fts, 0, %s, %s) AS title,
+                           snippet(board_manager_node_fts, 1, %s, %s, '...', 20) AS snippet
+                    FROM board_manager_node_fts
+                    WHERE board_manager_node_fts MATCH %s
+                ) matches
+                JOIN board_manager_node node ON node.id = matches.rowid
+                WHERE node.board_id IN ({ACCESSIBLE_BOARDS}) {board_filter}
+                ORDER BY matches.rank DESC, node.id
+                LIMIT %s OFFSET %s
+            """, [START_MARK, STOP_MARK, START_MARK, STOP_MARK, query, user_id]
+                 + ([board_id] if board_id is not None else []) + [limit, offset])
+            return cursor.fetchall()
+
+
+search_backends = {'postgresql': PostgresSearch(), 'sqlite': SqliteSearch()}
+
+
+def install_search_index(using, **kwargs):
+    """
+    post_migrate receiver creating the index, the triggers and the column outside of the models
+    """
+    connection = connections[using]
+    backend = search_backends.get(connection.vendor)
+    if backend is not None and router.allow_migrate_model(using, Node):
+        backend.install(connection)
+
+
+def _marked(text) -> str:
+    return html.escape(text or '').replace(START_MARK, '<mark>').replace(STOP_MARK, '</mark>')
+
+
+def search_nodes(user, query, board_id=None, page=1, page_size=None) -> dict:
+    """
+    Nodes of the boards of the user (or of one board) matching all words of the query as prefixes,
+    the best matches first. Highlighted words of the title and the snippet of the description are in <mark>
+    """
+    words = re.findall(r'\w+', query or '')[:settings.SEARCH['MAX_WORDS']]
+    if not words:
+        raise EmptySearchQueryException()
+    try:
+        page = max(int(page), 1)
+        page_size = min(max(int(page_size or settings.SEARCH['PAGE_SIZE']), 1), settings.SEARCH['MAX_PAGE_SIZE'])
+    except (TypeError, ValueError):
+        raise InvalidSearchPageException()
+
+    connection = connections[router.db_for_read(Node)]
+    rows = search_backends[connection.vendor].search(connection, words, user.pk, board_id,
+                                                     page_size, (page - 1) * page_size)
+    return {'query': query,
+            'page': page,
+            'page_size': page_size,
+            'total': rows[0][3] if rows else 0,
+            'results': [{'node_id': node_id,
+                         'board_id': node_board_id,
+                         'rank': rank,
+                         'title': _marked(title),
+                         'snippet': _marked(snippet)}
+                        for node_id, node_board_id, rank, _, title, snippet in rows]}
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from board_manager.models import Board, UserBoards, Node, Column
+from board_manager.models import Board, UserBoards, Node, Column, BoardTemplate
 from authentication.serializers import UserSerializer
 
 
@@ -48,3 +48,8 @@ class ColumnSerializer(serializers.ModelSerializer):
         model = Column
         fields = '__all__'
 
+
+class BoardTemplateSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BoardTemplate
+        fields = ('id', 'name', 'board_type', 'created')
@@ -0,0 +1,40 @@
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from .board_manager_backend import BoardManager
+from .jobs import register_job, job_runner
+from .models import Board, Node
+from .reclaimer import reclaimer
+
+
+@register_job('clone_board')
+def clone_board(job, board_id, user_id, name=None):
+    board = BoardManager.clone_board(board_id, get_user_model().objects.get(pk=user_id), name)
+    return {'board_id': board.pk}
+
+
+@register_job('migrate_to_another_board')
+def migrate_to_another_board(job, board_id, to_board_id, columns):
+    """
+    Moves the nodes to the other board, `columns` maps their columns to the columns of the other board
+    """
+    with transaction.atomic():
+        board = Board.objects.get(pk=board_id)
+        to_board = Board.objects.get(pk=to_board_id)
+        moved = 0
+        for column, to_column in columns.items():
+            moved += Node.objects.filter(board=board, status=column).update(board=to_board, status=str(to_column))
+        # nodes of columns missing in the map keep their status, the migration never cleared it
+        moved += Node.objects.filter(board=board).update(board=to_board)
+
+        now = datetime.datetime.now()
+        Board.objects.filter(pk__in=[board.pk, to_board.pk]).update(updated=now)
+    return {'nodes': moved}
+
+
+@register_job('reclaim', max_attempts=10)
+def reclaim(job, kind, pk):
+    removed = reclaimer.reclaim(kind, pk, lambda kind, pk, removed, done: job_runner.report(job, {'removed': removed}))
+    return {'removed': removed}
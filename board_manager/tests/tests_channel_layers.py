@@ -0,0 +1,303 @@
+import asyncio
+import threading
+
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer
+from django.test import SimpleTestCase, TestCase
+
+from board_manager.channel_layers import LocalFirstChannelLayer, local_messages, remote_messages, dropped_messages
+from board_manager.models import Worker
+from board_manager.workers import WorkerRegistry
+from helpers.consistent_hash import ConsistentHashRing
+
+
+class ConsistentHashRingTestCase(SimpleTestCase):
+    def test_same_node_for_key(self):
+        ring = ConsistentHashRing(['worker_1', 'worker_2', 'worker_3'])
+        self.assertEqual(ring.get_node('board_1'), ring.get_node('board_1'))
+        self.assertEqual(ring.nodes, {'worker_1', 'worker_2', 'worker_3'})
+
+    def test_remove_node_moves_only_its_keys(self):
+        ring = ConsistentHashRing(['worker_1', 'worker_2', 'worker_3'])
+        keys = [f"board_{i}" for i in range(300)]
+        before = {key: ring.get_node(key) for key in keys}
+
+        ring.remove('worker_2')
+        for key in keys:
+            if before[key] != 'worker_2':
+                self.assertEqual(ring.get_node(key), before[key])
+            else:
+                self.assertNotEqual(ring.get_node(key), 'worker_2')
+
+    def test_empty_ring(self):
+        with self.assertRaises(LookupError):
+            ConsistentHashRing().get_node('board_1')
+
+
+class LocalFirstChannelLayerTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        # two processes sharing two remote shards
+        self.shards = [InMemoryChannelLayer(), InMemoryChannelLayer()]
+        self.layer = LocalFirstChannelLayer(self.shards)
+        self.another_layer = LocalFirstChannelLayer(self.shards)
+
+    async def receive(self, layer, channel):
+        return await asyncio.wait_for(layer.receive(channel), timeout=1)
+
+    @staticmethod
+    async def announced():
+        # the relays pass the announcements of the members
+        await asyncio.sleep(0.05)
+
+    async def test_group_send_to_local_channels(self):
+        channels = [await self.layer.new_channel() for _ in range(3)]
+        for channel in channels:
+            await self.layer.group_add('board_1', channel)
+
+        local_before, remote_before = local_messages.value(), remote_messages.value()
+        await self.layer.group_send('board_1', {'type': 'send_content', 'content': {'type': 'node_created'}})
+
+        for channel in channels:
+            message = await self.receive(self.layer, channel)
+            self.assertEqual(message['content'], {'type': 'node_created'})
+        self.assertEqual(local_messages.value() - local_before, 3)
+        # no other process is in the group
+        self.assertEqual(remote_messages.value() - remote_before, 0)
+
+    async def test_group_send_from_process_out_of_group(self):
+        channel = await self.layer.new_channel()
+        await self.layer.group_add('board_1', channel)
+
+        remote_before = remote_messages.value()
+        await self.another_layer.group_send('board_1', {'type': 'send_content', 'content': 3})
+
+        self.assertEqual((await self.receive(self.layer, channel))['content'], 3)
+        self.assertEqual(remote_messages.value() - remote_before, 1)
+
+    async def test_members_learn_about_each_other(self):
+        channel = await self.layer.new_channel()
+        await self.layer.group_add('board_1', channel)
+        another_channel = await self.another_layer.new_channel()
+        await self.another_layer.group_add('board_1', another_channel)
+        await self.announced()
+
+        self.assertEqual(self.layer.remote_members['board_1'], {self.another_layer.process_id})
+        self.assertEqual(self.another_layer.remote_members['board_1'], {self.layer.process_id})
+
+        await self.another_layer.group_discard('board_1', another_channel)
+        await self.announced()
+        self.assertEqual(self.layer.remote_members['board_1'], set())
+
+        remote_before = remote_messages.value()
+        await self.layer.group_send('board_1', {'type': 'send_content', 'content': 1})
+        self.assertEqual(remote_messages.value() - remote_before, 0)
+
+    async def test_full_channel_drops_group_messages(self):
+        layer = LocalFirstChannelLayer(self.shards, capacity=1)
+        channel = await layer.new_channel()
+        await layer.group_add('board_1', channel)
+
+        dropped_before = dropped_messages.value()
+        for content in (1, 2):
+            await layer.group_send('board_1', {'type': 'send_content', 'content': content})
+        self.assertEqual(dropped_messages.value() - dropped_before, 1)
+        self.assertEqual((await self.receive(layer, channel))['content'], 1)
+
+    async def test_group_send_from_another_thread(self):
+        channel = await self.layer.new_channel()
+        await self.layer.group_add('board_1', channel)
+        # the debug mode refuses changes of the loop from other threads
+        asyncio.get_running_loop().set_debug(True)
+        receive = asyncio.ensure_future(self.receive(self.layer, channel))
+        await asyncio.sleep(0.05)
+
+        # like JobRunner.push, on a loop of its own
+        def push():
+            async_to_sync(self.layer.group_send)('board_1', {'type': 'send_content', 'content': 'job_status'})
+
+        thread = threading.Thread(target=push)
+        thread.start()
+        await asyncio.get_running_loop().run_in_executor(None, thread.join, 5)
+
+        self.assertEqual((await receive)['content'], 'job_status')
+
+    async def test_group_send_to_another_process(self):
+        channel = await self.layer.new_channel()
+        another_channel = await self.another_layer.new_channel()
+        await self.layer.group_add('board_1', channel)
+        await self.another_layer.group_add('board_1', another_channel)
+        await self.announced()
+
+        await self.layer.group_send('board_1', {'type': 'send_content', 'content': 1})
+
+        self.assertEqual((await self.receive(self.layer, channel))['content'], 1)
+        self.assertEqual((await self.receive(self.another_layer, another_channel))['content'], 1)
+
+        # the sender does not get its own message once more through the relay
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(self.layer.receive(channel), timeout=0.1)
+
+    async def test_group_discard(self):
+        channel = await self.layer.new_channel()
+        another_channel = await self.another_layer.new_channel()
+        await self.layer.group_add('board_1', channel)
+        await self.another_layer.group_add('board_1', another_channel)
+        await self.another_layer.group_discard('board_1', another_channel)
+
+        await self.layer.group_send('board_1', {'type': 'send_content', 'content': 1})
+
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(self.another_layer.receive(another_channel), timeout=0.1)
+
+    async def test_send_to_channel_of_another_process(self):
+        another_channel = await self.another_layer.new_channel()
+
+        await self.layer.send(another_channel, {'type': 'send_content', 'content': 2})
+
+        self.assertEqual((await self.receive(self.another_layer, another_channel))['content'], 2)
+
+    def test_groups_are_sharded(self):
+        shards = {self.layer._shard_index(f"board_{i}") for i in range(50)}
+        self.assertEqual(shards, {0, 1})
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class WorkerRegistryTestCase(TestCase):
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+        self.registries = [WorkerRegistry(f"worker_{i}", f"10.0.0.{i}:8000", 5, 15, 100, clock=self.clock)
+                           for i in range(3)]
+        for registry in self.registries:
+            registry.heartbeat()
+        for registry in self.registries:
+            registry.refresh()
+
+    def test_workers_agree_on_owners(self):
+        groups = [f"board_{i}" for i in range(300)]
+        owners = [{registry.owner(group) for registry in self.registries} for group in groups]
+        self.assertTrue(all(len(group_owners) == 1 for group_owners in owners))
+        self.assertEqual(set.union(*owners), {'worker_0', 'worker_1', 'worker_2'})
+        owner = self.registries[0].owner(groups[0])
+        self.assertEqual(self.registries[0].owner_address(groups[0]), f"10.0.0.{owner[-1]}:8000")
+
+    def test_ownership_is_trusted_once_stable(self):
+        registry = self.registries[0]
+        group = next(f"board_{i}" for i in range(300) if registry.owner(f"board_{i}") == 'worker_0')
+        self.assertFalse(registry.owns_group(group))
+        self.clock.now = 15
+        self.assertTrue(registry.owns_group(group))
+
+    def test_leaving_worker_moves_only_its_boards(self):
+        registry = self.registries[0]
+        groups = [f"board_{i}" for i in range(300)]
+        before = {group: registry.owner(group) for group in groups}
+        version = registry.version
+
+        Worker.objects.filter(name='worker_2').delete()
+        registry.refresh()
+
+        self.assertEqual(registry.version, version + 1)
+        for group in groups:
+            if before[group] != 'worker_2':
+                self.assertEqual(registry.owner(group), before[group])
+            else:
+                self.assertIn(registry.owner(group), {'worker_0', 'worker_1'})
+
+
+class BoardAffinityTestCase(SimpleTestCase):
+    """
+    Two worker processes sharing the remote shards, the sockets of a board placed on its owner
+    """
+
+    def setUp(self) -> None:
+        self.shards = [InMemoryChannelLayer(), InMemoryChannelLayer()]
+        self.registries = {}
+        self.layers = {}
+        for name in ('worker_0', 'worker_1'):
+            registry = WorkerRegistry(name, '', 5, 15, 100, clock=lambda: 100)
+            registry.ring = ConsistentHashRing(['worker_0', 'worker_1'])
+            registry.changed_at = 0
+            self.registries[name] = registry
+            self.layers[name] = LocalFirstChannelLayer(self.shards, owner_only=True, owners=registry)
+        self.groups = [f"board_{i}" for i in range(20)]
+
+    async def connect(self, layer, group, sockets=3):
+        channels = [await layer.new_channel() for _ in range(sockets)]
+        for channel in channels:
+            await layer.group_add(group, channel)
+        return channels
+
+    async def receive(self, layer, channel):
+        return await asyncio.wait_for(layer.receive(channel), timeout=1)
+
+    @staticmethod
+    async def announced():
+        # the relays pass the announcements of the members
+        await asyncio.sleep(0.05)
+
+    async def test_no_cross_process_fan_out(self):
+        sockets = {}
+        for group in self.groups:
+            layer = self.layers[self.registries['worker_0'].owner(group)]
+            sockets[group] = (layer, await self.connect(layer, group))
+
+        remote_before = remote_messages.value()
+        for group, (layer, channels) in sockets.items():
+            await layer.group_send(group, {'type': 'send_content', 'content': group})
+            for channel in channels:
+                self.assertEqual((await self.receive(layer, channel))['content'], group)
+        self.assertEqual(remote_messages.value() - remote_before, 0)
+
+    async def test_without_affinity(self):
+        # sockets of every board in both processes, all group messages cross the remote layer
+        layers = [LocalFirstChannelLayer(self.shards), LocalFirstChannelLayer(self.shards)]
+        for group in self.groups:
+            for layer in layers:
+                await self.connect(layer, group, sockets=1)
+        await self.announced()
+
+        remote_before = remote_messages.value()
+        for group in self.groups:
+            await layers[0].group_send(group, {'type': 'send_content', 'content': group})
+        self.assertEqual(remote_messages.value() - remote_before, len(self.groups))
+
+    async def test_send_from_another_process(self):
+        group = self.groups[0]
+        owner = self.registries['worker_0'].owner(group)
+        other = 'worker_1' if owner == 'worker_0' else 'worker_0'
+        channel, = await self.connect(self.layers[owner], group, sockets=1)
+
+        await self.layers[other].group_send(group, {'type': 'send_content', 'content': 1})
+        self.assertEqual((await self.receive(self.layers[owner], channel))['content'], 1)
+
+    async def test_sockets_of_moved_boards_reconnect(self):
+        registry = self.registries['worker_0']
+        layer = self.layers['worker_0']
+        owned = [group for group in self.groups if registry.owner(group) == 'worker_0']
+        channels = {group: (await self.connect(layer, group, sockets=1))[0] for group in owned}
+
+        # worker_2 joins and takes some of the boards
+        registry.ring = ConsistentHashRing(['worker_0', 'worker_1', 'worker_2'])
+        registry.version += 1
+        moved = [group for group in owned if registry.is_moved(group)]
+        self.assertTrue(moved)
+
+        for group in moved:
+            message = await self.receive(layer, channels[group])
+            self.assertEqual(message, {'type': 'board_moved', 'group': group})
+        for group in set(owned) - set(moved):
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(layer.receive(channels[group]), timeout=0.01)
+
+    async def test_socket_on_wrong_worker(self):
+        group = self.groups[0]
+        other = 'worker_1' if self.registries['worker_0'].owner(group) == 'worker_0' else 'worker_0'
+        channel, = await self.connect(self.layers[other], group, sockets=1)
+        self.assertEqual((await self.receive(self.layers[other], channel))['type'], 'board_moved')
@@ -0,0 +1,212 @@
+from django.core.cache import cache
+from django.db import connection
+from unittest import mock
+
+from django.test import TestCase, SimpleTestCase, TransactionTestCase, override_settings
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from CodeDocs_backend.warmup import WarmUp, PHASES, warmup_phase_seconds
+from authentication.models import CustomUser
+from board_manager.board_manager_backend import BoardManager
+from board_manager.models import Board, Node
+from helpers.instrumentation import handler_duration, handler_queries, payload_size, instrument
+from helpers.context import handler_context
+from helpers.sql_tracing import repeated_queries
+from helpers.metrics import Counter, Gauge, Histogram, MetricsRegistry, merge_rendered
+
+
+class HistogramTestCase(SimpleTestCase):
+    def test_samples(self):
+        histogram = Histogram('test_duration_seconds', 'Test', ['handler'], buckets=(0.1, 1))
+        histogram.observe(0.05, handler='a')
+        histogram.observe(0.5, handler='a')
+        histogram.observe(5, handler='a')
+
+        samples = {(name, labels.get('le')): value for name, labels, value in histogram.samples()}
+        self.assertEqual(samples[('test_duration_seconds_bucket', '0.1')], 1)
+        self.assertEqual(samples[('test_duration_seconds_bucket', '1')], 2)
+        self.assertEqual(samples[('test_duration_seconds_bucket', '+Inf')], 3)
+        self.assertEqual(samples[('test_duration_seconds_sum', None)], 5.55)
+        self.assertEqual(samples[('test_duration_seconds_count', None)], 3)
+
+    def test_render(self):
+        registry = MetricsRegistry()
+        histogram = Histogram('test_size_bytes', 'Test', buckets=(10,))
+        registry.register(histogram)
+        histogram.observe(3)
+
+        self.assertEqual(registry.render(), '# HELP test_size_bytes Test\n'
+                                            '# TYPE test_size_bytes histogram\n'
+                                            'test_size_bytes_bucket{le="10"} 1\n'
+                                            'test_size_bytes_bucket{le="+Inf"} 1\n'
+                                            'test_size_bytes_sum 3\n'
+                                            'test_size_bytes_count 1\n')
+
+    def test_merge_rendered(self):
+        texts = {}
+        for worker, value in enumerate((1, 2.5)):
+            registry = MetricsRegistry()
+            counter = Counter('test_total', 'Test', ['kind'])
+            registry.register(counter)
+            counter.inc(value, kind='a')
+            counter.inc(kind=str(value))
+            texts[worker] = registry.render()
+
+        self.assertEqual(merge_rendered(texts), '# HELP test_total Test\n'
+                                                '# TYPE test_total counter\n'
+                                                'test_total{kind="a"} 3.5\n'
+                                                'test_total{kind="1"} 1\n'
+                                                'test_total{kind="2.5"} 1\n')
+
+    def test_merge_rendered_gauges(self):
+        texts = {}
+        for worker in (0, 1):
+            registry = MetricsRegistry()
+            gauge = Gauge('test_ready', 'Test')
+            labelled_gauge = Gauge('test_phase_seconds', 'Test', ['phase'])
+            registry.register(gauge)
+            registry.register(labelled_gauge)
+            gauge.set(1)
+            labelled_gauge.set(worker + 0.5, phase='cache')
+            texts[worker] = registry.render()
+        registry = MetricsRegistry()
+        supervisor_gauge = Gauge('test_alive', 'Test')
+        registry.register(supervisor_gauge)
+        supervisor_gauge.set(2)
+        texts[None] = registry.render()
+
+        self.assertEqual(merge_rendered(texts), '# HELP test_ready Test\n'
+                                                '# TYPE test_ready gauge\n'
+                                                'test_ready{worker="0"} 1\n'
+                                                'test_ready{worker="1"} 1\n'
+                                                '# HELP test_phase_seconds Test\n'
+                                                '# TYPE test_phase_seconds gauge\n'
+                                                'test_phase_seconds{worker="0",phase="cache"} 0.5\n'
+                                                'test_phase_seconds{worker="1",phase="cache"} 1.5\n'
+                                                '# HELP test_alive Test\n'
+                                                '# TYPE test_alive gauge\n'
+                                                'test_alive 2\n')
+
+
+class MetricsEndpointTestCase(TestCase):
+    def setUp(self) -> None:
+        # cached responses of my_boards would run no queries
+        cache.clear()
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(username='Igor Mashtakov',
+                                                   email='111@mail.ru',
+                                                   password='12345')
+        self.client.force_authenticate(user=self.user)
+
+    def test_view_metrics(self):
+        durations_before = handler_duration.count(kind='view', handler='my_boards')
+        queries_before = handler_queries.sum(kind='view', handler='my_boards')
+        sent_before = payload_size.sum(kind='view', handler='my_boards', direction='sent')
+
+        BoardManager.create_board("board_1", Board.BoardTypes.KANBAN, self.user)
+        response = self.client.get('/board/my')
+
+        self.assertEqual(handler_duration.count(kind='view', handler='my_boards'), durations_before + 1)
+        self.assertGreater(handler_queries.sum(kind='view', handler='my_boards'), queries_before)
+        self.assertEqual(payload_size.sum(kind='view', handler='my_boards', direction='sent'),
+                         sent_before + len(response.content))
+
+    def test_metrics_endpoint(self):
+        board = BoardManager.create_board("board_1", Board.BoardTypes.KANBAN, self.user)
+        Node.objects.create(board=board, tag=1, color='#5688C7', blocked_by=self.user)
+        self.client.get('/board/my')
+
+        with override_settings(METRICS={'TOKEN': 'scraper', 'STATS_TOKEN': 'runworkers'}):
+            self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer other').status_code,
+                             status.HTTP_403_FORBIDDEN)
+            # e.g. behind nginx over a unix socket
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='').status_code, status.HTTP_403_FORBIDDEN)
+            self.assertEqual(self.client.get('/metrics', HTTP_X_STATS_TOKEN='runworkers').status_code,
+                             status.HTTP_200_OK)
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scraper')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = response.content.decode()
+        self.assertIn('board_held_node_locks 1\n', content)
+        self.assertIn('board_rooms 0\n', content)
+        self.assertIn('# TYPE websocket_open_connections gauge', content)
+        self.assertIn('handler_duration_seconds_count{kind="view",handler="my_boards"}', content)
+
+
+class SqlTracingTestCase(TestCase):
+    def setUp(self) -> None:
+        # cached responses of my_boards would run no queries
+        cache.clear()
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(username='Igor Mashtakov',
+                                                   email='111@mail.ru',
+                                                   password='12345')
+        self.client.force_authenticate(user=self.user)
+
+    def test_queries_are_tagged(self):
+        executed = []
+
+        def capture(execute, sql, params, many, context):
+            executed.append(sql)
+            return execute(sql, params, many, context)
+
+        with instrument('websocket', 'board_nodes', type='board_nodes', board='a*/b', user=1):
+            self.assertEqual(handler_context.get()['board'], 'a*/b')
+            with connection.execute_wrapper(capture):
+                list(Board.objects.all())
+        self.assertIsNone(handler_context.get())
+        self.assertTrue(executed[0].startswith('/* handler=board_nodes, type=board_nodes, board=a__b */ '))
+
+    @override_settings(SQL_TRACING={'SLOW_QUERY_SECONDS': 0, 'REPEATED_QUERIES': 5})
+    def test_slow_queries_are_logged(self):
+        with self.assertLogs('sql_logger', 'WARNING') as logs:
+            with instrument('view', 'my_boards'):
+                list(Board.objects.all())
+        self.assertIn('SLOW QUERY', logs.output[0])
+        self.assertIn("'handler': 'my_boards'", logs.output[0])
+
+    def test_repeated_queries_are_reported(self):
+        for i in range(5):
+            BoardManager.create_board(f"board_{i}", Board.BoardTypes.KANBAN, self.user)
+        repeated_before = repeated_queries.value(handler='my_boards')
+
+        with self.assertLogs('sql_logger', 'WARNING') as logs:
+            self.client.get('/board/my')
+
+        self.assertEqual(repeated_queries.value(handler='my_boards'), repeated_before + 1)
+        self.assertIn('REPEATED QUERY 5 times', logs.output[0])
+
+
+class WarmUpTestCase(TransactionTestCase):
+    def test_phases(self):
+        def failing():
+            raise ValueError("no connection")
+
+        warmup = WarmUp([('first', lambda: None), ('failing', failing)])
+        warmup.run()
+
+        status = warmup.status()
+        self.assertTrue(status['ready'])
+        self.assertEqual(set(status['phases']), {'first', 'failing'})
+        self.assertEqual(status['errors'], {'failing': "no connection"})
+        self.assertEqual(warmup_phase_seconds.value(phase='first'), warmup.durations['first'])
+
+    def test_project_phases(self):
+        warmup = WarmUp(PHASES)
+        warmup.run()
+        self.assertEqual(warmup.errors, {})
+
+    @override_settings(WARMUP={'ENABLED': True, 'DB_CONNECTIONS': 1})
+    def test_readiness(self):
+        warmup = WarmUp([])
+        with mock.patch('CodeDocs_backend.warmup.warmup', warmup):
+            response = self.client.get('/ready')
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertFalse(response.json()['ready'])
+
+            warmup.run()
+            response = self.client.get('/ready')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.json()['ready'])
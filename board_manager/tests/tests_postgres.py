@@ -0,0 +1,125 @@
+from unittest import skipUnless
+
+from django.db import connection, transaction, OperationalError
+from django.test import TestCase, TransactionTestCase
+
+from authentication.models import CustomUser
+from board_manager.board_manager_backend import BoardManager
+from board_manager.models import Board, Node
+from board_manager.search import PostgresSearch, search_nodes
+
+# run by CI against its Postgres, the other backends skip them
+POOLED_POSTGRES = connection.settings_dict['ENGINE'] == 'helpers.pooled_postgresql'
+
+
+@skipUnless(POOLED_POSTGRES, "needs the pooled PostgreSQL backend")
+class PooledPostgresTestCase(TransactionTestCase):
+    def setUp(self) -> None:
+        connection.ensure_connection()
+
+    def tearDown(self) -> None:
+        connection.close()
+
+    def test_reuse_after_close(self):
+        raw_connection = connection.connection
+        connection.close()
+        self.assertIsNone(connection.connection)
+
+        connection.ensure_connection()
+        self.assertIs(connection.connection, raw_connection)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            self.assertEqual(cursor.fetchone(), (1,))
+
+    def test_broken_connection_is_discarded(self):
+        raw_connection = connection.connection
+
+        # another session kills the backend of this one
+        other = connection.pool.get()
+        try:
+            with other.cursor() as cursor:
+                cursor.execute('SELECT pg_terminate_backend(%s)', [raw_connection.get_backend_pid()])
+            other.commit()
+        finally:
+            connection.pool.put(other)
+        with self.assertRaises(OperationalError):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+
+        connection.close()
+        self.assertTrue(raw_connection.closed)
+
+        connection.ensure_connection()
+        self.assertIsNot(connection.connection, raw_connection)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+
+    def test_open_transaction_is_rolled_back(self):
+        raw_connection = connection.connection
+        connection.set_autocommit(False)
+        CustomUser.objects.create_user(username='pooled', email='pooled@mail.ru', password='12345')
+        connection.close()
+
+        connection.ensure_connection()
+        self.assertIs(connection.connection, raw_connection)
+        self.assertTrue(connection.get_autocommit())
+        self.assertFalse(CustomUser.objects.filter(username='pooled').exists())
+
+    def test_transactions(self):
+        with transaction.atomic():
+            CustomUser.objects.create_user(username='committed', email='committed@mail.ru', password='12345')
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                CustomUser.objects.create_user(username='rolled_back', email='rolled@mail.ru', password='12345')
+                raise ValueError()
+        connection.close()
+
+        # another connection lent by the pool sees only the committed user
+        connection.ensure_connection()
+        self.assertEqual(list(CustomUser.objects.values_list('username', flat=True)), ['committed'])
+
+    def test_close_inside_atomic_block(self):
+        raw_connection = connection.connection
+        with transaction.atomic():
+            CustomUser.objects.create_user(username='closed', email='closed@mail.ru', password='12345')
+            connection.close()
+            self.assertTrue(raw_connection.closed)
+        self.assertFalse(CustomUser.objects.filter(username='closed').exists())
+
+
+@skipUnless(connection.vendor == 'postgresql', "needs PostgreSQL")
+class PostgresSearchTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = CustomUser.objects.create_user(username='Igor Mashtakov',
+                                                   email='111@mail.ru',
+                                                   password='12345')
+        self.board = BoardManager.create_board("board_1", Board.BoardTypes.KANBAN, self.user)
+        self.node = Node.objects.create(board=self.board, tag=1, color='red', title="Deploy <server>",
+                                        description="Ask the admins to deploy it on friday after the review")
+
+    def search_vector(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT search_vector::text FROM board_manager_node WHERE id = %s", [self.node.pk])
+            return cursor.fetchone()[0]
+
+    def test_trigger_fills_vector(self):
+        self.assertIn("'deploy':1A", self.search_vector())
+        self.assertIn("'friday'", self.search_vector())
+
+        Node.objects.filter(pk=self.node.pk).update(title="Rollback")
+        self.assertIn("'rollback':1A", self.search_vector())
+        self.assertEqual(search_nodes(self.user, "rollback")['total'], 1)
+
+    def test_backfill_of_rows_without_vector(self):
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE board_manager_node SET search_vector = NULL")
+        self.assertEqual(search_nodes(self.user, "deploy")['total'], 0)
+
+        PostgresSearch().install(connection)
+        self.assertEqual(search_nodes(self.user, "deploy")['total'], 1)
+
+    def test_headlines(self):
+        result = search_nodes(self.user, "depl", self.board.pk)['results'][0]
+        self.assertEqual(result['title'], "<mark>Deploy</mark> &lt;server&gt;")
+        self.assertIn("<mark>deploy</mark> it on friday", result['snippet'])
+        self.assertGreater(result['rank'], 0)
@@ -1,11 +1,55 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import io
+import json
+import logging
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+import types
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from django.db import connections
+from django.test import TestCase, SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
 
 from board_manager.exceptions import (
     BoardDoesNotExistException, NoRequiredBoardAccess
 )
 from board_manager.board_manager_backend import BoardManager
+from board_manager.consumers import BoardEditorConsumer
+from board_manager.metrics import open_sockets
+from board_manager.event_buffer import BoardEventBuffer
+from board_manager.text_editing import TextOperation, text_documents
+from board_manager.exceptions import TextRevisionTooOldException
+from board_manager.flow_control import TokenBucket, RateLimiter, OutboundQueue
+from board_manager.traffic_recording import TrafficRecorder, read_recordings
+from board_manager.reclaimer import Reclaimer, mark_user_deleted
+from board_manager.jobs import JobRunner, register_job, enqueue, job_kinds
+from board_manager import catch_websocket_exceptions
+from board_manager.catch_websocket_exceptions import catch_websocket_exception
+from board_manager.protocol import MessageRegistry, Optional, MapOf, ID, NULL, protocol
+from board_manager.exceptions import InvalidMessageException, UnknownMessageTypeException
+from helpers.connection_pool import ConnectionPool, PoolTimeout, pool_connections
+from helpers.context import handler_context
+from helpers.db_router import ReadReplicaRouter
+from helpers.worker_supervisor import WorkerSupervisor
+from board_manager.management.commands.runworkers import shared_state_problems
+from helpers.helper import catch_view_exception
+from helpers.logger import (
+    create_logger, log_file_name, log_pipeline, SamplingFilter, SizeAndTimeRotatingFileHandler, JsonFormatter
+)
+from authentication import exception_handler
 from authentication.models import CustomUser
-from board_manager.models import UserBoards, Board, Access
+from board_manager.models import UserBoards, Board, Access, Node, Column, BoardTemplate, Job
 
 
 class CreateBoardTestCase(TestCase):
@@ -38,7 +82,10 @@ class DeleteBoardTestCase(TestCase):
         board = BoardManager.create_board(name="board_1", board_type="kanban", owner=self.user)
 
         BoardManager.delete_board(board_id=board.pk, user=self.user)
+        self.assertFalse(Board.objects.filter(pk=board.pk).exists())
 
+        # the rows are removed by the reclaimer
+        Reclaimer(chunk_size=100, pause=0).run()
         self.assertFalse(UserBoards.objects.filter(board=board.pk,
                                                    user=self.user.pk,
                                                    access=Access.OWNER).exists())
@@ -99,3 +146,910 @@ class GenerateLinkTestCase(TestCase):
 
         decode_board = Board.decode(encode_board)
         self.assertEqual(board, decode_board)
+
+
+class BoardEventBufferTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.buffer = BoardEventBuffer(size=3, timeout=60)
+
+    def test_sequence_per_board(self):
+        self.assertEqual(self.buffer.append('board_1', {'type': 'node_created'})['seq'], 1)
+        self.assertEqual(self.buffer.append('board_1', {'type': 'node_deleted'})['seq'], 2)
+        self.assertEqual(self.buffer.append('board_2', {'type': 'node_created'})['seq'], 1)
+        self.assertEqual(self.buffer.last_seq('board_1'), 2)
+
+    def test_workers_share_the_sequence(self):
+        other_worker = BoardEventBuffer(size=3, timeout=60)
+        self.buffer.append('board_1', {'type': 'node_created'})
+        self.assertEqual(other_worker.append('board_1', {'type': 'node_deleted'})['seq'], 2)
+
+        self.assertEqual(self.buffer.last_event('board_1'), other_worker.last_event('board_1'))
+        self.assertEqual([event['type'] for event in self.buffer.events_after('board_1', 0)],
+                         ['node_created', 'node_deleted'])
+
+    def test_events_after(self):
+        for i in range(3):
+            self.buffer.append('board_1', {'type': 'node_deleted', 'node_id': i})
+
+        events = self.buffer.events_after('board_1', 1)
+        self.assertEqual([event['node_id'] for event in events], [1, 2])
+        self.assertEqual(self.buffer.events_after('board_1', 3), [])
+
+    def test_rolled_over(self):
+        for i in range(5):
+            self.buffer.append('board_1', {'type': 'node_deleted', 'node_id': i})
+
+        self.assertIsNone(self.buffer.events_after('board_1', 1))
+        self.assertEqual(len(self.buffer.events_after('board_1', 2)), 3)
+        self.assertIsNone(cache.get('board_events:board_1:2'))
+
+    def test_another_epoch(self):
+        self.buffer.append('board_1', {'type': 'node_created'})
+        epoch = self.buffer.last_event('board_1')['epoch']
+
+        self.assertIsNone(self.buffer.events_after('board_1', 0, epoch='old'))
+        self.assertIsNone(self.buffer.events_after('board_1', 5, epoch=epoch))
+        self.assertEqual(len(self.buffer.events_after('board_1', 0, epoch=epoch)), 1)
+
+    def test_forget_inactive_boards(self):
+        self.buffer.append('board_1', {'type': 'node_created'})
+        epoch = self.buffer.last_event('board_1')['epoch']
+        # the timeout of the board has passed
+        cache.delete_many(['board_events:board_1:seq', 'board_events:board_1:epoch'])
+
+        self.assertEqual(self.buffer.append('board_1', {'type': 'node_created'})['seq'], 1)
+        self.assertNotEqual(self.buffer.last_event('board_1')['epoch'], epoch)
+        self.assertIsNone(self.buffer.events_after('board_1', 0, epoch=epoch))
+
+
+class TextEditingTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = CustomUser.objects.create_user(username='Igor Mashtakov',
+                                                   email='masht@mail.ru',
+                                                   password='12345')
+        self.board = BoardManager.create_board(name="board_1", board_type="kanban", owner=self.user)
+        self.node = Node.create(self.board, tag=1, color='#5688C7')
+        self.node.description = 'hello world'
+        self.node.save()
+
+    def tearDown(self) -> None:
+        text_documents.close(self.board.pk)
+        Board.objects.all().delete()
+
+    def test_transform_insert_after_applied(self):
+        operation = TextOperation(6, 0, 'big ').transform(TextOperation(0, 5, 'hi'))
+        self.assertEqual(operation.apply('hi world'), 'hi big world')
+
+    def test_transform_overlapping_deletes(self):
+        operation = TextOperation(2, 4).transform(TextOperation(4, 4, 'xy'))
+        self.assertEqual(operation.to_dict(), {'position': 2, 'delete': 2, 'insert': ''})
+
+    def test_transform_delete_around_applied_insert(self):
+        operation = TextOperation(0, 11).transform(TextOperation(6, 0, 'big '))
+        self.assertEqual(operation.apply('hello big world'), 'big ')
+
+    def test_insert_inside_concurrent_delete_is_kept(self):
+        document = text_documents.get(self.board, self.node.pk, 'description')
+        document.apply(TextOperation(0, 11), 0)
+        document.apply(TextOperation(6, 0, 'big '), 0)
+        self.assertEqual(document.text, 'big ')
+
+    def test_delete_around_concurrent_insert_keeps_it(self):
+        document = text_documents.get(self.board, self.node.pk, 'description')
+        document.apply(TextOperation(6, 0, 'big '), 0)
+        operation, _ = document.apply(TextOperation(0, 11), 0)
+        self.assertEqual(document.text, 'big ')
+        self.assertEqual(operation.to_dict(), {'position': 0, 'delete': 15, 'insert': 'big '})
+
+        # later operations are transformed against both parts of the delete
+        document.apply(TextOperation(11, 0, '!'), 0)
+        self.assertEqual(document.text, 'big !')
+
+    def test_not_numeric_node_id(self):
+        with self.assertRaises(InvalidMessageException):
+            text_documents.get(self.board, 'first', 'description')
+
+    def test_close_node_saves_the_text(self):
+        document = text_documents.get(self.board, self.node.pk, 'description')
+        document.apply(TextOperation(11, 0, '!'), 0)
+
+        text_documents.close_node(self.board.pk, self.node.pk)
+        self.node.refresh_from_db()
+        self.assertEqual(self.node.description, 'hello world!')
+        self.assertIsNot(text_documents.get(self.board, self.node.pk, 'description'), document)
+
+    def test_concurrent_operations(self):
+        document = text_documents.get(self.board, self.node.pk, 'description')
+
+        document.apply(TextOperation(0, 5, 'bye'), 0)
+        operation, revision = document.apply(TextOperation(11, 0, '!'), 0)
+
+        self.assertEqual(document.text, 'bye world!')
+        self.assertEqual(operation.position, 9)
+        self.assertEqual(revision, 2)
+
+    def test_too_old_revision(self):
+        document = text_documents.get(self.board, self.node.pk, 'description')
+        with self.assertRaises(TextRevisionTooOldException):
+            document.apply(TextOperation(0, 0, 'a'), 1)
+
+    def test_snapshot(self):
+        document = text_documents.get(self.board, self.node.pk, 'description')
+        document.apply(TextOperation(11, 0, '!'), 0)
+        self.node.refresh_from_db()
+        self.assertEqual(self.node.description, 'hello world')
+
+        text_documents.flush(self.board.pk)
+        self.node.refresh_from_db()
+        self.assertEqual(self.node.description, 'hello world!')
+
+    def test_flush_due(self):
+        document = text_documents.get(self.board, self.node.pk, 'description')
+        document.apply(TextOperation(11, 0, '!'), 0)
+        self.assertEqual(text_documents.flush_due(), 0)
+
+        # the last edit of a burst is saved without the next one
+        document.saved_at -= settings.COLLABORATIVE_EDITING['SNAPSHOT_SECONDS']
+        self.assertEqual(text_documents.flush_due(), 1)
+        self.node.refresh_from_db()
+        self.assertEqual(self.node.description, 'hello world!')
+
+    def test_edit_of_node_closed_meanwhile_is_saved(self):
+        document = text_documents.get(self.board, self.node.pk, 'description')
+        apply = document.apply
+
+        def apply_after_close(operation, revision):
+            text_documents.close_node(self.board.pk, self.node.pk)
+            return apply(operation, revision)
+
+        with mock.patch.object(document, 'apply', apply_after_close):
+            text_documents.apply(self.board, self.node.pk, 'description', TextOperation(11, 0, '!'), 0)
+        self.node.refresh_from_db()
+        self.assertEqual(self.node.description, 'hello world!')
+
+
+class RefusedConnectionTestCase(TestCase):
+    def test_disconnect_before_joining(self):
+        open_before = open_sockets.value()
+        consumer = BoardEditorConsumer()
+        consumer.channel_name = 'refused'
+        consumer.scope = {'user': None}
+
+        consumer.disconnect(4401)
+        self.assertEqual(open_sockets.value(), open_before)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class RateLimiterTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=2, burst=3, clock=self.clock)
+        self.assertEqual([bucket.consume() for _ in range(4)], [True, True, True, False])
+
+        self.clock.now = 0.5
+        self.assertEqual([bucket.consume() for _ in range(2)], [True, False])
+
+    def test_limits_per_message_type(self):
+        limiter = RateLimiter((100, 100), {'default': (1, 2), 'changing_node': (1, 3)}, clock=self.clock)
+
+        self.assertEqual([limiter.allow('board_info') for _ in range(3)], [True, True, False])
+        self.assertEqual([limiter.allow('changing_node') for _ in range(4)], [True, True, True, False])
+
+    def test_limit_per_connection(self):
+        limiter = RateLimiter((1, 2), {'default': (100, 100)}, clock=self.clock)
+
+        self.assertEqual([limiter.allow(message_type) for message_type in ('a', 'b', 'c')], [True, True, False])
+
+    def test_denied_message_spends_no_tokens(self):
+        limiter = RateLimiter((1, 2), {'default': (100, 100), 'board_info': (1, 1)}, clock=self.clock)
+        self.assertEqual([limiter.allow('board_info') for _ in range(3)], [True, False, False])
+
+        # the per-type bucket denied them, so the connection has its second token left
+        self.assertTrue(limiter.allow('active_users'))
+        self.assertFalse(limiter.allow('active_users'))
+
+        self.clock.now = 1
+        self.assertTrue(limiter.allow('board_info'))
+
+
+def node_changed(node_id, title):
+    return {'type': 'send_content',
+            'content': {'type': 'node_changed', 'node': {'id': node_id, 'title': title}}}
+
+
+class OutboundQueueTestCase(SimpleTestCase):
+    def test_collapse_node_updates(self):
+        queue = OutboundQueue(None, max_size=10)
+        queue.put(node_changed(1, 'a'))
+        queue.put({'type': 'send_content', 'content': {'type': 'node_created'}})
+        queue.put(node_changed(2, 'b'))
+        queue.put(node_changed(1, 'c'))
+
+        self.assertEqual(len(queue), 3)
+        messages = [queue._messages.popleft() for _ in range(3)]
+        self.assertEqual(messages[0]['content']['type'], 'node_created')
+        self.assertEqual(messages[2], node_changed(1, 'c'))
+
+    def test_drop_oldest_messages(self):
+        queue = OutboundQueue(None, max_size=2)
+        for node_id in range(3):
+            queue.put(node_changed(node_id, 'a'))
+
+        self.assertEqual([message['content']['node']['id'] for message in queue._messages], [1, 2])
+
+    async def test_receive_from_channel_layer(self):
+        channel = asyncio.Queue()
+        queue = OutboundQueue(channel.get, max_size=10)
+        for node_id in (1, 2, 1):
+            channel.put_nowait(node_changed(node_id, str(node_id)))
+
+        self.assertEqual(await queue.receive(), node_changed(2, '2'))
+        self.assertEqual(await queue.receive(), node_changed(1, '1'))
+
+
+class BenchWebsocketCommandTestCase(TransactionTestCase):
+    def test_bench_websocket(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            call_command('bench_websocket', boards=1, clients=2, messages=3, rate=50,
+                         mix='changing_node=1,create_node=1', output=output, stdout=io.StringIO())
+
+            with open(output) as f:
+                results = json.load(f)
+
+        self.assertEqual(results['sent'], 6)
+        self.assertEqual(results['missing'], 0)
+        self.assertIsNotNone(results['latency_ms']['all']['p50'])
+        self.assertGreater(results['queries_per_message'], 0)
+        self.assertFalse(Board.objects.exists())
+
+
+class TrafficRecorderTestCase(SimpleTestCase):
+    def test_anonymize(self):
+        recorder = TrafficRecorder(True, '', 'salt')
+        message = recorder.anonymize({'type': 'changing_node',
+                                      'node': {'id': 15, 'title': 'secret', 'status': '3', 'position_x': 10}})
+
+        self.assertEqual(message['node']['id'], recorder.pseudonym('n', 15))
+        self.assertEqual(message['node']['status'], recorder.pseudonym('c', '3'))
+        self.assertEqual(message['node']['title'], 'xxxxxx')
+        self.assertEqual(message['node']['position_x'], 10)
+        self.assertEqual(recorder.anonymize({'node_id': 15})['node_id'], message['node']['id'])
+        self.assertNotEqual(TrafficRecorder(True, '', 'another salt').pseudonym('n', 15), message['node']['id'])
+
+    def test_migrate_columns(self):
+        recorder = TrafficRecorder(True, '', 'salt')
+        message = recorder.anonymize({'type': 'migrate_to_another_board', 'board_id': 'abc', 'columns': {'1': 2}})
+
+        self.assertEqual(message['board_id'], recorder.pseudonym('b', 'abc'))
+        self.assertEqual(message['columns'], {recorder.pseudonym('c', '1'): recorder.pseudonym('c', 2)})
+
+    def test_search_query_is_masked(self):
+        recorder = TrafficRecorder(True, '', 'salt')
+        self.assertEqual(recorder.anonymize({'type': 'search_nodes', 'query': 'salary'})['query'], 'xxxxxx')
+
+    def test_connection_refused_early(self):
+        with tempfile.TemporaryDirectory() as directory:
+            recorder = TrafficRecorder(True, os.path.join(directory, 'traffic.ndjson'), 'salt')
+            consumer = types.SimpleNamespace(channel_name='specific.1', board=None, scope={})
+            recorder.disconnected(consumer)
+            recorder._file.close()
+
+            record, = read_recordings([recorder.path])
+        self.assertEqual(record['event'], 'disconnect')
+        self.assertIsNone(record['board'])
+        self.assertIsNone(record['user'])
+
+
+class ReplayWebsocketTrafficCommandTestCase(TransactionTestCase):
+    def test_replay(self):
+        recorder = TrafficRecorder(True, '', 'salt')
+        connection, board, user = recorder.pseudonym('s', 'a'), recorder.pseudonym('b', 'b'), recorder.pseudonym('u', 1)
+        messages = [{'type': 'start_changing_node', 'node_id': 7},
+                    {'type': 'changing_node', 'node': {'id': 7, 'title': 'title'}},
+                    {'type': 'stop_changing_node', 'node_id': 7}]
+        records = [{'time': 100.0, 'event': 'connect', 'connection': connection, 'board': board, 'user': user}]
+        records += [{'time': 100.0 + i / 10, 'event': 'message', 'connection': connection, 'board': board,
+                     'user': user, 'message': recorder.anonymize(message)} for i, message in enumerate(messages)]
+        records.append({'time': 101.0, 'event': 'disconnect', 'connection': connection, 'board': board, 'user': user})
+
+        with tempfile.TemporaryDirectory() as directory:
+            recording, output = os.path.join(directory, 'recording.ndjson'), os.path.join(directory, 'results.json')
+            with open(recording, 'w') as f:
+                f.writelines(json.dumps(record) + '\n' for record in records)
+            call_command('replay_websocket_traffic', recording, speed=10, output=output, stdout=io.StringIO())
+
+            with open(output) as f:
+                results = json.load(f)
+
+        self.assertEqual(results['connections'], 1)
+        self.assertEqual(results['sent'], 3)
+        self.assertGreater(results['queries_per_message'], 0)
+        self.assertEqual(results['errors'], {})
+        self.assertFalse(Board.objects.exists())
+        self.assertFalse(CustomUser.objects.exists())
+
+
+class LoggerTestCase(SimpleTestCase):
+    def create_logger(self, name):
+        directory = tempfile.TemporaryDirectory()
+        logger = create_logger(name, directory=directory.name)
+
+        def remove():
+            log_pipeline.flush()
+            for handler in logger.handlers[:]:
+                logger.removeHandler(handler)
+            log_pipeline.router.handlers.pop(name).close()
+            directory.cleanup()
+        self.addCleanup(remove)
+        return logger
+
+    @staticmethod
+    def last_record(name) -> dict:
+        log_pipeline.flush()
+        with open(log_pipeline.router.handlers[name].baseFilename, encoding='utf-8') as f:
+            return json.loads(f.readlines()[-1])
+
+    def test_json_records_with_context(self):
+        logger = self.create_logger('test_logger')
+        token = handler_context.set({'handler': 'board_nodes', 'board': 'abc', 'user': 1})
+        try:
+            logger.error("something went wrong")
+        finally:
+            handler_context.reset(token)
+
+        record = self.last_record('test_logger')
+        self.assertEqual(record['message'], "something went wrong")
+        self.assertEqual(record['level'], 'ERROR')
+        self.assertEqual(record['board'], 'abc')
+        self.assertEqual(record['user'], 1)
+
+    def test_errors_of_handlers_with_context(self):
+        logger = self.create_logger('test_handler_errors')
+
+        with mock.patch.object(protocol, 'register'):
+            @catch_websocket_exception({})
+            def failing_handler(consumer, event):
+                raise RuntimeError("handler failed")
+
+        consumer = mock.Mock(board=types.SimpleNamespace(pk='abc'), scope={'user': types.SimpleNamespace(pk=1)})
+        with mock.patch.object(catch_websocket_exceptions, 'boards_logger', logger):
+            failing_handler(consumer, {'type': 'failing_handler'})
+        consumer.close.assert_called_once_with(4500)
+        record = self.last_record('test_handler_errors')
+        self.assertIn("handler failed", record['message'])
+        self.assertEqual((record['handler'], record['board'], record['user']), ('failing_handler', 'abc', 1))
+
+        @catch_view_exception([], logger)
+        def failing_view(request):
+            raise RuntimeError("view failed")
+
+        request = types.SimpleNamespace(data={'board_id': 'abc'}, user=types.SimpleNamespace(pk=1), META={})
+        with self.assertRaises(RuntimeError) as context:
+            failing_view(request)
+        with mock.patch.object(exception_handler, 'out_logger', logger):
+            response = exception_handler.custom_exception_handler(context.exception, {})
+        self.assertEqual(response.status_code, 500)
+        record = self.last_record('test_handler_errors')
+        self.assertIn("view failed", record['message'])
+        self.assertEqual((record['handler'], record['board'], record['user']), ('failing_view', 'abc', 1))
+
+    def test_file_per_worker(self):
+        with mock.patch.dict(os.environ, {'CODE_DOCS_WORKER_NAME': 'host:8000:3'}):
+            self.assertEqual(log_file_name('boards_logger'), 'boards_logger-worker3.log')
+        with mock.patch.dict(os.environ):
+            os.environ.pop('CODE_DOCS_WORKER_NAME', None)
+            self.assertEqual(log_file_name('boards_logger'), 'boards_logger.log')
+
+    def test_sampling(self):
+        clock = FakeClock()
+        sampling = SamplingFilter(burst=2, period=60, clock=clock)
+
+        def record(message, level=logging.ERROR):
+            return logging.LogRecord('test_logger', level, __file__, 1, message, None, None)
+
+        self.assertEqual([sampling.filter(record("error")) for _ in range(4)], [True, True, False, False])
+        self.assertTrue(sampling.filter(record("another error")))
+        self.assertTrue(sampling.filter(record("info", logging.INFO)))
+
+        clock.now = 60
+        allowed = record("error")
+        self.assertTrue(sampling.filter(allowed))
+        self.assertEqual(allowed.suppressed, 2)
+
+    def test_size_rotation(self):
+        with tempfile.TemporaryDirectory() as directory:
+            handler = SizeAndTimeRotatingFileHandler(os.path.join(directory, 'test.log'), 200, 'midnight', 3)
+            handler.setFormatter(JsonFormatter())
+            for i in range(20):
+                handler.handle(logging.LogRecord('test_logger', logging.ERROR, __file__, 1, f"error {i}", None, None))
+            handler.close()
+
+            files = os.listdir(directory)
+            self.assertEqual(len(files), 4)
+            for name in files:
+                self.assertLess(os.path.getsize(os.path.join(directory, name)), 200)
+
+
+class MessageRegistryTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        self.registry = MessageRegistry(1)
+        self.registry.register('changing_node', {'node': {'id': ID,
+                                                          'status': Optional((str, NULL)),
+                                                          'position_x': Optional((int, float))}}, None)
+        self.registry.register('migrate', {'columns': MapOf(str, int)}, None)
+        self.registry.register('migrate_columns', {'columns': MapOf(ID, ID)}, None)
+
+    def assertInvalid(self, content, message):
+        with self.assertRaises(InvalidMessageException) as context:
+            self.registry.get(content)
+        self.assertEqual(context.exception.message, message)
+
+    def test_valid_messages(self):
+        self.assertEqual(self.registry.get({'type': 'changing_node', 'node': {'id': 1, 'title': 'a'}}).type,
+                         'changing_node')
+        self.registry.get({'type': 'changing_node', 'node': {'id': '1', 'status': None, 'position_x': 1.5}})
+        self.registry.get({'type': 'migrate', 'columns': {'1': 2}})
+        # MessagePack keeps the keys numbers
+        self.registry.get({'type': 'migrate_columns', 'columns': {1: '2', '3': 4}})
+
+    def test_invalid_messages(self):
+        self.assertInvalid(['changing_node'], "message must be object with type")
+        self.assertInvalid({'type': ['changing_node']}, "message must be object with type")
+        self.assertInvalid({'type': 'changing_node'}, "node is empty field")
+        self.assertInvalid({'type': 'changing_node', 'node': {}}, "node.id is empty field")
+        self.assertInvalid({'type': 'changing_node', 'node': {'id': 1, 'position_x': True}},
+                           "node.position_x must be int or float")
+        self.assertInvalid({'type': 'changing_node', 'node': {'id': 1, 'status': 3}}, "node.status must be str or null")
+        self.assertInvalid({'type': 'migrate', 'columns': {'1': '2'}}, "columns.1 must be int")
+        for node_id in ('abc', '', '-1', '1.5', '\u0661', True, 1.0):
+            self.assertInvalid({'type': 'changing_node', 'node': {'id': node_id}}, "node.id must be number")
+        self.assertInvalid({'type': 'migrate_columns', 'columns': {'a': 1}}, "columns key must be number")
+
+    def test_unknown_type(self):
+        with self.assertRaises(UnknownMessageTypeException):
+            self.registry.get({'type': 'disconnect'})
+        self.assertEqual(self.registry.known_type({'type': 'disconnect'}), 'unknown')
+
+    def test_describe(self):
+        description = self.registry.describe()
+        self.assertEqual(description['version'], 1)
+        self.assertEqual(description['messages']['changing_node']['fields']['node']['fields']['status'],
+                         {'type': ['str', 'null'], 'optional': True})
+
+
+class DummyConnection:
+    def __init__(self, number):
+        self.number = number
+        self.alive = True
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+        self.created = []
+        self.pool = ConnectionPool(self.create, size=2, timeout=0.1, check=lambda connection: connection.alive,
+                                   check_idle_seconds=30, name='test', clock=self.clock)
+
+    def create(self):
+        self.created.append(DummyConnection(len(self.created)))
+        return self.created[-1]
+
+    def test_reuse(self):
+        connection = self.pool.get()
+        self.pool.put(connection)
+        self.assertIs(self.pool.get(), connection)
+        self.assertEqual(len(self.created), 1)
+        self.assertEqual(pool_connections.value(pool='test', state='in_use'), 1)
+
+    def test_size(self):
+        self.pool.clock = time.monotonic
+        connections = [self.pool.get(), self.pool.get()]
+        with self.assertRaises(PoolTimeout):
+            self.pool.get()
+
+        # a waiting thread gets the returned connection
+        timer = threading.Timer(0.02, self.pool.put, [connections[0]])
+        timer.start()
+        self.pool.timeout = 5
+        self.assertIs(self.pool.get(), connections[0])
+        timer.join()
+
+    def test_health_check(self):
+        connection = self.pool.get()
+        self.pool.put(connection)
+        connection.alive = False
+
+        self.assertIs(self.pool.get(), connection)  # recently returned connections are not checked
+        self.pool.put(connection)
+        self.clock.now = 60
+
+        another_connection = self.pool.get()
+        self.assertIsNot(another_connection, connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(len(self.pool), 1)
+
+    def test_close_idle(self):
+        connection = self.pool.get()
+        self.pool.put(connection)
+        self.pool.close_idle()
+
+        self.assertTrue(connection.closed)
+        self.assertEqual(len(self.pool), 0)
+
+    def test_prefill(self):
+        self.pool.prefill(5)
+        self.assertEqual(len(self.created), 2)  # no more than the size
+        self.assertEqual(pool_connections.value(pool='test', state='idle'), 2)
+        self.assertIn(self.pool.get(), self.created)
+        self.assertEqual(len(self.created), 2)
+
+
+@override_settings(READ_REPLICAS={'DATABASES': ['replica'], 'HANDLERS': ['board_nodes', 'my_boards'], 'PIN_SECONDS': 5})
+class ReadReplicaRouterTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.clock = FakeClock()
+        self.router = ReadReplicaRouter()
+        self.router.pins.clock = self.clock
+
+    def route(self, handler, board=None, user=1, write=False):
+        token = handler_context.set({'kind': 'websocket', 'handler': handler, 'board': board, 'user': user})
+        try:
+            if write:
+                return self.router.db_for_write(Node)
+            return self.router.db_for_read(Node)
+        finally:
+            handler_context.reset(token)
+
+    def test_reads_of_read_handlers(self):
+        self.assertEqual(self.route('board_nodes', 'board_1'), 'replica')
+        self.assertEqual(self.route('my_boards'), 'replica')
+        self.assertEqual(self.route('changing_node', 'board_1'), 'default')
+        self.assertEqual(self.router.db_for_read(Node), 'default')  # outside handlers
+
+    def test_board_is_pinned_after_write(self):
+        self.assertEqual(self.route('changing_node', 'board_1', user=2, write=True), 'default')
+
+        self.assertEqual(self.route('board_nodes', 'board_1'), 'default')
+        self.assertEqual(self.route('board_nodes', 'board_2'), 'replica')
+
+        self.clock.now = 5
+        self.assertEqual(self.route('board_nodes', 'board_1'), 'replica')
+
+    def test_user_is_pinned_after_write(self):
+        self.route('create_board', user=1, write=True)
+
+        self.assertEqual(self.route('my_boards', user=1), 'default')
+        self.assertEqual(self.route('my_boards', user=2), 'replica')
+
+    @override_settings(READ_REPLICAS={'DATABASES': [], 'HANDLERS': ['board_nodes'], 'PIN_SECONDS': 5})
+    def test_without_replicas(self):
+        self.assertEqual(self.route('board_nodes', 'board_1'), 'default')
+
+
+@override_settings(READ_REPLICAS={'DATABASES': ['replica'], 'HANDLERS': ['board_info'], 'PIN_SECONDS': 5})
+class ReadReplicaDatabaseTestCase(TransactionTestCase):
+    """
+    A second SQLite database plays a replica lagging behind the primary
+    """
+
+    def setUp(self) -> None:
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connections.databases['replica'] = {'ENGINE': 'django.db.backends.sqlite3',
+                                            'NAME': os.path.join(directory.name, 'replica.sqlite3')}
+        self.addCleanup(self.remove_replica)
+        with connections['replica'].schema_editor() as editor:
+            editor.create_model(Board)
+
+        self.user = CustomUser.objects.create_user(username='Igor Mashtakov',
+                                                   email='masht@mail.ru',
+                                                   password='12345')
+        self.board = BoardManager.create_board(name="board_1", board_type="kanban", owner=self.user)
+        Board.all_objects.using('replica').create(id=self.board.pk, name="old name", board_type="kanban",
+                                                  prefix=self.board.prefix)
+
+    @staticmethod
+    def remove_replica():
+        connections['replica'].close()
+        del connections['replica']
+        del connections.databases['replica']
+
+    def board_name(self, router=None):
+        token = handler_context.set({'kind': 'websocket', 'handler': 'board_info',
+                                     'board': self.board.pk, 'user': self.user.pk})
+        try:
+            if router is not None:
+                return router.db_for_read(Board)
+            return Board.objects.get(pk=self.board.pk).name
+        finally:
+            handler_context.reset(token)
+
+    def test_reads_after_write_go_to_primary(self):
+        self.assertEqual(self.board_name(), "old name")
+
+        token = handler_context.set({'kind': 'websocket', 'handler': 'change_board_config',
+                                     'board': self.board.pk, 'user': self.user.pk})
+        try:
+            Board.objects.filter(pk=self.board.pk).update(name="new name")
+        finally:
+            handler_context.reset(token)
+
+        self.assertEqual(self.board_name(), "new name")
+        # the pin is seen by the router of another worker sharing the cache
+        self.assertEqual(self.board_name(ReadReplicaRouter()), 'default')
+
+
+class ReclaimerTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = CustomUser.objects.create_user(username='Igor Mashtakov',
+                                                   email='masht@mail.ru',
+                                                   password='12345')
+        self.editor = CustomUser.objects.create_user(username='editor',
+                                                     email='editor@mail.ru',
+                                                     password='12345')
+        self.board = BoardManager.create_board(name="board_1", board_type="kanban", owner=self.user)
+        UserBoards.objects.create(board=self.board, user=self.editor, access=Access.EDITOR)
+        Node.objects.bulk_create([Node(board=self.board, tag=i, color='red') for i in range(250)])
+        self.reclaimer = Reclaimer(chunk_size=100, pause=0)
+
+    def test_board_is_removed_in_chunks(self):
+        BoardManager.delete_board(board_id=self.board.pk, user=self.user)
+        self.assertEqual(self.reclaimer.pending(), [('board', self.board.pk)])
+
+        progress = []
+        self.reclaimer.run(lambda kind, pk, removed, done: progress.append((removed, done)))
+
+        # 3 chunks of nodes, the columns, the memberships and the board
+        self.assertEqual(progress, [(100, False), (200, False), (250, False), (253, False), (255, False),
+                                    (256, False), (256, True)])
+        self.assertFalse(Board.all_objects.filter(pk=self.board.pk).exists())
+        self.assertFalse(Node.objects.exists())
+        self.assertFalse(Column.objects.exists())
+        self.assertEqual(self.reclaimer.pending(), [])
+
+    def test_user_is_removed_with_owned_boards(self):
+        editor_board = BoardManager.create_board(name="board_2", board_type="kanban", owner=self.editor)
+        UserBoards.objects.create(board=editor_board, user=self.user, access=Access.VIEWER)
+        BoardManager.save_template(self.board.pk, self.user)
+
+        mark_user_deleted(self.user)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertFalse(Board.objects.filter(pk=self.board.pk).exists())
+        self.assertEqual(BoardManager.get_user_boards(self.editor).get().board, editor_board)
+
+        self.reclaimer.run()
+        self.assertFalse(CustomUser.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(Board.all_objects.filter(pk=self.board.pk).exists())
+        self.assertFalse(BoardTemplate.objects.exists())
+        self.assertEqual(list(editor_board.user_boards.values_list('user_id', flat=True)), [self.editor.pk])
+
+    def test_command_reports_progress(self):
+        BoardManager.delete_board(board_id=self.board.pk, user=self.user)
+        out = io.StringIO()
+        call_command('reclaim_deleted', '--chunk-size', '200', stdout=out)
+        self.assertIn("1 boards and users to reclaim", out.getvalue())
+        self.assertIn(f"board {self.board.pk}: 256 rows removed, done", out.getvalue())
+
+
+class JobRunnerTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = CustomUser.objects.create_user(username='Igor Mashtakov',
+                                                   email='masht@mail.ru',
+                                                   password='12345')
+        self.board = BoardManager.create_board(name="board_1", board_type="kanban", owner=self.user)
+        self.clock = FakeClock()
+        self.runner = JobRunner(threads=1, poll_seconds=0.1, backoff_seconds=60, lease_seconds=60,
+                                keep_seconds=3600, cleanup_seconds=60, clock=self.clock)
+        self.calls = []
+
+        @register_job('test_flaky', max_attempts=2)
+        def flaky(job, fail_times):
+            self.calls.append(job.attempts)
+            if len(self.calls) <= fail_times:
+                raise ValueError("try again")
+            return {'calls': len(self.calls)}
+
+    def tearDown(self) -> None:
+        job_kinds.pop('test_flaky')
+
+    def run_again_now(self, job):
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+
+    def test_retry_with_backoff(self):
+        job = enqueue('test_flaky', {'fail_times': 1})
+        self.assertEqual(self.runner.run_pending(), 1)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Statuses.QUEUED)
+        self.assertEqual(job.error, "try again")
+        self.assertGreater(job.run_after, timezone.now() + datetime.timedelta(seconds=50))
+        self.assertEqual(self.runner.run_pending(), 0)
+
+        self.run_again_now(job)
+        self.assertEqual(self.runner.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Statuses.SUCCEEDED)
+        self.assertEqual(job.result, {'calls': 2})
+        self.assertEqual(self.calls, [1, 2])
+
+    def test_failed_after_max_attempts(self):
+        job = enqueue('test_flaky', {'fail_times': 5})
+        self.runner.run_pending()
+        self.run_again_now(job)
+        self.runner.run_pending()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Statuses.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    def test_job_of_dead_worker_is_taken_again(self):
+        job = enqueue('test_flaky', {'fail_times': 0})
+        Job.objects.filter(pk=job.pk).update(status=Job.Statuses.RUNNING, attempts=1,
+                                             locked_until=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(self.runner.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Statuses.SUCCEEDED)
+
+    def test_job_killing_its_workers_fails(self):
+        job = enqueue('test_flaky', {'fail_times': 0})
+        Job.objects.filter(pk=job.pk).update(status=Job.Statuses.RUNNING, attempts=2,
+                                             locked_until=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(self.runner.run_pending(), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Statuses.FAILED)
+        self.assertIsNone(job.locked_until)
+        self.assertIn("lease of the job expired", job.error)
+        self.assertEqual(self.calls, [])
+
+    def test_finished_jobs_are_deleted(self):
+        jobs = [enqueue('test_flaky', {'fail_times': 0}) for _ in range(3)]
+        self.runner.run_pending()
+        queued = enqueue('test_flaky', {'fail_times': 0})
+        Job.objects.filter(pk__in=[jobs[0].pk, jobs[1].pk, queued.pk]).update(
+            updated=timezone.now() - datetime.timedelta(hours=2))
+
+        self.runner._cleanup_if_due()
+        self.assertEqual(set(Job.objects.values_list('pk', flat=True)), {jobs[2].pk, queued.pk})
+
+        # not again before cleanup_seconds
+        Job.objects.filter(pk=jobs[2].pk).update(updated=timezone.now() - datetime.timedelta(hours=2))
+        self.runner._cleanup_if_due()
+        self.assertTrue(Job.objects.filter(pk=jobs[2].pk).exists())
+        self.clock.now = 60
+        self.runner._cleanup_if_due()
+        self.assertFalse(Job.objects.filter(pk=jobs[2].pk).exists())
+
+    def test_status_is_pushed_to_board_group(self):
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(f"board_{self.board.pk}", channel)
+
+        enqueue('test_flaky', {'fail_times': 0}, board_id=self.board.pk)
+        self.runner.run_pending()
+
+        statuses = [async_to_sync(layer.receive)(channel)['content']['job']['status'] for _ in range(2)]
+        self.assertEqual(statuses, [Job.Statuses.RUNNING, Job.Statuses.SUCCEEDED])
+
+    def test_migrate_to_another_board(self):
+        to_board = BoardManager.create_board(name="board_2", board_type="kanban", owner=self.user)
+        column = Column.objects.filter(board=self.board, position=1).get()
+        to_column = Column.objects.filter(board=to_board, position=2).get()
+        Node.create(self.board, tag=1, color='red', status=str(column.pk))
+        Node.create(self.board, tag=2, color='red')
+        Node.create(self.board, tag=3, color='red', status='not mapped')
+
+        job = enqueue('migrate_to_another_board', {'board_id': self.board.pk, 'to_board_id': to_board.pk,
+                                                   'columns': {str(column.pk): to_column.pk}})
+        self.runner.run_pending()
+
+        job.refresh_from_db()
+        self.assertEqual(job.result, {'nodes': 3})
+        self.assertEqual(dict(to_board.nodes.values_list('tag', 'status')),
+                         {1: str(to_column.pk), 2: None, 3: 'not mapped'})
+
+    def test_board_is_reclaimed_by_job(self):
+        BoardManager.delete_board(board_id=self.board.pk, user=self.user)
+        self.runner.run_pending()
+
+        job = Job.objects.get(kind='reclaim')
+        self.assertEqual(job.status, Job.Statuses.SUCCEEDED)
+        self.assertEqual(job.board_id, self.board.pk)
+        self.assertEqual(job.progress, {'removed': job.result['removed']})
+        self.assertFalse(Board.all_objects.filter(pk=self.board.pk).exists())
+
+
+class WorkerSupervisorTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+
+    def make_supervisor(self, code):
+        return WorkerSupervisor(lambda index: [sys.executable, '-c', code], 1, backoff_seconds=1,
+                                stable_seconds=30, graceful_seconds=5, clock=self.clock)
+
+    def test_crashed_worker_is_restarted_with_backoff(self):
+        supervisor = self.make_supervisor('import sys; sys.exit(1)')
+        slot = supervisor.slots[0]
+        supervisor.check()
+        slot.process.wait()
+
+        supervisor.check()
+        self.assertIsNone(slot.process)
+        self.assertEqual(slot.last_exit_code, 1)
+        self.assertEqual(slot.restart_at, 1)
+
+        self.clock.now = 1
+        supervisor.check()
+        self.assertEqual(slot.restarts, 1)
+        slot.process.wait()
+        supervisor.check()
+        self.assertEqual(slot.restart_at, 3)
+
+        # a worker which ran long enough is restarted at once
+        self.clock.now = 40
+        supervisor.check()
+        slot.process.wait()
+        self.clock.now = 80
+        supervisor.check()
+        self.assertEqual(slot.crashes, 0)
+        self.assertEqual(slot.restarts, 3)
+        slot.process.wait()
+        self.assertEqual(supervisor.stats()[0]['restarts'], 3)
+
+    def test_stop(self):
+        supervisor = self.make_supervisor('import time; time.sleep(60)')
+        supervisor.check()
+        process = supervisor.slots[0].process
+
+        supervisor.stop()
+        self.assertEqual(process.returncode, -signal.SIGTERM)
+        supervisor.check()
+        self.assertIsNone(supervisor.slots[0].process)
+
+
+REDIS_CHANNEL_LAYERS = {'default': {'BACKEND': 'board_manager.channel_layers.LocalFirstChannelLayer',
+                                    'CONFIG': {'shards': [{'BACKEND': 'channels_redis.core.RedisChannelLayer'}]}}}
+REDIS_CACHES = {'default': {'BACKEND': 'django_redis.cache.RedisCache'}}
+
+
+class RunWorkersCommandTestCase(SimpleTestCase):
+    def test_several_workers_need_shared_state(self):
+        with self.assertRaises(CommandError):
+            call_command('runworkers', workers=2, stdout=io.StringIO())
+
+    @override_settings(CHANNEL_LAYERS=REDIS_CHANNEL_LAYERS, CACHES=REDIS_CACHES,
+                       BOARD_AFFINITY={**settings.BOARD_AFFINITY, 'ENABLED': True})
+    def test_shared_state_problems(self):
+        self.assertEqual(shared_state_problems(8100), [])
+
+        with override_settings(BOARD_AFFINITY={**settings.BOARD_AFFINITY, 'ENABLED': False}):
+            self.assertEqual(len(shared_state_problems(8100)), 1)
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual(len(shared_state_problems(8100)), 1)
+        with override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}):
+            self.assertEqual(len(shared_state_problems(8100)), 1)
+
+    @override_settings(CHANNEL_LAYERS=REDIS_CHANNEL_LAYERS, CACHES=REDIS_CACHES,
+                       BOARD_AFFINITY={**settings.BOARD_AFFINITY, 'ENABLED': True})
+    def test_several_workers_need_addresses(self):
+        # every worker would register the same empty address
+        self.assertEqual(len(shared_state_problems(None)), 1)
+        with self.assertRaises(CommandError):
+            call_command('runworkers', workers=2, stdout=io.StringIO())
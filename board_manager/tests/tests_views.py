@@ -1,13 +1,22 @@
 import json
-
-from django.test import TestCase
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.test import APIClient
 
 from authentication.models import CustomUser
-from board_manager.models import UserBoards, Board, Access
+from board_manager.board_manager_backend import BoardManager
+from board_manager.jobs import job_runner
+from board_manager.models import UserBoards, Board, Access, Column, Node, Job
 from board_manager.exceptions import BoardDoesNotExistException
 from board_manager.serializers import BoardWithoutContentSerializer
+from board_manager.workers import WorkerRegistry, worker_registry
 
 
 class CreateBoardTestCase(TestCase):
@@ -73,6 +82,8 @@ class CreateBoardTestCase(TestCase):
 
 class MyBoardsTestCase(TestCase):
     def setUp(self) -> None:
+        # versions are not bumped in the transactions of TestCase
+        cache.clear()
         self.client = APIClient()
 
         self.user = CustomUser.objects.create_user(username='Igor Mashtakov',
@@ -218,3 +229,294 @@ class LeaveBoardTestCase(TestCase):
 
         response = self.client.post('/board/leave_board/', {'board_id': self.board.pk})
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+
+class CachedResponsesTestCase(TransactionTestCase):
+    # versions are bumped on commit
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(username='Igor Mashtakov',
+                                                   email='111@mail.ru',
+                                                   password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.client.post('/board/create_board/', {'name': "board_1", 'board_type': "kanban"})
+        self.board = Board.objects.last()
+
+    def test_my_boards_not_modified(self):
+        response = self.client.get('/board/my')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('ETag', response)
+
+        response = self.client.get('/board/my', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+    def test_my_boards_changed(self):
+        etag = self.client.get('/board/my')['ETag']
+        self.board.name = "renamed"
+        self.board.save()
+
+        response = self.client.get('/board/my', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(json.loads(response.content)[0]['board']['name'], "renamed")
+
+        etag = response['ETag']
+        self.client.post('/board/create_board/', {'name': "board_2", 'board_type': "kanban"})
+        response = self.client.get('/board/my', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(json.loads(response.content)), 2)
+
+    def test_my_boards_of_other_user_not_changed(self):
+        other = CustomUser.objects.create_user(username='other', email='222@mail.ru', password='12345')
+        client = APIClient()
+        client.force_authenticate(user=other)
+        etag = self.client.get('/board/my')['ETag']
+
+        client.post('/board/create_board/', {'name': "board_2", 'board_type': "kanban"})
+        response = self.client.get('/board/my', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_my_boards_owner_changed(self):
+        other = CustomUser.objects.create_user(username='other', email='222@mail.ru', password='12345')
+        UserBoards.objects.create(user=other, board=self.board, access=Access.EDITOR)
+        client = APIClient()
+        client.force_authenticate(user=other)
+        etag = client.get('/board/my')['ETag']
+
+        self.user.is_active = True
+        self.user.save(update_fields=['is_active'])
+        response = client.get('/board/my', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.user.username = 'renamed'
+        self.user.save()
+        response = client.get('/board/my', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content)[0]['owner']['username'], 'renamed')
+
+    @override_settings(RESPONSE_CACHE={'VERSION_TIMEOUT': 1})
+    def test_versions_expire(self):
+        # a process-local cache misses the changes of other workers, its versions are forgotten soon
+        cache.clear()
+        etag = self.client.get('/board/my')['ETag']
+        time.sleep(1.1)
+
+        response = self.client.get('/board/my', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_board_columns_changed(self):
+        response = self.client.post('/board/get_board_columns/', {'board_id': self.board.id})
+        self.assertEqual(len(json.loads(response.content)), 3)
+        etag = response['ETag']
+
+        response = self.client.post('/board/get_board_columns/', {'board_id': self.board.id},
+                                    HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Column.objects.create(board=self.board, name='LATER', position=3)
+        response = self.client.post('/board/get_board_columns/', {'board_id': self.board.id},
+                                    HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(json.loads(response.content)), 4)
+
+    def test_board_columns_only_for_participants(self):
+        self.client.post('/board/get_board_columns/', {'board_id': self.board.id})
+
+        other = CustomUser.objects.create_user(username='other', email='222@mail.ru', password='12345')
+        client = APIClient()
+        client.force_authenticate(user=other)
+        response = client.post('/board/get_board_columns/', {'board_id': self.board.id})
+        self.assertEqual(response.status_code, status.HTTP_406_NOT_ACCEPTABLE)
+
+        Board.all_objects.filter(pk=self.board.pk).update(deleted=True)
+        response = self.client.post('/board/get_board_columns/', {'board_id': self.board.id})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CloneBoardTestCase(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(username='Igor Mashtakov',
+                                                   email='111@mail.ru',
+                                                   password='12345')
+        self.editor = CustomUser.objects.create_user(username='editor',
+                                                     email='222@mail.ru',
+                                                     password='12345')
+        self.client.force_authenticate(user=self.user)
+
+        self.board = BoardManager.create_board("board_1", Board.BoardTypes.KANBAN, self.user)
+        UserBoards.objects.create(board=self.board, user=self.editor, access=Access.EDITOR)
+        self.columns = list(Column.objects.filter(board=self.board).order_by('position'))
+        Node.objects.bulk_create([Node(board=self.board, tag=i, color='red', title=f"node {i}",
+                                       status=str(self.columns[i % 3].id) if i % 4 else None)
+                                  for i in range(1500)])
+
+    def test_clone_board(self):
+        response = self.client.post('/board/clone_board/', {'board_id': self.board.id, 'name': "copy"})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job_id = json.loads(response.content)['id']
+        # the members of the source board are not told about the board of the requester
+        self.assertIsNone(Job.objects.get(pk=job_id).board_id)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(job_runner.run_pending(), 1)
+        # the nodes are inserted in batches, limited by the query parameters on SQLite
+        node_inserts = [query for query in queries.captured_queries
+                        if query['sql'].startswith('INSERT INTO "board_manager_node"')]
+        self.assertLess(len(node_inserts), 1500 / 50)
+        self.assertLess(len(queries) - len(node_inserts), 20)
+
+        response = self.client.post('/board/job_status/', {'job_id': job_id})
+        job = json.loads(response.content)
+        self.assertEqual(job['status'], Job.Statuses.SUCCEEDED)
+        board = Board.objects.get(id=job['result']['board_id'])
+        self.assertEqual(board.name, "copy")
+        self.assertEqual(dict(board.user_boards.values_list('user_id', 'access')),
+                         {self.user.id: Access.OWNER, self.editor.id: Access.EDITOR})
+
+        columns = {str(column.id): column.position for column in Column.objects.filter(board=board)}
+        self.assertEqual(sorted(columns.values()), [0, 1, 2])
+        nodes = Node.objects.filter(board=board).order_by('tag')
+        self.assertEqual(len(nodes), 1500)
+        for node in nodes:
+            self.assertEqual(node.title, f"node {node.tag}")
+            if node.tag % 4:
+                self.assertEqual(columns[node.status], node.tag % 3)
+            else:
+                self.assertIsNone(node.status)
+
+    def test_clone_board_without_access(self):
+        other = CustomUser.objects.create_user(username='other', email='333@mail.ru', password='12345')
+        self.client.force_authenticate(user=other)
+        response = self.client.post('/board/clone_board/', {'board_id': self.board.id})
+        self.assertEqual(response.status_code, status.HTTP_406_NOT_ACCEPTABLE)
+
+    def test_board_from_template(self):
+        response = self.client.post('/board/save_template/', {'board_id': self.board.id, 'name': "sprint"})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        template_id = json.loads(response.content)['id']
+
+        response = self.client.get('/board/templates/')
+        self.assertEqual([template['name'] for template in json.loads(response.content)], ["sprint"])
+
+        response = self.client.post('/board/create_board_from_template/', {'template_id': template_id})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        board = Board.objects.get(id=json.loads(response.content)['id'])
+        self.assertEqual(board.name, "sprint")
+        self.assertEqual(list(board.user_boards.values_list('user_id', flat=True)), [self.user.id])
+        columns = {str(column.id): column.position for column in Column.objects.filter(board=board)}
+        node = Node.objects.get(board=board, tag=5)
+        self.assertEqual(columns[node.status], 2)
+
+    def test_template_of_other_user(self):
+        template = BoardManager.save_template(self.board.id, self.user)
+        self.client.force_authenticate(user=self.editor)
+        response = self.client.post('/board/create_board_from_template/', {'template_id': template.id})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class SearchNodesTestCase(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(username='Igor Mashtakov',
+                                                   email='111@mail.ru',
+                                                   password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.board = BoardManager.create_board("board_1", Board.BoardTypes.KANBAN, self.user)
+        self.other_board = BoardManager.create_board("board_2", Board.BoardTypes.KANBAN, self.user)
+
+        self.in_title = Node.objects.create(board=self.board, tag=1, color='red', title="Deploy <server>")
+        self.in_description = Node.objects.create(board=self.board, tag=2, color='red', title="Release",
+                                                  description="Ask the admins to deploy it on friday")
+        Node.objects.create(board=self.other_board, tag=1, color='red', title="Deployment checklist")
+
+        stranger = CustomUser.objects.create_user(username='stranger', email='222@mail.ru', password='12345')
+        foreign_board = BoardManager.create_board("board_3", Board.BoardTypes.KANBAN, stranger)
+        Node.objects.create(board=foreign_board, tag=1, color='red', title="Deploy secrets")
+
+    def search(self, **params):
+        response = self.client.post('/board/search_nodes/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.content)
+
+    def test_ranked_in_board(self):
+        results = self.search(query="deploy", board_id=self.board.id)
+        self.assertEqual(results['total'], 2)
+        self.assertEqual([result['node_id'] for result in results['results']],
+                         [self.in_title.id, self.in_description.id])
+        self.assertEqual(results['results'][0]['title'], "<mark>Deploy</mark> &lt;server&gt;")
+        self.assertIn("<mark>deploy</mark>", results['results'][1]['snippet'])
+
+    def test_all_boards_of_user(self):
+        results = self.search(query="depl")
+        self.assertEqual(results['total'], 3)
+        self.assertEqual({result['board_id'] for result in results['results']}, {self.board.id, self.other_board.id})
+
+    def test_pages(self):
+        results = self.search(query="deploy", page=2, page_size=2)
+        self.assertEqual(results['total'], 3)
+        self.assertEqual(len(results['results']), 1)
+
+    def test_index_follows_updates(self):
+        Node.objects.filter(pk=self.in_title.pk).update(title="Rollback")
+        self.in_description.delete()
+        results = self.search(query="rollback deploy")
+        self.assertEqual(results['total'], 0)
+        results = self.search(query="rollback")
+        self.assertEqual([result['node_id'] for result in results['results']], [self.in_title.id])
+
+    def test_empty_query(self):
+        response = self.client.post('/board/search_nodes/', {'query': " ?! "})
+        self.assertContains(response, "The search query has no words", status_code=status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_page(self):
+        for params in ({'page': "second"}, {'page_size': "all"}):
+            response = self.client.post('/board/search_nodes/', {'query': "deploy", **params})
+            self.assertContains(response, "page and page_size must be numbers",
+                                status_code=status.HTTP_400_BAD_REQUEST)
+
+    def test_board_without_access(self):
+        response = self.client.post('/board/search_nodes/', {'query': "deploy",
+                                                             'board_id': Board.objects.get(name="board_3").id})
+        self.assertEqual(response.status_code, status.HTTP_406_NOT_ACCEPTABLE)
+
+
+@override_settings(BOARD_AFFINITY={**settings.BOARD_AFFINITY, 'ROUTE_TOKEN': 'route-secret'})
+class RouteBoardTestCase(TestCase):
+    def route(self, **headers):
+        return self.client.get('/board/route/42/', **{'HTTP_X_ROUTE_TOKEN': 'route-secret', **headers})
+
+    def test_owner_address(self):
+        registry = WorkerRegistry('worker_0', '10.0.0.1:8000', 5, 15, 100)
+        registry.heartbeat()
+        WorkerRegistry('worker_1', '10.0.0.2:8000', 5, 15, 100).heartbeat()
+        registry.refresh()
+
+        with mock.patch.multiple(worker_registry, ring=registry.ring, addresses=registry.addresses):
+            response = self.route()
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(response['X-Board-Worker'], registry.owner_address('board_42'))
+
+    def test_only_load_balancer(self):
+        # anonymous requests without the token
+        self.assertEqual(self.client.get('/board/route/42/').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.route(HTTP_X_ROUTE_TOKEN='guess').status_code, status.HTTP_401_UNAUTHORIZED)
+        with override_settings(BOARD_AFFINITY={**settings.BOARD_AFFINITY, 'ROUTE_TOKEN': ''}):
+            self.assertEqual(self.route(HTTP_X_ROUTE_TOKEN='').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_no_live_workers(self):
+        response = self.route()
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_owner_without_address(self):
+        registry = WorkerRegistry('worker_0', '', 5, 15, 100)
+        registry.heartbeat()
+
+        with mock.patch.multiple(worker_registry, ring=registry.ring, addresses=registry.addresses):
+            response = self.route()
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertNotIn('X-Board-Worker', response)
@@ -1,15 +1,22 @@
 from unittest.mock import patch
 import json
+import zlib
+
+import msgpack
 
 from channels.testing import WebsocketCommunicator
-from django.test import TransactionTestCase
+from django.test import TransactionTestCase, override_settings
 from channels_presence.models import Presence
 from asgiref.sync import sync_to_async
 
 from CodeDocs_backend.asgi import application
 from authentication.models import CustomUser
-from board_manager.models import Board, UserBoards, Access
+from board_manager.models import Board, UserBoards, Access, Node
 from board_manager.board_manager_backend import BoardManager
+from board_manager.event_buffer import board_events
+from board_manager.codecs import COMPRESSED_FRAME_MARKER
+from board_manager.metrics import open_sockets
+from helpers.instrumentation import handler_duration, handler_queries, payload_size
 from authentication.serializers import UserSerializer
 from board_manager.serializers import (
     BoardSerializer, UserWithAccessSerializer
@@ -376,6 +383,30 @@ class BoardEditorConsumerTestCase(TransactionTestCase):
                               'board': BoardSerializer(self.board).data}
         self.assertDictEqual(board_answer, right_board_answer)
 
+    async def test_change_board_config__only_config_fields(self):
+        communicator = WebsocketCommunicator(application.application_mapping["websocket"],
+                                             f"/boards/{self.board.pk}/1278/")
+        await communicator.connect()
+
+        for _ in range(4):
+            _ = await communicator.receive_json_from()  # channel_name, current_user, board_info, last_event
+        _ = await communicator.receive_json_from()  # new_user
+
+        await communicator.send_json_to({'type': 'change_board_config',
+                                         'config': {'name': 'another_board_1',
+                                                    'id': 'another_id',
+                                                    'deleted': True,
+                                                    'link_access': Access.OWNER}})
+        self.board.name = 'another_board_1'
+
+        board_answer = await communicator.receive_json_from()
+        self.assertEqual(board_answer['board'], BoardSerializer(self.board).data)
+        board = await sync_to_async(Board.all_objects.get)(pk=self.board.pk)
+        self.assertEqual((board.name, board.deleted, board.link_access),
+                         ('another_board_1', False, self.board.link_access))
+        self.assertFalse(await sync_to_async(Board.all_objects.filter(pk='another_id').exists)())
+        await communicator.disconnect()
+
     async def test_change_board_config__change_to_the_same_config(self):
         communicator = WebsocketCommunicator(application.application_mapping["websocket"],
                                              f"/boards/{self.board.pk}/1278/")
@@ -538,3 +569,247 @@ class BoardEditorConsumerTestCase(TransactionTestCase):
         right_change_access_answer = {'type': 'change_user_access',
                                       'user': await sync_to_async(another_user_with_access)()}
         self.assertDictEqual(change_access_answer, right_change_access_answer)
+
+    async def test_missed_events(self):
+        communicator = WebsocketCommunicator(application.application_mapping["websocket"],
+                                             f"/boards/{self.board.pk}/1278/")
+        await communicator.connect()
+
+        for _ in range(4):
+            _ = await communicator.receive_json_from()  # channel_name, current_user, board_info, last_event
+        _ = await communicator.receive_json_from()  # new_user
+
+        await communicator.send_json_to({'type': 'create_node', 'status': None})
+        node_created = await communicator.receive_json_from()
+
+        await communicator.send_json_to({'type': 'missed_events',
+                                         'seq': node_created['seq'] - 1,
+                                         'epoch': board_events.last_event(self.board.pk)['epoch']})
+        answer = await communicator.receive_json_from()
+        self.assertFalse(answer['reload'])
+        self.assertEqual(answer['events'], [node_created])
+
+        await communicator.send_json_to({'type': 'missed_events',
+                                         'seq': node_created['seq'],
+                                         'epoch': 'another epoch'})
+        answer = await communicator.receive_json_from()
+        self.assertTrue(answer['reload'])
+
+    async def test_search_nodes(self):
+        await sync_to_async(Node.objects.create)(board=self.board, tag=1, color='#5688C7', title="Fix login")
+        communicator = WebsocketCommunicator(application.application_mapping["websocket"],
+                                             f"/boards/{self.board.pk}/1278/")
+        await communicator.connect()
+        for _ in range(5):
+            _ = await communicator.receive_json_from()  # channel_name, current_user, board_info, last_event, new_user
+
+        await communicator.send_json_to({'type': 'search_nodes', 'query': "log"})
+        answer = await communicator.receive_json_from()
+        self.assertEqual(answer['type'], 'search_results')
+        self.assertEqual(answer['total'], 1)
+        self.assertEqual(answer['results'][0]['title'], "Fix <mark>login</mark>")
+
+        await communicator.send_json_to({'type': 'search_nodes', 'query': ""})
+        answer = await communicator.receive_json_from()
+        self.assertEqual(answer['error_code'], 4400)
+        await communicator.disconnect()
+
+    async def test_edit_node_text__two_users(self):
+        node = await sync_to_async(Node.create)(self.board, tag=1, color='#5688C7')
+
+        communicators = []
+        for _ in range(2):
+            communicator = WebsocketCommunicator(application.application_mapping["websocket"],
+                                                 f"/boards/{self.board.pk}/1278/")
+            await communicator.connect()
+            for _ in range(4):
+                _ = await communicator.receive_json_from()  # channel_name, current_user, board_info, last_event
+            communicators.append(communicator)
+        _ = await communicators[0].receive_json_from()  # new_user
+
+        # both users type in the empty description at the same time
+        for communicator, text in zip(communicators, ('hello', 'world')):
+            await communicator.send_json_to({'type': 'edit_node_text',
+                                             'node_id': node.pk,
+                                             'field': 'description',
+                                             'revision': 0,
+                                             'operation': {'position': 0, 'insert': text}})
+
+        for communicator in communicators:
+            edits = [await communicator.receive_json_from() for _ in range(2)]
+            self.assertEqual([edit['revision'] for edit in edits], [1, 2])
+
+        await communicators[0].send_json_to({'type': 'node_text',
+                                             'node_id': node.pk,
+                                             'field': 'description'})
+        answer = await communicators[0].receive_json_from()
+        self.assertIn(answer['text'], ('helloworld', 'worldhello'))  # depends on which edit came first
+
+        for communicator in communicators:
+            await communicator.disconnect()
+        await sync_to_async(node.refresh_from_db)()
+        self.assertEqual(node.description, answer['text'])
+
+    async def test_msgpack_subprotocol(self):
+        communicator = WebsocketCommunicator(application.application_mapping["websocket"],
+                                             f"/boards/{self.board.pk}/1278/",
+                                             subprotocols=['msgpack', 'json'])
+        _, subprotocol = await communicator.connect()
+        self.assertEqual(subprotocol, 'msgpack')
+
+        for _ in range(5):
+            _ = await communicator.receive_from()  # channel_name, current_user, board_info, last_event, new_user
+
+        await communicator.send_to(bytes_data=msgpack.packb({'type': 'board_info'}))
+        answer = msgpack.unpackb(await communicator.receive_from(), raw=False)
+        self.assertDictEqual(answer, {'type': 'board_info',
+                                      'board': BoardSerializer(self.board).data})
+
+    async def test_json_subprotocol_by_default(self):
+        communicator = WebsocketCommunicator(application.application_mapping["websocket"],
+                                             f"/boards/{self.board.pk}/1278/",
+                                             subprotocols=['mqtt'])
+        _, subprotocol = await communicator.connect()
+        self.assertIsNone(subprotocol)
+
+        channel_name = await communicator.receive_json_from()
+        self.assertEqual(channel_name['type'], 'channel_name')
+
+    @override_settings(WEBSOCKET_COMPRESSION={'THRESHOLD': 100, 'LEVEL': 6})
+    async def test_compression_of_big_messages(self):
+        communicator = WebsocketCommunicator(application.application_mapping["websocket"],
+                                             f"/boards/{self.board.pk}/1278/",
+                                             subprotocols=['json+deflate'])
+        _, subprotocol = await communicator.connect()
+        self.assertEqual(subprotocol, 'json+deflate')
+
+        channel_name = await communicator.receive_json_from()  # small messages are not compressed
+        self.assertEqual(channel_name['type'], 'channel_name')
+        for _ in range(4):
+            _ = await communicator.receive_from()  # current_user, board_info, last_event, new_user
+
+        await communicator.send_json_to({'type': 'columns_info'})
+        frame = await communicator.receive_from()
+        self.assertIsInstance(frame, bytes)
+        self.assertTrue(frame.startswith(COMPRESSED_FRAME_MARKER))
+
+        answer = json.loads(zlib.decompress(frame[len(COMPRESSED_FRAME_MARKER):]))
+        self.assertEqual(answer['type'], 'columns_info')
+        self.assertEqual(len(answer['columns']), 3)
+
+    async def test_compression__corrupt_frames_close_the_socket(self):
+        for frame, code in [(COMPRESSED_FRAME_MARKER + b'not zlib', 4400),
+                            (COMPRESSED_FRAME_MARKER + zlib.compress(b' ' * 100), 4413)]:
+            communicator = WebsocketCommunicator(application.application_mapping["websocket"],
+                                                 f"/boards/{self.board.pk}/1278/",
+                                                 subprotocols=['json+deflate'])
+            await communicator.connect()
+            for _ in range(5):
+                _ = await communicator.receive_from()  # greetings
+
+            with patch('board_manager.codecs.MAX_DECOMPRESSED_SIZE', 10):
+                await communicator.send_to(bytes_data=frame)
+                answer = await communicator.receive_output()
+            self.assertEqual(answer, {'type': 'websocket.close', 'code': code})
+            await communicator.disconnect()
+
+    @override_settings(WEBSOCKET_FLOW_CONTROL={'CONNECTION_RATE_LIMIT': (100, 100),
+                                               'MESSAGE_RATE_LIMITS': {'default': (0.01, 2)},
+                                               'OUTBOUND_QUEUE_SIZE': 100})
+    async def test_rate_limit(self):
+        communicator = WebsocketCommunicator(application.application_mapping["websocket"],
+                                             f"/boards/{self.board.pk}/1278/")
+        await communicator.connect()
+        for _ in range(5):
+            _ = await communicator.receive_json_from()  # channel_name, current_user, board_info, last_event, new_user
+
+        for _ in range(3):
+            await communicator.send_json_to({'type': 'board_info'})
+        answers = [await communicator.receive_json_from() for _ in range(3)]
+
+        self.assertEqual(answers[1]['type'], 'board_info')
+        self.assertDictEqual(answers[2], {'type': 'board_info',
+                                          'error_code': 4429,
+                                          'message': 'Too many messages'})
+
+    @override_settings(WEBSOCKET_FLOW_CONTROL={'CONNECTION_RATE_LIMIT': (100, 100),
+                                               'MESSAGE_RATE_LIMITS': {'default': (0.01, 2)},
+                                               'OUTBOUND_QUEUE_SIZE': 100})
+    async def test_rate_limit__invalid_messages(self):
+        communicator = WebsocketCommunicator(application.application_mapping["websocket"],
+                                             f"/boards/{self.board.pk}/1278/")
+        await communicator.connect()
+        for _ in range(5):
+            _ = await communicator.receive_json_from()  # channel_name, current_user, board_info, last_event, new_user
+
+        for message_type in ('flood_1', 'flood_2', 'flood_3'):
+            await communicator.send_json_to({'type': message_type})
+        answers = [await communicator.receive_json_from() for _ in range(3)]
+
+        self.assertEqual(answers[1]['error_code'], 4404)
+        self.assertDictEqual(answers[2], {'type': None,
+                                          'error_code': 4429,
+                                          'message': 'Too many messages'})
+
+    async def test_handler_metrics(self):
+        durations_before = handler_duration.count(kind='websocket', handler='board_nodes')
+        queries_before = handler_queries.sum(kind='websocket', handler='board_nodes')
+        received_before = payload_size.count(kind='websocket', handler='board_nodes', direction='received')
+        open_before = open_sockets.value()
+
+        communicator = WebsocketCommunicator(application.application_mapping["websocket"],
+                                             f"/boards/{self.board.pk}/1278/")
+        await communicator.connect()
+        for _ in range(5):
+            _ = await communicator.receive_json_from()  # greetings
+        self.assertEqual(open_sockets.value(), open_before + 1)
+
+        await communicator.send_json_to({'type': 'board_nodes'})
+        _ = await communicator.receive_json_from()
+        # the next answer comes after the handler above has returned
+        await communicator.send_json_to({'type': 'active_users'})
+        _ = await communicator.receive_json_from()
+
+        self.assertEqual(handler_duration.count(kind='websocket', handler='board_nodes'), durations_before + 1)
+        self.assertGreater(handler_queries.sum(kind='websocket', handler='board_nodes'), queries_before)
+        self.assertEqual(payload_size.count(kind='websocket', handler='board_nodes', direction='received'),
+                         received_before + 1)
+
+        await communicator.disconnect()
+        self.assertEqual(open_sockets.value(), open_before)
+
+    async def test_invalid_messages_are_rejected(self):
+        communicator = WebsocketCommunicator(application.application_mapping["websocket"],
+                                             f"/boards/{self.board.pk}/1278/")
+        await communicator.connect()
+        for _ in range(5):
+            _ = await communicator.receive_json_from()  # greetings
+
+        await communicator.send_json_to({'type': 'disconnect', 'code': 1000})
+        answer = await communicator.receive_json_from()
+        self.assertEqual(answer, {'type': None,
+                                  'error_code': 4404,
+                                  'message': "Unknown message type disconnect"})
+
+        await communicator.send_json_to({'type': 'delete_node'})
+        answer = await communicator.receive_json_from()
+        self.assertEqual(answer, {'type': 'delete_node',
+                                  'error_code': 4400,
+                                  'message': "node_id is empty field"})
+
+        await communicator.send_json_to({'type': 'create_column', 'position': 'first'})
+        answer = await communicator.receive_json_from()
+        self.assertEqual(answer, {'type': 'create_column',
+                                  'error_code': 4400,
+                                  'message': "position must be number"})
+
+        # the connection is still open
+        sent_before = payload_size.count(kind='websocket', handler='protocol_info', direction='sent')
+        await communicator.send_json_to({'type': 'protocol_info'})
+        answer = await communicator.receive_json_from()
+        self.assertEqual(answer['version'], 1)
+        # sent messages are labelled with registered handlers only
+        self.assertEqual(payload_size.count(kind='websocket', handler='protocol_info', direction='sent'),
+                         sent_before + 1)
+        self.assertEqual(payload_size.count(kind='websocket', handler='disconnect', direction='sent'), 0)
+        self.assertIn('edit_node_text', answer['messages'])
@@ -0,0 +1,276 @@
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from .logger import boards_logger
+from .models import Node
+from .exceptions import TextRevisionTooOldException, IllegalTextOperationException, InvalidMessageException
+
+TEXT_FIELDS = ('title', 'description')
+
+
+class TextOperation:
+    """
+    Replaces `delete` characters starting from `position` with the `insert` text.
+    Positions are counted in characters of the text the operation was made against.
+    """
+
+    def __init__(self, position: int, delete: int = 0, insert: str = ''):
+        self.position = position
+        self.delete = delete
+        self.insert = insert
+
+    @staticmethod
+    def from_dict(data: dict) -> 'TextOperation':
+        try:
+            operation = TextOperation(int(data['position']),
+                                      int(data.get('delete', 0)),
+                                      str(data.get('insert', '')))
+        except (KeyError, TypeError, ValueError):
+            raise IllegalTextOperationException()
+        if operation.position < 0 or operation.delete < 0:
+            raise IllegalTextOperationException()
+        return operation
+
+    def to_dict(self) -> dict:
+        return {'position': self.position,
+                'delete': self.delete,
+                'insert': self.insert}
+
+    def apply(self, text: str) -> str:
+        if self.position + self.delete > len(text):
+            raise IllegalTextOperationException()
+        return text[:self.position] + self.insert + text[self.position + self.delete:]
+
+    def transform_parts(self, applied: 'TextOperation') -> list:
+        """
+        Returns this operation rewritten against the text where the concurrent `applied` operation
+        has already been made, as operations on that text which do not overlap, applied from the last one.
+        Text deleted by `applied` can not be deleted twice, a delete around the text inserted by `applied`
+        is split to keep it, and inserts at the same position go before the already applied insert.
+        """
+        applied_end = applied.position + applied.delete
+        end = self.position + self.delete
+        if end <= applied.position:
+            return [TextOperation(self.position, self.delete, self.insert)]
+
+        shift = len(applied.insert) - applied.delete
+        right_start = max(self.position, applied_end)
+        left = TextOperation(self.position, min(end, applied.position) - self.position, self.insert) \
+            if self.position < applied.position else None
+        right = TextOperation(right_start + shift, max(0, end - right_start), '' if left else self.insert)
+        if left is None:
+            return [right]
+        if not right.delete:
+            return [left]
+        if not applied.insert:
+            return [TextOperation(left.position, left.delete + right.delete, left.insert)]
+        return [left, right]
+
+    def transform(self, applied: 'TextOperation') -> 'TextOperation':
+        """
+        Returns this operation rewritten against the text where the concurrent `applied` operation
+        has already been made, the text inserted by `applied` is replaced with itself if it has to be kept
+        """
+        parts = self.transform_parts(applied)
+        if len(parts) == 1:
+            return parts[0]
+        left, right = parts
+        return TextOperation(left.position, right.position + right.delete - left.position,
+                             left.insert + applied.insert)
+
+    @staticmethod
+    def compose(parts: list, text: str, new_text: str) -> 'TextOperation':
+        """
+        One operation replacing the changed part of the text, which turns `text` into `new_text`
+        """
+        start, end = parts[0].position, parts[-1].position + parts[-1].delete
+        return TextOperation(start, end - start, new_text[start:len(new_text) - (len(text) - end)])
+
+
+class TextDocument:
+    """
+    The merged state of one text field of a node with the history of the last operations,
+    which is needed to transform operations made against older revisions.
+    """
+
+    def __init__(self, node_id, field, text, max_length=None):
+        self.node_id = node_id
+        self.field = field
+        self.text = text
+        self.max_length = max_length
+        self.revision = 0
+        self.history = deque(maxlen=settings.COLLABORATIVE_EDITING['HISTORY_SIZE'])
+        self.not_saved_operations = 0
+        self.saved_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def apply(self, operation: TextOperation, revision: int):
+        with self.lock:
+            if revision > self.revision or revision < self.revision - len(self.history):
+                raise TextRevisionTooOldException(self.revision)
+
+            # the history keeps the parts of the operations, which do not overlap
+            parts = [operation]
+            for applied in list(self.history)[len(self.history) - (self.revision - revision):]:
+                for applied_part in reversed(applied):
+                    parts = [part for own in parts for part in own.transform_parts(applied_part)]
+            parts = [part for part in parts if part.delete or part.insert] or parts[:1]
+
+            text = self.text
+            for part in reversed(parts):
+                text = part.apply(text)
+            if self.max_length is not None and len(text) > self.max_length:
+                raise IllegalTextOperationException()
+
+            operation = TextOperation.compose(parts, self.text, text)
+            self.text = text
+            self.history.append(parts)
+            self.revision += 1
+            self.not_saved_operations += 1
+            return operation, self.revision
+
+    def need_snapshot(self) -> bool:
+        return self.not_saved_operations >= settings.COLLABORATIVE_EDITING['SNAPSHOT_OPERATIONS'] or \
+            (self.not_saved_operations and
+             time.monotonic() - self.saved_at >= settings.COLLABORATIVE_EDITING['SNAPSHOT_SECONDS'])
+
+    def snapshot(self):
+        with self.lock:
+            if not self.not_saved_operations:
+                return
+            Node.objects.filter(pk=self.node_id).update(**{self.field: self.text,
+                                                           'updated': timezone.now()})
+            self.not_saved_operations = 0
+            self.saved_at = time.monotonic()
+
+
+class TextDocuments:
+    """
+    Text documents of nodes which are being edited right now in this process.
+    All sockets of a board have to be served by one process, one worker or BOARD_AFFINITY,
+    or the documents of a node in several processes would go apart.
+    A thread of the ASGI application saves the documents due for a snapshot every `flush_seconds`,
+    so the last edits of a burst do not wait in memory for the next one
+    """
+
+    def __init__(self, flush_seconds=None):
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._documents = {}
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def get(self, board, node_id, field) -> TextDocument:
+        if field not in TEXT_FIELDS:
+            raise IllegalTextOperationException()
+
+        try:
+            node_id = int(node_id)
+        except ValueError:
+            raise InvalidMessageException("node_id must be number")
+
+        key = (board.pk, node_id, field)
+        with self._lock:
+            document = self._documents.get(key)
+        if document is not None:
+            return document
+
+        node = Node.objects.get(id=node_id, board=board)
+        document = TextDocument(node.pk, field, getattr(node, field),
+                                Node._meta.get_field(field).max_length)
+        with self._lock:
+            return self._documents.setdefault(key, document)
+
+    def apply(self, board, node_id, field, operation: TextOperation, revision: int):
+        """
+        Applies the operation to the document of the node field, returns the document, the operation
+        against its text and the new revision
+        """
+        document = self.get(board, node_id, field)
+        operation, revision = document.apply(operation, revision)
+        with self._lock:
+            if self._documents.get((board.pk, document.node_id, field)) is not document:
+                # closed while the operation was applied, saved before the node is loaded again
+                document.snapshot()
+        return document, operation, revision
+
+    def _board_documents(self, board_id):
+        with self._lock:
+            return [document for key, document in self._documents.items() if key[0] == board_id]
+
+    def flush(self, board_id):
+        """
+        Saves all not saved changes of the board
+        """
+        for document in self._board_documents(board_id):
+            document.snapshot()
+
+    def flush_due(self) -> int:
+        """
+        Saves the documents which need a snapshot, returns how many were saved
+        """
+        with self._lock:
+            documents = list(self._documents.values())
+        due = [document for document in documents if document.need_snapshot()]
+        for document in due:
+            document.snapshot()
+        return len(due)
+
+    def run(self):
+        """
+        Saves the documents due for a snapshot until stopped
+        """
+        while not self._stopping.wait(self.flush_seconds):
+            try:
+                self.flush_due()
+            except Exception as e:
+                boards_logger.exception(f"Saving edited texts failed: {e}")
+            finally:
+                connections.close_all()
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self.run, name='text-documents-flusher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self, board_id):
+        """
+        Saves and forgets documents of the board, e.g. when all its users have left
+        """
+        self.flush(board_id)
+        with self._lock:
+            for key in [key for key in self._documents if key[0] == board_id]:
+                del self._documents[key]
+
+    def close_node(self, board_id, node_id):
+        """
+        Saves and forgets documents of the node, e.g. before it is changed in another way
+        """
+        with self._lock:
+            keys = [key for key in self._documents if key[:2] == (board_id, node_id)]
+            documents = [self._documents.pop(key) for key in keys]
+        for document in documents:
+            document.snapshot()
+
+    def discard(self, board_id, node_id):
+        """
+        Forgets documents of the node without saving them, e.g. when the node has been deleted
+        """
+        with self._lock:
+            for key in [key for key in self._documents if key[:2] == (board_id, node_id)]:
+                del self._documents[key]
+
+
+text_documents = TextDocuments(settings.COLLABORATIVE_EDITING['SNAPSHOT_SECONDS'])
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from django.conf import settings
+
+# fields with ids of objects and the kinds of the objects
+ID_FIELDS = {'node_id': 'n', 'column_id': 'c', 'status': 'c', 'another_user_id': 'u', 'board_id': 'b'}
+OBJECT_FIELDS = {'node': 'n', 'column': 'c'}
+# user content is replaced with text of the same length
+TEXT_FIELDS = {'title', 'description', 'name', 'link_to', 'assigned', 'insert', 'query'}
+
+PSEUDONYM = re.compile(r'^([nucb]):[0-9a-f]{12}$')
+
+
+class TrafficRecorder:
+    """
+    Appends incoming websocket messages with their time to a NDJSON file.
+    Ids are replaced with stable pseudonyms and user texts are masked.
+    """
+
+    def __init__(self, enabled, path, salt):
+        self.enabled = enabled
+        self.path = path
+        self.salt = salt
+        self._file = None
+        self._lock = threading.Lock()
+
+    def pseudonym(self, kind, value):
+        if value is None:
+            return None
+        digest = hashlib.blake2b(f"{self.salt}:{kind}:{value}".encode('utf-8'), digest_size=6).hexdigest()
+        return f"{kind}:{digest}"
+
+    def anonymize(self, value, key=None):
+        if isinstance(value, dict):
+            if key == 'columns':
+                # migrate_to_another_board maps columns of one board to columns of another
+                return {self.pseudonym('c', old): self.pseudonym('c', new) for old, new in value.items()}
+            anonymized = {}
+            for field, field_value in value.items():
+                if key in OBJECT_FIELDS and field == 'id':
+                    anonymized[field] = self.pseudonym(OBJECT_FIELDS[key], field_value)
+                else:
+                    anonymized[field] = self.anonymize(field_value, field)
+            return anonymized
+        if key in ID_FIELDS:
+            return self.pseudonym(ID_FIELDS[key], value)
+        if key in TEXT_FIELDS and isinstance(value, str):
+            return 'x' * len(value)
+        return value
+
+    def _write(self, record):
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(line)
+            self._file.flush()
+
+    def _record(self, event, consumer, message=None):
+        if not self.enabled:
+            return
+        # the board and the user are unknown if the connection was refused early
+        record = {'time': time.time(),
+                  'event': event,
+                  'connection': self.pseudonym('s', consumer.channel_name),
+                  'board': self.pseudonym('b', getattr(consumer.board, 'pk', None)),
+                  'user': self.pseudonym('u', getattr(consumer.scope.get('user'), 'pk', None))}
+        if message is not None:
+            record['message'] = self.anonymize(message)
+        self._write(record)
+
+    def connected(self, consumer):
+        self._record('connect', consumer)
+
+    def received(self, consumer, message):
+        self._record('message', consumer, message)
+
+    def disconnected(self, consumer):
+        self._record('disconnect', consumer)
+
+
+def read_recordings(paths):
+    """
+    Returns records of all the files ordered by time
+    """
+    records = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return sorted(records, key=lambda record: record['time'])
+
+
+traffic_recorder = TrafficRecorder(settings.WEBSOCKET_RECORDING['ENABLED'],
+                                   settings.WEBSOCKET_RECORDING['PATH'].format(pid=os.getpid()),
+                                   settings.WEBSOCKET_RECORDING['SALT'])
@@ -1,6 +1,8 @@
 from django.urls import path
 from .views import (
-    create_board, delete_board, my_boards, open_board, leave_board, get_board_columns
+    create_board, delete_board, my_boards, open_board, leave_board, get_board_columns,
+    clone_board, save_board_template, board_templates, create_board_from_template, job_status,
+    search_nodes, route_board
 )
 
 
@@ -11,4 +13,11 @@ urlpatterns = [
     path('open_board/', open_board),
     path('leave_board/', leave_board),
     path('get_board_columns/', get_board_columns),
+    path('clone_board/', clone_board),
+    path('templates/', board_templates),
+    path('save_template/', save_board_template),
+    path('create_board_from_template/', create_board_from_template),
+    path('job_status/', job_status),
+    path('search_nodes/', search_nodes),
+    path('route/<str:board_id>/', route_board),
 ]
@@ -1,5 +1,7 @@
 import json
 
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
 from django.http import HttpResponse, JsonResponse
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
@@ -10,11 +12,16 @@ from authentication.serializers import UserSerializer
 from helpers.helper import catch_view_exception
 from .logger import boards_logger
 from .board_manager_backend import BoardManager
-from .exceptions import BoardManagerException
+from .jobs import enqueue
+from .permissions import IsLoadBalancer
+from .search import search_nodes as search_board_nodes
+from .workers import worker_registry
+from .caching import versions, user_boards_key, board_key, columns_key, make_etag, cached_response
+from .exceptions import BoardManagerException, JobDoesNotExistException
 from .serializers import (
-    UserBoardsSerializer, BoardWithoutContentSerializer, ColumnSerializer
+    UserBoardsSerializer, BoardWithoutContentSerializer, ColumnSerializer, BoardTemplateSerializer
 )
-from .models import UserBoards, Access, Board, Column
+from .models import UserBoards, Access, Column, Job
 
 
 @csrf_exempt
@@ -48,13 +55,23 @@ def delete_board(request):
 @permission_classes([IsAuthenticated])
 @catch_view_exception([], boards_logger)
 def my_boards(request):
-    boards = BoardManager.get_user_boards(request.user)
-    serializer = UserBoardsSerializer(boards, many=True)
-    data = serializer.data
-    for row in data:
-        owner = UserBoards.objects.get(board=row["board"]["id"], access=Access.OWNER).user
-        row["owner"] = UserSerializer(owner).data
-    return JsonResponse(data, status=status.HTTP_200_OK, safe=False)
+    user_version, = versions(user_boards_key(request.user.pk))
+    board_ids = cache.get(f"board_ids:{request.user.pk}:{user_version}")
+    if board_ids is None:
+        board_ids = list(BoardManager.get_user_boards(request.user).values_list('board_id', flat=True))
+        cache.set(f"board_ids:{request.user.pk}:{user_version}", board_ids)
+
+    def build():
+        boards = BoardManager.get_user_boards(request.user)
+        serializer = UserBoardsSerializer(boards, many=True)
+        data = serializer.data
+        for row in data:
+            owner = UserBoards.objects.get(board=row["board"]["id"], access=Access.OWNER).user
+            row["owner"] = UserSerializer(owner).data
+        return json.dumps(data, cls=DjangoJSONEncoder)
+
+    etag = make_etag(user_version, *versions(*[board_key(board_id) for board_id in sorted(board_ids)]))
+    return cached_response(request, 'my_boards', etag, build)
 
 
 @csrf_exempt
@@ -88,8 +105,120 @@ def leave_board(request):
 @catch_view_exception(['board_id'], boards_logger)
 def get_board_columns(request):
     try:
-        board = Board.objects.get(id=request.data['board_id'])
-        columns = Column.objects.filter(board=board).all()
-        return HttpResponse(json.dumps([column.to_dict() for column in columns]), status=status.HTTP_200_OK)
+        # the cached body is shared by the participants of the board only
+        board = BoardManager.get_participated_board(request.data['board_id'], request.user)
+
+        def build():
+            columns = Column.objects.filter(board=board).all()
+            return json.dumps([column.to_dict() for column in columns])
+
+        version, = versions(columns_key(board.pk))
+        return cached_response(request, 'get_board_columns', make_etag(board.pk, version), build)
     except BoardManagerException as e:
         return HttpResponse(content=e.message, status=e.response_status)
+
+
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@catch_view_exception(['board_id'], boards_logger)
+def clone_board(request):
+    try:
+        board = BoardManager.get_participated_board(request.data['board_id'], request.user)
+        # not pushed to the group of the board, only the requester asks for the status with job_status
+        job = enqueue('clone_board',
+                      {'board_id': board.pk, 'user_id': request.user.pk, 'name': request.data.get('name')},
+                      user=request.user)
+        return JsonResponse(job.to_dict(), status=status.HTTP_202_ACCEPTED)
+    except BoardManagerException as e:
+        return HttpResponse(content=e.message, status=e.response_status)
+
+
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@catch_view_exception(['board_id'], boards_logger)
+def save_board_template(request):
+    try:
+        template = BoardManager.save_template(request.data['board_id'],
+                                              request.user,
+                                              request.data.get('name'))
+        serializer = BoardTemplateSerializer(template)
+        return JsonResponse(serializer.data, status=status.HTTP_201_CREATED)
+    except BoardManagerException as e:
+        return HttpResponse(content=e.message, status=e.response_status)
+
+
+@csrf_exempt
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@catch_view_exception([], boards_logger)
+def board_templates(request):
+    serializer = BoardTemplateSerializer(BoardManager.get_templates(request.user), many=True)
+    return JsonResponse(serializer.data, status=status.HTTP_200_OK, safe=False)
+
+
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@catch_view_exception(['template_id'], boards_logger)
+def create_board_from_template(request):
+    try:
+        board = BoardManager.create_board_from_template(request.data['template_id'],
+                                                        request.user,
+                                                        request.data.get('name'))
+        serializer = BoardWithoutContentSerializer(board)
+        return JsonResponse(serializer.data, status=status.HTTP_201_CREATED)
+    except BoardManagerException as e:
+        return HttpResponse(content=e.message, status=e.response_status)
+
+
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@catch_view_exception(['job_id'], boards_logger)
+def job_status(request):
+    try:
+        try:
+            job = Job.objects.get(pk=request.data['job_id'], user=request.user)
+        except (Job.DoesNotExist, ValueError):
+            raise JobDoesNotExistException()
+        return JsonResponse(job.to_dict(), status=status.HTTP_200_OK)
+    except BoardManagerException as e:
+        return HttpResponse(content=e.message, status=e.response_status)
+
+
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@catch_view_exception(['query'], boards_logger)
+def search_nodes(request):
+    try:
+        board_id = request.data.get('board_id')
+        if board_id:
+            BoardManager.get_participated_board(board_id, request.user)
+        results = search_board_nodes(request.user,
+                                     request.data['query'],
+                                     board_id or None,
+                                     request.data.get('page', 1),
+                                     request.data.get('page_size'))
+        return JsonResponse(results, status=status.HTTP_200_OK)
+    except BoardManagerException as e:
+        return HttpResponse(content=e.message, status=e.response_status)
+
+
+@csrf_exempt
+@api_view(['GET'])
+@permission_classes([IsLoadBalancer])
+@catch_view_exception([], boards_logger)
+def route_board(request, board_id):
+    """
+    Address of the worker owning the sockets of the board in the X-Board-Worker header,
+    for the load balancer (e.g. auth_request of nginx with proxy_set_header X-Route-Token)
+    """
+    address = worker_registry.owner_address(f"board_{board_id}")
+    if address is None:
+        return HttpResponse(status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    response = HttpResponse(status=status.HTTP_204_NO_CONTENT)
+    response['X-Board-Worker'] = address
+    return response
@@ -0,0 +1,128 @@
+import atexit
+import datetime
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from helpers.consistent_hash import ConsistentHashRing
+from helpers.metrics import Counter, Gauge
+from .logger import boards_logger
+from .models import Worker
+
+ring_changes = Counter('worker_ring_changes_total', 'Changes of the live workers the boards are spread over')
+live_workers = Gauge('live_workers', 'Workers with a recent heartbeat')
+
+
+class WorkerRegistry:
+    """
+    Heartbeats of this worker in the Worker table and the ring of the live workers, which maps
+    the group of every board to the worker owning its sockets. When workers join or leave
+    only the boards of the changed part of the ring move. Ownership is trusted only after
+    the ring has not changed for `expiry_seconds`, while sockets of moved boards reconnect
+    """
+
+    def __init__(self, name, address, heartbeat_seconds, expiry_seconds, virtual_nodes, clock=time.monotonic):
+        self.name = name
+        self.address = address
+        self.heartbeat_seconds = heartbeat_seconds
+        self.expiry_seconds = expiry_seconds
+        self.virtual_nodes = virtual_nodes
+        self.clock = clock
+
+        self.ring = ConsistentHashRing(virtual_nodes=virtual_nodes)
+        self.addresses = {}
+        self.version = 0
+        self.changed_at = None
+
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def heartbeat(self):
+        now = timezone.now()
+        Worker.objects.update_or_create(name=self.name, defaults={'address': self.address, 'heartbeat': now})
+        self.refresh()
+
+    def refresh(self):
+        expired = timezone.now() - datetime.timedelta(seconds=self.expiry_seconds)
+        addresses = dict(Worker.objects.filter(heartbeat__gte=expired).values_list('name', 'address'))
+        live_workers.set(len(addresses))
+        if set(addresses) != self.ring.nodes:
+            boards_logger.info(f"Live workers changed to {sorted(addresses)}")
+            # a new ring, readers of the old one are not disturbed
+            self.ring = ConsistentHashRing(sorted(addresses), self.virtual_nodes)
+            self.version += 1
+            self.changed_at = self.clock()
+            ring_changes.inc()
+        self.addresses = addresses
+
+    def owner(self, group):
+        """
+        Name of the worker owning the group, None while there are no live workers
+        """
+        ring = self.ring
+        try:
+            return ring.get_node(group)
+        except LookupError:
+            return None
+
+    def owner_address(self, group):
+        """
+        Address of the worker owning the group, None while it is unknown or the worker registered no address
+        """
+        return self.addresses.get(self.owner(group)) or None
+
+    def stable(self) -> bool:
+        return self.changed_at is not None and self.clock() - self.changed_at >= self.expiry_seconds
+
+    def owns_group(self, group) -> bool:
+        return self.stable() and self.owner(group) == self.name
+
+    def is_moved(self, group) -> bool:
+        owner = self.owner(group)
+        return owner is not None and owner != self.name
+
+    def leave(self):
+        Worker.objects.filter(name=self.name).delete()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._work, name='worker-heartbeat', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+        try:
+            self.leave()
+        except Exception as e:
+            boards_logger.error(f"Unable to unregister the worker {self.name}: {e}")
+        finally:
+            connections.close_all()
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                self.heartbeat()
+            except Exception as e:
+                boards_logger.error(f"Worker heartbeat failed: {e}")
+            finally:
+                connections.close_all()
+            self._stopping.wait(self.heartbeat_seconds)
+
+
+worker_registry = WorkerRegistry(settings.BOARD_AFFINITY['WORKER_NAME'] or f"{socket.gethostname()}:{os.getpid()}",
+                                 settings.BOARD_AFFINITY['ADDRESS'],
+                                 settings.BOARD_AFFINITY['HEARTBEAT_SECONDS'],
+                                 settings.BOARD_AFFINITY['EXPIRY_SECONDS'],
+                                 settings.BOARD_AFFINITY['VIRTUAL_NODES'])
@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import deque
+
+from .metrics import Counter, Gauge, Histogram
+
+pool_wait = Histogram('db_pool_wait_seconds', 'Time spent waiting for a pooled connection', ['pool'])
+pool_connections = Gauge('db_pool_connections', 'Pooled connections by state', ['pool', 'state'])
+pool_discarded = Counter('db_pool_discarded_connections_total', 'Connections closed by health checks or errors',
+                         ['pool'])
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Keeps up to `size` connections made by `factory` and lends them to threads.
+    Connections idle for more than `check_idle_seconds` are health-checked before lending.
+    """
+
+    def __init__(self, factory, size, timeout=10, check=None, check_idle_seconds=30, close=None, name='default',
+                 clock=time.monotonic):
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self.check = check
+        self.check_idle_seconds = check_idle_seconds
+        self.close_connection = close or (lambda connection: connection.close())
+        self.name = name
+        self.clock = clock
+
+        self._idle = deque()  # (connection, returned at)
+        self._created = 0
+        self._condition = threading.Condition()
+
+    def _update_gauges(self):
+        pool_connections.set(len(self._idle), pool=self.name, state='idle')
+        pool_connections.set(self._created - len(self._idle), pool=self.name, state='in_use')
+
+    def _usable(self, connection, returned_at) -> bool:
+        if self.check is None or self.clock() - returned_at < self.check_idle_seconds:
+            return True
+        try:
+            return self.check(connection)
+        except Exception:
+            return False
+
+    def get(self):
+        started = self.clock()
+        while True:
+            with self._condition:
+                while not self._idle and self._created >= self.size:
+                    remaining = self.timeout - (self.clock() - started)
+                    if remaining <= 0:
+                        raise PoolTimeout(f"No free connection in the pool {self.name} in {self.timeout}s")
+                    self._condition.wait(remaining)
+
+                if self._idle:
+                    # the most recently used connection is the most likely to be alive
+                    connection, returned_at = self._idle.pop()
+                else:
+                    connection, returned_at = None, None
+                    self._created += 1
+                self._update_gauges()
+
+            if connection is None:
+                try:
+                    connection = self.factory()
+                except Exception:
+                    self._forget()
+                    raise
+                break
+            if self._usable(connection, returned_at):
+                break
+            self.discard(connection)
+
+        pool_wait.observe(self.clock() - started, pool=self.name)
+        return connection
+
+    def put(self, connection):
+        with self._condition:
+            self._idle.append((connection, self.clock()))
+            self._update_gauges()
+            self._condition.notify()
+
+    def _forget(self):
+        with self._condition:
+            self._created -= 1
+            self._update_gauges()
+            self._condition.notify()
+
+    def discard(self, connection):
+        """
+        Closes a broken connection or one which must not be lent again
+        """
+        pool_discarded.inc(pool=self.name)
+        try:
+            self.close_connection(connection)
+        except Exception:
+            pass
+        self._forget()
+
+    def prefill(self, count):
+        """
+        Opens connections until `count` are idle or the pool is full, so the first requests do not wait for them
+        """
+        while True:
+            with self._condition:
+                if len(self._idle) >= count or self._created >= self.size:
+                    return
+                self._created += 1
+            try:
+                connection = self.factory()
+            except Exception:
+                self._forget()
+                raise
+            self.put(connection)
+
+    def close_idle(self):
+        with self._condition:
+            idle, self._idle = list(self._idle), deque()
+            self._created -= len(idle)
+            self._update_gauges()
+            self._condition.notify_all()
+        for connection, _ in idle:
+            try:
+                self.close_connection(connection)
+            except Exception:
+                pass
+
+    def __len__(self):
+        return self._created
@@ -0,0 +1,41 @@
+import bisect
+import hashlib
+
+
+class ConsistentHashRing:
+    """
+    Maps keys to nodes so that adding or removing a node moves only the keys of that node
+    """
+
+    def __init__(self, nodes=(), virtual_nodes=100):
+        self.virtual_nodes = virtual_nodes
+        self._hashes = []
+        self._nodes = []
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key) -> int:
+        return int.from_bytes(hashlib.md5(str(key).encode('utf-8')).digest()[:8], 'big')
+
+    def add(self, node):
+        for i in range(self.virtual_nodes):
+            point = self._hash(f"{node}#{i}")
+            index = bisect.bisect(self._hashes, point)
+            self._hashes.insert(index, point)
+            self._nodes.insert(index, node)
+
+    def remove(self, node):
+        points = [(point, ring_node) for point, ring_node in zip(self._hashes, self._nodes) if ring_node != node]
+        self._hashes = [point for point, _ in points]
+        self._nodes = [ring_node for _, ring_node in points]
+
+    @property
+    def nodes(self) -> set:
+        return set(self._nodes)
+
+    def get_node(self, key):
+        if not self._hashes:
+            raise LookupError("The ring has no nodes")
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._nodes[index]
@@ -0,0 +1,4 @@
+from contextvars import ContextVar
+
+# handler, message type, board and user of the code running now
+handler_context = ContextVar('handler_context', default=None)
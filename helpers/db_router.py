@@ -0,0 +1,89 @@
+import itertools
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache as default_cache
+from django.db import connections
+
+from .context import handler_context
+from .metrics import Counter
+
+replica_reads = Counter('db_replica_reads_total', 'Reads of handlers routed to read replicas', ['database'])
+
+
+class PrimaryPins:
+    """
+    Boards and users written to recently, whose reads go to the primary until the replicas catch up.
+    Pins are kept in the cache, so share it in Redis between the workers (CODE_DOCS_CACHE_REDIS),
+    a board may be written to in one worker and read in another.
+    """
+
+    def __init__(self, cache=default_cache, clock=time.time):
+        self.cache = cache
+        self.clock = clock
+
+    @staticmethod
+    def _key(key) -> str:
+        return f"primary_pin:{key[0]}:{key[1]}"
+
+    def pin(self, keys, seconds):
+        until = self.clock() + seconds
+        self.cache.set_many({self._key(key): until for key in keys}, math.ceil(seconds))
+
+    def is_pinned(self, keys) -> bool:
+        now = self.clock()
+        return any(until > now for until in self.cache.get_many([self._key(key) for key in keys]).values())
+
+
+class ReadReplicaRouter:
+    """
+    Sends the reads of the handlers listed in READ_REPLICAS['HANDLERS'] to the replicas,
+    unless their board or user has been written to in the last READ_REPLICAS['PIN_SECONDS']
+    """
+
+    def __init__(self):
+        self.pins = PrimaryPins()
+        self._replicas = None
+        self._next_replica = None
+
+    def _pin_keys(self, context):
+        return [key for key in (('board', context.get('board')), ('user', context.get('user'))) if key[1] is not None]
+
+    def _replica(self):
+        replicas = settings.READ_REPLICAS['DATABASES']
+        if replicas != self._replicas:
+            self._replicas = list(replicas)
+            self._next_replica = itertools.cycle(self._replicas)
+        return next(self._next_replica)
+
+    def db_for_read(self, model, **hints):
+        # explicit, otherwise objects read from a replica would keep reading from it
+        context = handler_context.get()
+        if (context is None or context['handler'] not in settings.READ_REPLICAS['HANDLERS']
+                or not settings.READ_REPLICAS['DATABASES']):
+            return 'default'
+        # the transaction of the primary sees its own changes only
+        if connections['default'].in_atomic_block:
+            return 'default'
+        if self.pins.is_pinned(self._pin_keys(context)):
+            return 'default'
+
+        database = self._replica()
+        replica_reads.inc(database=database)
+        return database
+
+    def db_for_write(self, model, **hints):
+        context = handler_context.get()
+        if context is not None and settings.READ_REPLICAS['DATABASES']:
+            self.pins.pin(self._pin_keys(context), settings.READ_REPLICAS['PIN_SECONDS'])
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.READ_REPLICAS['DATABASES']:
+            return False
+        return None
@@ -1,18 +1,27 @@
 from django.http import HttpResponseBadRequest
 
+from .instrumentation import instrument, payload_size
+
 
 def catch_view_exception(required_request_fields: tuple or list, logger):
     def decorator(func):
-        def wrap(request):
-
-            # check necessary fields in request
-            for field in required_request_fields:
-                try:
-                    request.data[field]
-                except KeyError:
-                    logger.error(f"{field} is empty field")
-                    return HttpResponseBadRequest(f"{field} not given")
+        def wrap(request, *args, **kwargs):
+            board_id = request.data.get('board_id') if hasattr(request.data, 'get') else None
+            board_id = kwargs.get('board_id', board_id)
+            with instrument('view', func.__name__, board=board_id, user=request.user.pk):
+                # check necessary fields in request
+                for field in required_request_fields:
+                    try:
+                        request.data[field]
+                    except KeyError:
+                        logger.error(f"{field} is empty field")
+                        return HttpResponseBadRequest(f"{field} not given")
 
-            return func(request)
+                response = func(request, *args, **kwargs)
+            payload_size.observe(int(request.META.get('CONTENT_LENGTH') or 0),
+                                 kind='view', handler=func.__name__, direction='received')
+            payload_size.observe(len(getattr(response, 'content', b'')),
+                                 kind='view', handler=func.__name__, direction='sent')
+            return response
         return wrap
     return decorator
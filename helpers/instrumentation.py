@@ -0,0 +1,69 @@
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+from .metrics import Histogram
+from .context import handler_context
+from .sql_tracing import SqlTracer
+
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+handler_duration = Histogram('handler_duration_seconds',
+                             'Time spent in websocket handlers and REST views',
+                             ['kind', 'handler'])
+handler_queries = Histogram('handler_db_queries',
+                            'SQL queries made by one call of a handler',
+                            ['kind', 'handler'], QUERY_BUCKETS)
+handler_query_duration = Histogram('handler_db_query_duration_seconds',
+                                   'Time spent in SQL queries by one call of a handler',
+                                   ['kind', 'handler'])
+payload_size = Histogram('payload_size_bytes',
+                         'Sizes of received and sent messages and bodies',
+                         ['kind', 'handler', 'direction'], SIZE_BUCKETS)
+
+
+class QueryTimer:
+    """
+    Execute wrapper counting queries of the connection and the time spent in them
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+@contextmanager
+def instrument(kind, handler, **context):
+    """
+    Measures the latency and the SQL queries of the handler called inside
+    and traces the queries with the handler context (message type, board, user)
+    """
+    context = {'kind': kind, 'handler': handler, **context}
+    token = handler_context.set(context)
+    timer = QueryTimer()
+    tracer = SqlTracer(context)
+    started = time.perf_counter()
+    try:
+        with connection.execute_wrapper(timer), connection.execute_wrapper(tracer):
+            yield timer
+    except Exception as e:
+        # the exception handler of REST framework logs it out of this block, with the context of the exception
+        if getattr(e, 'handler_context', None) is None:
+            e.handler_context = context
+        raise
+    finally:
+        handler_context.reset(token)
+        tracer.report_repeated()
+        handler_duration.observe(time.perf_counter() - started, kind=kind, handler=handler)
+        handler_queries.observe(timer.count, kind=kind, handler=handler)
+        handler_query_duration.observe(timer.duration, kind=kind, handler=handler)
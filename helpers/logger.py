@@ -1,23 +1,200 @@
+import atexit
+import json
 import logging
 import os
-from CodeDocs_backend.settings import BASE_DIR
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 
-LOGGER_FORMATTER = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+from CodeDocs_backend.settings import BASE_DIR, LOG_FILES
+from .context import handler_context
+from .metrics import Counter
 
+dropped_records = Counter('log_dropped_records_total', 'Log records dropped because the log queue was full')
+suppressed_records = Counter('log_suppressed_records_total', 'Repeated log records left out by sampling',
+                             ['logger'])
 
-def create_logger(logger_name, level=logging.INFO):
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line with the handler context of the record
+    """
+
+    def format(self, record):
+        data = {'time': self.formatTime(record),
+                'logger': record.name,
+                'level': record.levelname,
+                'message': record.getMessage()}
+        data.update(getattr(record, 'context', None) or {})
+        if getattr(record, 'suppressed', 0):
+            data['suppressed'] = record.suppressed
+        return json.dumps(data, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Attaches the handler context in the thread of the caller, before the record is queued
+    """
+
+    def filter(self, record):
+        record.context = handler_context.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through `burst` records with the same message per `period` seconds
+    and counts the rest, the next record let through tells how many were left out
+    """
+
+    def __init__(self, burst, period, level=logging.WARNING, key_length=200, clock=time.monotonic):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        self.level = level
+        self.key_length = key_length
+        self.clock = clock
+        self._windows = {}  # key -> [window start, records in window, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < self.level:
+            return True
+
+        key = (record.name, record.getMessage()[:self.key_length])
+        now = self.clock()
+        with self._lock:
+            if len(self._windows) > 10000:
+                self._windows = {k: w for k, w in self._windows.items() if now - w[0] < self.period}
+            window = self._windows.setdefault(key, [now, 0, 0])
+            if now - window[0] >= self.period:
+                window[0], window[1] = now, 0
+            window[1] += 1
+            if window[1] > self.burst:
+                window[2] += 1
+                suppressed_records.inc(logger=record.name)
+                return False
+            record.suppressed, window[2] = window[2], 0
+        return True
+
+
+class SizeAndTimeRotatingFileHandler(TimedRotatingFileHandler):
+    """
+    Rotates the file every `when` and also when it grows over `max_bytes`.
+    Rotation renames the file, so only one process may write to it, see `log_file_name`
+    """
+
+    def __init__(self, filename, max_bytes, when, backup_count, encoding=None):
+        super().__init__(filename, when=when, backupCount=backup_count, encoding=encoding)
+        self.max_bytes = max_bytes
+
+    def shouldRollover(self, record):
+        if super().shouldRollover(record):
+            return True
+        if self.max_bytes and self.stream is not None:
+            self.stream.seek(0, os.SEEK_END)
+            return self.stream.tell() + len(self.format(record)) + 1 >= self.max_bytes
+        return False
+
+    def rotation_filename(self, default_name):
+        # several size rotations in the same time interval
+        name, number = default_name, 0
+        while os.path.exists(name):
+            number += 1
+            name = f"{default_name}.{number}"
+        return name
+
+
+class DroppingQueueHandler(QueueHandler):
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_records.inc()
+
+
+class FileRouter(logging.Handler):
+    """
+    Handler of the writer thread passing records to the file handlers of their loggers
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.handlers = {}
+
+    def emit(self, record):
+        handler = self.handlers.get(record.name)
+        if handler is not None:
+            handler.handle(record)
+
+
+class LogPipeline:
+    """
+    Request threads only put records to a queue, one background thread writes them to the files
+    """
+
+    def __init__(self, queue_size):
+        self.queue = queue.Queue(queue_size)
+        self.router = FileRouter()
+        self.listener = QueueListener(self.queue, self.router)
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if not self._started:
+                self.listener.start()
+                self._started = True
+                atexit.register(self.stop)
+
+    def stop(self):
+        with self._lock:
+            if self._started:
+                self.listener.stop()
+                self._started = False
+
+    def flush(self):
+        """
+        Waits until the queued records are written
+        """
+        self.queue.join()
+        for handler in self.router.handlers.values():
+            handler.flush()
+
+
+log_pipeline = LogPipeline(LOG_FILES['QUEUE_SIZE'])
+
+
+def log_file_name(logger_name) -> str:
+    """
+    Every worker of runworkers writes its own files, the worker started again in its place continues them
+    """
+    worker_name = os.getenv('CODE_DOCS_WORKER_NAME')
+    if worker_name:
+        return f"{logger_name}-worker{worker_name.rsplit(':', 1)[-1]}.log"
+    return f"{logger_name}.log"
+
+
+def create_logger(logger_name, level=logging.INFO, directory=None):
     # create path
-    path = os.path.join(BASE_DIR, "logs", f"{logger_name}.log")
+    path = os.path.join(directory or os.path.join(BASE_DIR, "logs"), log_file_name(logger_name))
     if not os.path.exists(os.path.dirname(path)):
         os.makedirs(os.path.dirname(path))
 
-    # file handler
-    fh = logging.FileHandler(path, encoding='utf-8')
-    formatter = logging.Formatter(LOGGER_FORMATTER)
-    fh.setFormatter(formatter)
+    # rotated JSON file written by the background thread
+    fh = SizeAndTimeRotatingFileHandler(path, LOG_FILES['MAX_BYTES'], LOG_FILES['WHEN'],
+                                        LOG_FILES['BACKUP_COUNT'], encoding='utf-8')
+    fh.setFormatter(JsonFormatter())
+    log_pipeline.router.handlers[logger_name] = fh
+    log_pipeline.start()
+
+    qh = DroppingQueueHandler(log_pipeline.queue)
+    qh.addFilter(ContextFilter())
+    qh.addFilter(SamplingFilter(LOG_FILES['SAMPLING_BURST'], LOG_FILES['SAMPLING_PERIOD']))
 
     # create logger
     logger = logging.getLogger(logger_name)
     logger.setLevel(level)
-    logger.addHandler(fh)
+    logger.addHandler(qh)
     return logger
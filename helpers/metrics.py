@@ -0,0 +1,200 @@
+import hmac
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+
+def _escape(label_value):
+    return label_value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    """
+    Monotonically growing process-wide value, optionally split by labels
+    """
+    type = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, dict(zip(self.labels, key)), value) for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """
+    Value which goes up and down, or is taken from the function on every scrape
+    """
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        if self.function is not None:
+            return [(self.name, {}, self.function())]
+        return super().samples()
+
+
+class Histogram:
+    """
+    Counts observed values in cumulative buckets, optionally split by labels
+    """
+    type = 'histogram'
+    DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labels -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = [[0] * len(self.buckets), 0, 0]
+            counts = self._values[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][i] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    def count(self, **labels):
+        return self._values.get(self._key(labels), [None, 0, 0])[2]
+
+    def sum(self, **labels):
+        return self._values.get(self._key(labels), [None, 0, 0])[1]
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (bucket_counts, total, count) in self._values.items():
+                labels = dict(zip(self.labels, key))
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    samples.append((f"{self.name}_bucket", {**labels, 'le': str(bound)}, bucket_count))
+                samples.append((f"{self.name}_bucket", {**labels, 'le': '+Inf'}, count))
+                samples.append((f"{self.name}_sum", labels, total))
+                samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """
+        Returns all metrics in the Prometheus text format
+        """
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                if labels:
+                    labels = ','.join(f'{label}="{_escape(label_value)}"' for label, label_value in labels.items())
+                    lines.append(f"{name}{{{labels}}} {value}")
+                else:
+                    lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+SUMMED_TYPES = ('counter', 'histogram')
+
+
+def _with_label(sample, label, label_value):
+    label = f'{label}="{_escape(label_value)}"'
+    if sample.endswith('}'):
+        name, labels = sample[:-1].split('{', 1)
+        return f"{name}{{{label},{labels}}}"
+    return f"{sample}{{{label}}}"
+
+
+def merge_rendered(texts_by_worker) -> str:
+    """
+    Merges metrics rendered by several processes, {worker: text}.
+    Counters and histograms are summed up by name and labels, the samples of other types (gauges)
+    are kept for every worker with its `worker` label, or as they are for the worker None
+    """
+    families = {}  # name -> [help and type lines, type, {sample: value}]
+    for worker, text in texts_by_worker.items():
+        family = None
+        for line in text.splitlines():
+            if line.startswith('# HELP ') or line.startswith('# TYPE '):
+                parts = line.split(' ', 3)
+                family = families.setdefault(parts[2], [[], None, {}])
+                if line not in family[0]:
+                    family[0].append(line)
+                if parts[1] == 'TYPE':
+                    family[1] = parts[3]
+            elif line and family is not None:
+                sample, value = line.rsplit(' ', 1)
+                if family[1] in SUMMED_TYPES:
+                    family[2][sample] = family[2].get(sample, 0) + float(value)
+                else:
+                    if worker is not None:
+                        sample = _with_label(sample, 'worker', str(worker))
+                    family[2][sample] = float(value)
+
+    lines = []
+    for header, _, samples in families.values():
+        lines.extend(header)
+        lines.extend(f"{sample} {int(value) if value.is_integer() else value}" for sample, value in samples.items())
+    return '\n'.join(lines) + '\n'
+
+
+def _header_matches(request, header, expected) -> bool:
+    return bool(expected) and hmac.compare_digest(request.META.get(header, '').encode(), expected.encode())
+
+
+def metrics_view(request):
+    """
+    Served to scrapers sending the token (Authorization: Bearer <token>)
+    and to runworkers sending the secret of its workers (X-Stats-Token), nobody is trusted for their address
+    """
+    token, stats_token = settings.METRICS['TOKEN'], settings.METRICS['STATS_TOKEN']
+    if not (_header_matches(request, 'HTTP_AUTHORIZATION', token and f"Bearer {token}") or
+            _header_matches(request, 'HTTP_X_STATS_TOKEN', stats_token)):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,98 @@
+"""
+PostgreSQL backend lending connections from a process-wide pool.
+
+Closing a connection returns it to the pool, so the connections closed by Django
+after every request and by channels after every consumer handler are reused
+by the threads of the next ones instead of being opened again.
+"""
+import threading
+
+import psycopg2.extensions
+import psycopg2.extras
+from django.db.backends.postgresql import base, creation
+
+from helpers.connection_pool import ConnectionPool
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, conn_params, pool_settings) -> ConnectionPool:
+    key = (alias, tuple(sorted((name, str(value)) for name, value in conn_params.items())))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(lambda: base.Database.connect(**conn_params),
+                                         size=pool_settings.get('SIZE', 20),
+                                         timeout=pool_settings.get('TIMEOUT', 10),
+                                         check=is_usable,
+                                         check_idle_seconds=pool_settings.get('CHECK_IDLE_SECONDS', 30),
+                                         name=f"{alias}:{conn_params.get('database')}")
+        return _pools[key]
+
+
+def close_pools(database_name=None):
+    """
+    Closes idle connections of all pools or of the pools of the database
+    """
+    with _pools_lock:
+        pools = [pool for (_, params), pool in _pools.items()
+                 if database_name is None or ('database', database_name) in params]
+    for pool in pools:
+        pool.close_idle()
+
+
+def is_usable(connection) -> bool:
+    if connection.closed:
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+    return True
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # a database with open connections can not be dropped
+        close_pools(test_database_name)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+
+    def get_new_connection(self, conn_params):
+        self.pool = get_pool(self.alias, conn_params, self.settings_dict.get('POOL', {}))
+        connection = self.pool.get()
+
+        # the same as in the parent, which makes a new connection every time
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+        if self.pool is None or self.in_atomic_block or self.connection.closed:
+            # Django keeps using a connection closed inside atomic blocks until they end
+            super()._close()
+            if self.pool is not None:
+                self.pool.discard(self.connection)
+            return
+
+        try:
+            if self.connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                self.connection.rollback()
+        except base.Database.Error:
+            self.pool.discard(self.connection)
+            return
+        self.pool.put(self.connection)
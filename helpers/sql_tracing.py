@@ -0,0 +1,56 @@
+import re
+import time
+from collections import Counter
+
+from django.conf import settings
+
+from .logger import create_logger
+from .metrics import Counter as MetricsCounter
+
+sql_logger = create_logger('sql_logger')
+
+slow_queries = MetricsCounter('sql_slow_queries_total', 'Queries slower than the threshold', ['handler'])
+repeated_queries = MetricsCounter('sql_repeated_queries_total', 'Handler calls repeating the same query (N+1)',
+                                  ['handler'])
+
+UNSAFE_COMMENT_CHARACTERS = re.compile(r'[^\w.:-]')
+COMMENT_KEYS = ('handler', 'type', 'board')
+
+
+def sql_comment(context) -> str:
+    # only harmless characters, the comment must neither end early nor contain placeholders
+    items = (f"{key}={UNSAFE_COMMENT_CHARACTERS.sub('_', str(value))}"
+             for key, value in context.items() if key in COMMENT_KEYS and value is not None)
+    return f"/* {', '.join(items)} */ "
+
+
+class SqlTracer:
+    """
+    Execute wrapper tagging queries with the handler context, logging the slow ones
+    and counting identical statements to find N+1 patterns
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.comment = sql_comment(context)
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        self.statements[sql] += 1
+        started = time.perf_counter()
+        try:
+            return execute(self.comment + sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            if duration >= settings.SQL_TRACING['SLOW_QUERY_SECONDS']:
+                slow_queries.inc(handler=self.context['handler'])
+                sql_logger.warning(f"SLOW QUERY {duration * 1000:.1f}ms {self.context} {sql}")
+
+    def report_repeated(self):
+        threshold = settings.SQL_TRACING['REPEATED_QUERIES']
+        repeated = {sql: count for sql, count in self.statements.items() if count >= threshold}
+        if repeated:
+            repeated_queries.inc(handler=self.context['handler'])
+        for sql, count in repeated.items():
+            sql_logger.warning(f"REPEATED QUERY {count} times {self.context} {sql}")
+        return repeated
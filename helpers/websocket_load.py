@@ -0,0 +1,98 @@
+"""
+Websocket clients of bench_workers, free of Django so they run in processes of their own
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from autobahn.asyncio.websocket import WebSocketClientFactory, WebSocketClientProtocol
+
+
+class BenchClientProtocol(WebSocketClientProtocol):
+    """
+    Sends protocol_info and waits for the answer before the next one, at most `rate` times a second
+    """
+
+    def onOpen(self):
+        self.factory.opened.set_result(self)
+
+    def onMessage(self, payload, isBinary):
+        message = json.loads(payload)
+        if message['type'] == 'protocol_info' and self.factory.sent_at is not None:
+            self.factory.latencies.append((time.perf_counter() - self.factory.sent_at) * 1000)
+            self.factory.sent_at = None
+            self.factory.answered.set()
+        elif message.get('error_code') == 4429:
+            self.factory.throttled += 1
+
+    def onClose(self, wasClean, code, reason):
+        # the board is owned by another worker
+        self.factory.moved = code == 4307
+        if not self.factory.opened.done():
+            self.factory.opened.set_exception(ConnectionError(reason))
+        self.factory.answered.set()
+
+
+async def run_connection(port, path, rate, duration, timeout):
+    loop = asyncio.get_event_loop()
+    factory = WebSocketClientFactory(f"ws://127.0.0.1:{port}{path}")
+    factory.protocol = BenchClientProtocol
+    factory.opened = loop.create_future()
+    factory.answered = asyncio.Event()
+    factory.sent_at = None
+    factory.latencies = []
+    factory.throttled = 0
+    factory.moved = False
+
+    await loop.create_connection(factory, '127.0.0.1', port)
+    connection = await asyncio.wait_for(factory.opened, timeout)
+    # greetings of the connected users
+    await asyncio.sleep(1)
+
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline and not factory.moved:
+        next_at = time.perf_counter() + 1 / rate
+        factory.answered.clear()
+        factory.sent_at = time.perf_counter()
+        connection.sendMessage(json.dumps({'type': 'protocol_info'}).encode())
+        try:
+            await asyncio.wait_for(factory.answered.wait(), timeout)
+        except asyncio.TimeoutError:
+            factory.sent_at = None
+        await asyncio.sleep(max(next_at - time.perf_counter(), 0))
+    connection.sendClose()
+    return factory.latencies, factory.throttled, factory.moved
+
+
+def run_client_process(targets, rate, duration, timeout):
+    """
+    One connection to every (port, path) of the targets
+    """
+    async def run():
+        return await asyncio.gather(*[run_connection(port, path, rate, duration, timeout)
+                                      for port, path in targets], return_exceptions=True)
+
+    latencies, throttled, moved, failed = [], 0, 0, 0
+    for result in asyncio.run(run()):
+        if isinstance(result, BaseException):
+            failed += 1
+            continue
+        latencies += result[0]
+        throttled += result[1]
+        moved += result[2]
+    return latencies, throttled, moved, failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rate', type=float)
+    parser.add_argument('--duration', type=float)
+    parser.add_argument('--timeout', type=float)
+    arguments = parser.parse_args()
+    # JSON list of [port, path] of every connection
+    targets = json.load(sys.stdin)
+    latencies, throttled, moved, failed = run_client_process(targets, arguments.rate, arguments.duration,
+                                                             arguments.timeout)
+    print(json.dumps({'latencies': latencies, 'throttled': throttled, 'moved': moved, 'failed': failed}))
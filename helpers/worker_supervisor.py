@@ -0,0 +1,139 @@
+import http.client
+import os
+import signal
+import socket
+import subprocess
+import threading
+import time
+
+from .metrics import Counter, Gauge
+
+worker_restarts = Counter('runworkers_restarts_total', 'Worker processes started again after they exited', ['worker'])
+alive_workers = Gauge('runworkers_alive_workers', 'Running worker processes')
+
+
+class WorkerSlot:
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.started = None
+        self.crashes = 0  # exits in a row of workers which did not run for `stable_seconds`
+        self.restarts = 0
+        self.restart_at = 0
+        self.last_exit_code = None
+
+
+class WorkerSupervisor:
+    """
+    Keeps `workers` processes made by `command(index)` running. A worker which exits is started again
+    after `backoff_seconds` doubled for every crash in a row, up to `max_backoff_seconds`, while the others
+    go on serving. Stopping sends SIGTERM and kills the workers still running after `graceful_seconds`
+    """
+
+    def __init__(self, command, workers, env=None, pass_fds=(), cwd=None, backoff_seconds=1, max_backoff_seconds=30,
+                 stable_seconds=30, graceful_seconds=30, log=lambda message: None, clock=time.monotonic):
+        self.command = command
+        self.env = env or (lambda index: {})
+        self.pass_fds = tuple(pass_fds)
+        self.cwd = cwd
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.stable_seconds = stable_seconds
+        self.graceful_seconds = graceful_seconds
+        self.log = log
+        self.clock = clock
+
+        self.slots = [WorkerSlot(index) for index in range(workers)]
+        self._stopping = threading.Event()
+
+    def spawn(self, slot):
+        if slot.started is not None:
+            slot.restarts += 1
+            worker_restarts.inc(worker=slot.index)
+        slot.process = subprocess.Popen(self.command(slot.index), pass_fds=self.pass_fds, cwd=self.cwd,
+                                        env={**os.environ, **self.env(slot.index)})
+        slot.started = self.clock()
+        self.log(f"Worker {slot.index} started, pid {slot.process.pid}")
+
+    def check(self):
+        """
+        Notices exited workers and starts the ones whose backoff is over
+        """
+        now = self.clock()
+        for slot in self.slots:
+            if slot.process is not None and slot.process.poll() is not None:
+                slot.last_exit_code = slot.process.returncode
+                slot.process = None
+                slot.crashes = 0 if now - slot.started >= self.stable_seconds else slot.crashes + 1
+                delay = min(self.backoff_seconds * 2 ** (slot.crashes - 1), self.max_backoff_seconds) \
+                    if slot.crashes else 0
+                slot.restart_at = now + delay
+                self.log(f"Worker {slot.index} exited with {slot.last_exit_code}, starting it again in {delay}s")
+
+            if slot.process is None and not self._stopping.is_set() and now >= slot.restart_at:
+                self.spawn(slot)
+        alive_workers.set(sum(slot.process is not None for slot in self.slots))
+
+    def run(self, poll_seconds=0.5, on_tick=None):
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signal_number, lambda *args: self._stopping.set())
+        self.check()
+        while not self._stopping.wait(poll_seconds):
+            self.check()
+            if on_tick is not None:
+                on_tick()
+        self.stop()
+
+    def stop(self):
+        self._stopping.set()
+        running = [slot.process for slot in self.slots if slot.process is not None]
+        for process in running:
+            process.terminate()
+        deadline = self.clock() + self.graceful_seconds
+        for process in running:
+            try:
+                process.wait(max(deadline - self.clock(), 0))
+            except subprocess.TimeoutExpired:
+                self.log(f"Worker pid {process.pid} did not stop in {self.graceful_seconds}s, killing it")
+                process.kill()
+                process.wait()
+        for slot in self.slots:
+            slot.process = None
+        alive_workers.set(0)
+
+    def stats(self) -> list:
+        now = self.clock()
+        return [{'worker': slot.index,
+                 'pid': slot.process.pid if slot.process is not None else None,
+                 'uptime': round(now - slot.started, 1) if slot.process is not None else None,
+                 'restarts': slot.restarts,
+                 'last_exit_code': slot.last_exit_code}
+                for slot in self.slots]
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP over the private unix socket of a worker, requests to the shared socket reach any of them
+    """
+
+    def __init__(self, path, timeout=5):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def get_from_worker(path, url, headers=None, timeout=5):
+    """
+    Returns the status and the body of the response of the worker listening on the unix socket `path`
+    """
+    connection = UnixHTTPConnection(path, timeout)
+    try:
+        connection.request('GET', url, headers=headers or {})
+        response = connection.getresponse()
+        return response.status, response.read().decode()
+    finally:
+        connection.close()